@@ -10,24 +10,23 @@ from types import UnionType
 import typing
 from dataclasses import asdict, dataclass, field, is_dataclass
 from functools import lru_cache
-from typing import Any, Callable, Iterable, Literal, Optional, Self, Union, overload
+from typing import Any, Callable, Hashable, Iterable, Literal, Optional, Self, TypeVar, Union, overload
 
-import pythoncom
 import pywintypes
 import win32api
 import win32con
 import win32gui
 import win32process
-import wmi
 
+from geometry import DisplayGeometry, Rect, XandY, rect_fits
+from process import process_cache
 from win32_extras import DwmGetWindowAttribute, GetDpiForMonitor
 
 log = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
 # some basic types
-XandY = tuple[int, int]
-Rect = tuple[int, int, int, int]
-"""X, Y, X1, Y1"""
 Placement = tuple[int, int, XandY, XandY, Rect]
 """Flags, showCmd, min pos, max pos, normal pos"""
 
@@ -96,6 +95,52 @@ def match(a: Optional[int | str], b: Optional[int | str]) -> int:
     return 0
 
 
+def compile_match(a: Optional[int | str]) -> Callable[[Optional[int | str]], int]:
+    """
+    Precompile `a` for repeated use with `match`. Useful when matching the same pattern
+    against lots of values, since the regex only has to be compiled once.
+
+    Returns:
+        A function that takes `b` and returns the same score as `match(a, b)`
+    """
+    if a is None:
+        return lambda b: 1
+    if not isinstance(a, str):
+        return lambda b: match(a, b)
+
+    try:
+        pattern = re.compile(a, re.IGNORECASE)
+    except re.error:
+        log.exception(f'fail to compile pattern "{a}"')
+        pattern = None
+
+    def matcher(b: Optional[int | str]) -> int:
+        if b is None:
+            return 1
+        if a == b:
+            return 2
+        if pattern is None or not isinstance(b, str):
+            return 0
+        return 0 if pattern.match(b) is None else 1
+
+    return matcher
+
+
+def get_system_frame_thickness() -> int:
+    """
+    Get the size of the resizable border and drop shadow of windows, based on system metrics
+    """
+    return (
+        max(
+            win32api.GetSystemMetrics(win32con.SM_CXSIZEFRAME),
+            win32api.GetSystemMetrics(win32con.SM_CYSIZEFRAME),
+            # on my system, the total window border offset is 8px and CXSIZEFRAME is 4px. 2x seems to line up
+            # TODO: find a better way of getting this
+        )
+        * 2
+    )
+
+
 def str_to_op(op_name: str) -> Callable[[Any, Any], bool]:
     if op_name in ('lt', 'le', 'eq', 'ge', 'gt'):
         return getattr(operator, op_name)
@@ -166,9 +211,63 @@ def tuple_convert(item: Iterable, to=tuple, from_: type | UnionType = list):
     return item
 
 
+class Interner:
+    """
+    Deduplicates immutable values (strings and tuples), so that equal values loaded from disk or captured
+    from different windows share one object. The same executable paths, titles and rects repeat across
+    thousands of history entries.
+
+    Unlike `sys.intern`, the table is bounded. Once full it is cleared, which only stops new values
+    from being shared with values that were interned before the clear.
+    """
+
+    def __init__(self, max_size: int = 2**16):
+        self.max_size = max_size
+        self._table: dict[Hashable, Any] = {}
+
+    def __len__(self):
+        return len(self._table)
+
+    def intern(self, value: T) -> T:
+        """
+        Returns:
+            A previously interned value equal to `value`, or `value` itself. Unhashable values are returned as is
+        """
+        # include element types in the key so that, for example, `(1, True)` and `(1, 1)` stay distinct
+        key = (value, self._type_key(value)) if isinstance(value, tuple) else value
+        try:
+            return self._table[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return value
+        if len(self._table) >= self.max_size:
+            self._table.clear()
+        self._table[key] = value
+        return value
+
+    @classmethod
+    def _type_key(cls, value: tuple) -> tuple:
+        return tuple(cls._type_key(v) if isinstance(v, tuple) else type(v) for v in value)
+
+    def clear(self):
+        self._table.clear()
+
+
+interner = Interner()
+
+
 class JSONType:
     @classmethod
-    def from_json(cls, data: dict) -> Self | None:
+    def from_json(cls, data: dict, memo: Optional[dict[int, Any]] = None) -> Self | None:
+        """
+        Args:
+            data: the JSON data to build the instance from
+            memo: if given, the same object is returned for every occurrence of the same `data` dict.
+                Keyed by `id`, so `data` must be kept alive while the memo is in use
+        """
+        if memo is not None and (cached := memo.get(id(data))) is not None:
+            return cached
         if is_dataclass(data):
             if isinstance(data, type):
                 # check if just the type itself, not an actual instance
@@ -187,7 +286,7 @@ class JSONType:
                 continue
             sub_types = typing.get_args(field_type)
             if sub_types and issubclass(sub_types[0], JSONType):
-                value = field_type(filter(None, (sub_types[0].from_json(i) for i in data[field_name])))
+                value = field_type(filter(None, (sub_types[0].from_json(i, memo) for i in data[field_name])))
             elif sub_types:
                 value = tuple_convert(data[field_name], to=field_type, from_=tuple | list)
                 if isinstance(value, tuple):
@@ -199,18 +298,87 @@ class JSONType:
                         pass
             else:
                 if issubclass(field_type, JSONType):
-                    value = field_type.from_json(data[field_name])
+                    value = field_type.from_json(data[field_name], memo)
                 else:
                     try:
                         value = field_type(data[field_name])
                     except TypeError:
                         value = data[field_name]
+            if isinstance(value, (str, tuple)):
+                value = interner.intern(value)
             init_data[field_name] = value
 
         try:
-            return cls(**init_data)
+            instance = cls(**init_data)
         except TypeError:
             return None
+        if memo is not None:
+            memo[id(data)] = instance
+        return instance
+
+
+class CaptureContext:
+    """
+    Memoises Win32 window queries for the lifetime of a single capture, restore or rescue pass, so that
+    validity checks and `Window` construction don't keep asking Windows for the same information.
+
+    Window state can change at any moment, so contexts should be short-lived. Using a context as a
+    context manager makes it the active context for the current thread (see `CaptureContext.current`).
+    """
+
+    _active = threading.local()
+
+    def __init__(self):
+        self._cache: dict[tuple, Any] = {}
+        self._previous: Optional[CaptureContext] = None
+
+    def __enter__(self) -> Self:
+        self._previous = getattr(self._active, 'ctx', None)
+        self._active.ctx = self
+        return self
+
+    def __exit__(self, *_):
+        self._active.ctx = self._previous
+        self._previous = None
+
+    @classmethod
+    def current(cls) -> 'CaptureContext':
+        """
+        Returns:
+            The active context for the current thread, or a new, throwaway context if there isn't one
+        """
+        return getattr(cls._active, 'ctx', None) or cls()
+
+    def query(self, func: Callable[..., T], hwnd: int, *args) -> T:
+        """
+        Call `func(hwnd, *args)`, or return the result of a previous identical call.
+        Exceptions are not cached.
+        """
+        key = (func, hwnd, *args)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        value = self._cache[key] = func(hwnd, *args)
+        return value
+
+    def get_pid(self, hwnd: int) -> int:
+        return self.query(win32process.GetWindowThreadProcessId, hwnd)[1]
+
+    def get_placement(self, hwnd: int) -> Placement:
+        return self.query(win32gui.GetWindowPlacement, hwnd)
+
+    def get_rect(self, hwnd: int) -> Rect:
+        return self.query(win32gui.GetWindowRect, hwnd)
+
+    def get_style(self, hwnd: int) -> int:
+        return self.query(win32gui.GetWindowLong, hwnd, win32con.GWL_STYLE)
+
+    def get_text(self, hwnd: int) -> str:
+        return self.query(win32gui.GetWindowText, hwnd)
+
+    def is_window(self, hwnd: int) -> bool:
+        return self.query(win32gui.IsWindow, hwnd)
 
 
 @dataclass
@@ -219,14 +387,18 @@ class WindowType(JSONType):
     rect: Rect
     placement: Placement
 
-    def fits_display(self, display: 'Display') -> bool:
+    def fits_display(self, display: 'Display', geometry: Optional[DisplayGeometry] = None) -> bool:
         """
         Check whether `self` fits within the bounds of a display. This function uses
         `fits_rect` internally.
+
+        Args:
+            display: the display to check against
+            geometry: the current display geometry, used to avoid querying system metrics
         """
         # define constant offset because window rects include the drop shadow, but
         # display rects don't.
-        return self.fits_rect(display.rect, offset=self.get_border_and_shadow_thickness())
+        return self.fits_rect(display.rect, offset=self.get_border_and_shadow_thickness(geometry))
 
     def fits_rect(self, target_rect: Rect, offset: Optional[int] = None) -> bool:
         """
@@ -247,43 +419,45 @@ class WindowType(JSONType):
             else:
                 offset = 0
 
-        return (
-            self.rect[0] >= target_rect[0] - offset
-            and self.rect[1] >= target_rect[1] - offset
-            and self.rect[2] <= target_rect[2] + offset
-            and self.rect[3] <= target_rect[3] + offset
-        )
+        return rect_fits(self.rect, target_rect, offset)
 
-    def fits_display_config(self, displays: list['Display']) -> bool:
-        return any(self.fits_display(d) for d in displays)
+    def fits_display_config(self, displays: list['Display'], geometry: Optional[DisplayGeometry] = None) -> bool:
+        if not displays:
+            return False
+        # the offset is the same for every display, so only work it out once
+        offset = self.get_border_and_shadow_thickness(geometry)
+        return any(self.fits_rect(d.rect, offset=offset) for d in displays)
 
-    def get_closest_display_rect(self, coords: XandY) -> Rect:
+    def get_closest_display_rect(self, coords: XandY, geometry: Optional[DisplayGeometry] = None) -> Rect:
         """
         Get the `Rect` of the display that contains (or is closest to) a set of coordinates.
 
+        Args:
+            coords: the coordinates
+            geometry: the current display geometry. If not given, the system is queried instead
+
         Returns:
             A rect of the display, excluding the Windows taskbar.
         """
-        display = win32api.MonitorFromPoint(coords, win32con.MONITOR_DEFAULTTONEAREST)
         # use working area rather than total monitor area so we don't move window into the taskbar
+        if geometry is not None and (work := geometry.work_area(coords)) is not None:
+            return work
+        display = win32api.MonitorFromPoint(coords, win32con.MONITOR_DEFAULTTONEAREST)
         return win32api.GetMonitorInfo(display)['Work']
 
-    def get_border_and_shadow_thickness(self):
+    def get_border_and_shadow_thickness(self, geometry: Optional[DisplayGeometry] = None):
         """
         Get the size of the window's resizable border and drop shadow in pixels.
 
         For `WindowType` objects, this is based on system metrics, not on the window itself.
         See also: `Window.get_border_and_shadow_thickness`
+
+        Args:
+            geometry: the current display geometry, which caches the system metrics
         """
-        return (
-            max(
-                win32api.GetSystemMetrics(win32con.SM_CXSIZEFRAME),
-                win32api.GetSystemMetrics(win32con.SM_CYSIZEFRAME),
-                # on my system, the total window border offset is 8px and CXSIZEFRAME is 4px. 2x seems to line up
-                # TODO: find a better way of getting this
-            )
-            * 2
-        )
+        if geometry is not None:
+            return geometry.frame_thickness
+        return get_system_frame_thickness()
 
 
 @dataclass(slots=True)
@@ -294,8 +468,9 @@ class Window(WindowType):
     resizable: bool = True
 
     def __post_init__(self):
-        if win32gui.IsWindow(self.id):
-            self.resizable = self.is_resizable()
+        ctx = CaptureContext.current()
+        if ctx.is_window(self.id):
+            self.resizable = bool(ctx.get_style(self.id) & win32con.WS_THICKFRAME)
 
     @property
     def parent(self) -> Optional['Window']:
@@ -304,7 +479,7 @@ class Window(WindowType):
             return None
         return self.from_hwnd(p_id)
 
-    def center_on(self, coords: XandY):
+    def center_on(self, coords: XandY, geometry: Optional[DisplayGeometry] = None):
         """
         Centers the window around a point, making sure to keep it on screen
         """
@@ -312,7 +487,7 @@ class Window(WindowType):
         w, h = self.get_size()
         x = coords[0] - (w // 2)
         y = coords[1] - (h // 2)
-        self.move(self.rebound((x, y)))
+        self.move(self.rebound((x, y), geometry=geometry))
 
     def focus(self):
         """
@@ -324,22 +499,25 @@ class Window(WindowType):
         win32gui.ShowWindow(self.id, win32con.SW_SHOWNORMAL)
 
     @classmethod
-    def from_hwnd(cls, hwnd: int) -> 'Window':
-        if threading.current_thread() != threading.main_thread():
-            pythoncom.CoInitialize()
-        w = wmi.WMI()
-        # https://stackoverflow.com/a/14973422
-        _, pid = win32process.GetWindowThreadProcessId(hwnd)
-        exe = w.query(f'SELECT ExecutablePath FROM Win32_Process WHERE ProcessId = {pid}')[0]
-        rect = win32gui.GetWindowRect(hwnd)
+    def from_hwnd(cls, hwnd: int, executable: Optional[str] = None, ctx: Optional[CaptureContext] = None) -> 'Window':
+        """
+        Args:
+            hwnd: the window handle
+            executable: the executable path of the owning process, if already known
+            ctx: context to read window info from. Defaults to the active context, if any
+        """
+        ctx = ctx or CaptureContext.current()
+        if executable is None:
+            executable = process_cache.get_executable(ctx.get_pid(hwnd))
+        rect = interner.intern(ctx.get_rect(hwnd))
 
         return Window(
             id=hwnd,
-            name=win32gui.GetWindowText(hwnd),
-            executable=exe.ExecutablePath,
-            size=size_from_rect(rect),
+            name=interner.intern(ctx.get_text(hwnd)),
+            executable=interner.intern(executable),
+            size=interner.intern(size_from_rect(rect)),
             rect=rect,
-            placement=win32gui.GetWindowPlacement(hwnd),
+            placement=interner.intern(ctx.get_placement(hwnd)),
         )
 
     def get_placement(self) -> Placement:
@@ -392,19 +570,34 @@ class Window(WindowType):
         self.refresh()
 
     @overload
-    def rebound(self, coords: XandY, to_rect: Optional[Rect] = None, offset: int = 0) -> XandY:
-        ...
+    def rebound(
+        self,
+        coords: XandY,
+        to_rect: Optional[Rect] = None,
+        offset: int = 0,
+        geometry: Optional[DisplayGeometry] = None,
+    ) -> XandY: ...
 
     @overload
-    def rebound(self, coords: Rect, to_rect: Optional[Rect] = None, offset: int = 0) -> Rect:
-        ...
-
-    def rebound(self, coords: XandY | Rect, to_rect: Optional[Rect] = None, offset: int = 0) -> XandY | Rect:
+    def rebound(
+        self, coords: Rect, to_rect: Optional[Rect] = None, offset: int = 0, geometry: Optional[DisplayGeometry] = None
+    ) -> Rect: ...
+
+    def rebound(
+        self,
+        coords: XandY | Rect,
+        to_rect: Optional[Rect] = None,
+        offset: int = 0,
+        geometry: Optional[DisplayGeometry] = None,
+    ) -> XandY | Rect:
         """
         Takes a set of coordinates and moves them so that the window will not appear off-screen
 
         Args:
             coords: can be coordinates (top left) or a rect
+            to_rect: the rect to keep the window within. Defaults to the closest display
+            offset: how far the window may overhang the edges of `to_rect`
+            geometry: the current display geometry, used to find the closest display
 
         Returns:
             same type as input. Returned rects will also have the bottom right coord adjusted
@@ -419,7 +612,7 @@ class Window(WindowType):
             w, h = self.get_size()
             rx, ry = x + w, y + h
 
-        display_rect = to_rect or self.get_closest_display_rect((x, y))
+        display_rect = to_rect or self.get_closest_display_rect((x, y), geometry)
         dx, dy, drx, dry = display_rect
 
         # adjust top left
@@ -443,25 +636,32 @@ class Window(WindowType):
         self.name = win32gui.GetWindowText(self.id)
         self.resizable = self.is_resizable()
 
-    def set_pos(self, rect: Rect, placement: Optional[Placement] = None):
+    def set_pos(self, rect: Rect, placement: Optional[Placement] = None, geometry: Optional[DisplayGeometry] = None):
         """
         Set the position, size and placement of the window
+
+        Args:
+            rect: the new window rect
+            placement: the new window placement
+            geometry: the current display geometry. If not given, the system is queried instead
         """
         try:
             # adjust the offset for the monitor that the window is going to end up on, since it might change
             # if that monitor's DPI is different
-            target_display_dpi = GetDpiForMonitor(
-                win32api.MonitorFromPoint(rect[:2], win32con.MONITOR_DEFAULTTONEAREST).handle  # type: ignore
-            )
+            if geometry:
+                target_display_dpi = geometry.dpi(rect[:2])
+            else:
+                target_display_dpi = GetDpiForMonitor(
+                    win32api.MonitorFromPoint(rect[:2], win32con.MONITOR_DEFAULTTONEAREST).handle  # type: ignore
+                )
             offset = dpi_scale(self.get_border_and_shadow_thickness(), target_display_dpi)
 
             # check if Window will fit on the Display it's being moved to. If not, adjust the rect to fit
             # use center point because top left might be out of bounds due to drop shadow and offset, which may
             # lead to `MONITOR_DEFAULTTONEAREST` picking the wrong display
-            target_display_rect = self.get_closest_display_rect((
-                rect[0] + (size_from_rect(rect)[0] // 2),
-                rect[1] + (size_from_rect(rect)[1] // 2)
-            ))
+            target_display_rect = self.get_closest_display_rect(
+                (rect[0] + (size_from_rect(rect)[0] // 2), rect[1] + (size_from_rect(rect)[1] // 2)), geometry
+            )
             rect = self.rebound(rect, to_rect=target_display_rect, offset=offset)
 
             resizable = self.is_resizable()
@@ -489,12 +689,12 @@ class Window(WindowType):
         except pywintypes.error as e:
             log.error('err moving window %s : %s' % (win32gui.GetWindowText(self.id), e))
 
-    def get_border_and_shadow_thickness(self):
+    def get_border_and_shadow_thickness(self, geometry: Optional[DisplayGeometry] = None):
         """
         Get the size of the window's resizable border and drop shadow in pixels.
 
         Unlike `WindowType.get_border_and_shadow_thickness`, this function is based on the actual
-        shadow size of the window subject to the DPI of the monitor the window is on.
+        shadow size of the window subject to the DPI of the monitor the window is on, so `geometry` is unused.
         """
         # DWMWA_EXTENDED_FRAME_BOUNDS = 9 says every StackOverflow answer, and it's the 9th item in this enum:
         # https://learn.microsoft.com/en-us/windows/win32/api/dwmapi/ne-dwmapi-dwmwindowattribute
@@ -506,8 +706,28 @@ class Window(WindowType):
         return abs(max(efb_rect[i] - win32gui.GetWindowRect(self.id)[i] for i in range(4)))
 
 
+class Revisioned:
+    """
+    Counts assignments to public attributes, so that changes can be detected without comparing contents.
+    In-place changes, such as appending to a list attribute, are not detected and must be followed by `touch`
+    """
+
+    def __setattr__(self, name: str, value):
+        super().__setattr__(name, value)
+        if name[0] != '_':
+            self.touch()
+
+    @property
+    def revision(self) -> int:
+        return getattr(self, '_revision', 0)
+
+    def touch(self):
+        """Mark the object as changed"""
+        object.__setattr__(self, '_revision', self.revision + 1)
+
+
 @dataclass(slots=True)
-class WindowHistory(JSONType):
+class WindowHistory(Revisioned, JSONType):
     time: float
     windows: list[Window] = field(default_factory=list)
 
@@ -525,29 +745,72 @@ class Display(JSONType):
     """
 
     def matches(self, display: 'Display'):
+        return self.get_matcher().matches(display)
+
+    def matches_config(self, config: list['Display']):
+        matcher = self.get_matcher()
+        return any(matcher.matches(d) for d in config)
+
+    def get_matcher(self) -> 'DisplayMatcher':
+        """
+        Returns:
+            A compiled matcher for this display. This is cached, so `invalidate_matcher` must be
+            called after editing the display
+        """
+        matcher = getattr(self, '_matcher', None)
+        if matcher is None:
+            matcher = self._matcher = DisplayMatcher(self)
+        return matcher
+
+    def invalidate_matcher(self):
+        self._matcher = None
+
+    def set_res(self, index, value):
+        res = list(self.resolution)
+        res[index] = value
+        self.resolution = tuple(res)  # type: ignore
+        self.invalidate_matcher()
+
+
+class DisplayMatcher:
+    """
+    Precompiled form of `Display.matches`, with the UID and name regexes and the resolution
+    comparison operators built ahead of time
+    """
+
+    __slots__ = ('name', 'ops', 'resolution', 'uid')
+
+    def __init__(self, display: Display):
+        self.uid = compile_match(display.uid)
+        self.name = compile_match(display.name)
+        self.resolution: tuple[int, ...] = tuple(display.resolution)
+        self.ops = tuple(map(str_to_op, display.comparison_params.get('resolution', ('eq', 'eq'))))
+
+    def matches(self, display: Display) -> bool:
         # check UIDs
-        if display.uid and not match(self.uid, display.uid):
+        if display.uid and not self.uid(display.uid):
             return False
         # check names
-        if display.name and not match(self.name, display.name):
+        if display.name and not self.name(display.name):
             return False
         # check resolution
-        for index, metric in enumerate(zip(display.resolution, self.resolution)):
+        for op, metric in zip(self.ops, zip(display.resolution, self.resolution)):
             if 0 in metric:
                 continue
-            op = self.comparison_params.get('resolution', ('eq', 'eq'))[index]
-            if not str_to_op(op)(*metric):
+            if not op(*metric):
                 return False
-        else:
-            return True
+        return True
 
-    def matches_config(self, config: list['Display']):
-        return any(self.matches(d) for d in config)
 
-    def set_res(self, index, value):
-        res = list(self.resolution)
-        res[index] = value
-        self.resolution = tuple(res)  # type: ignore
+DisplayFingerprint = tuple[tuple[str, str, XandY, Rect], ...]
+
+
+def display_fingerprint(displays: Iterable[Display]) -> DisplayFingerprint:
+    """
+    Returns:
+        A hashable identifier for a display configuration, which does not depend on the order of the displays
+    """
+    return tuple(sorted((d.uid, d.name, tuple(d.resolution), tuple(d.rect)) for d in displays))
 
 
 @dataclass(slots=True)
@@ -562,8 +825,115 @@ class Rule(WindowType):
             self.rule_name = 'Unnamed rule'
 
 
+class LKPNode:
+    __slots__ = ('children', 'latest')
+
+    def __init__(self):
+        self.children: dict[str, LKPNode] = {}
+        self.latest: dict[bool, tuple[int, Window]] = {}
+        """The most recently added window for each resizability, along with when it was added"""
+
+    def add(self, seq: int, window: Window):
+        self.latest[bool(window.resizable)] = (seq, window)
+
+    def get(self, resizable: Optional[bool] = None) -> Optional[Window]:
+        """
+        Args:
+            resizable: only return windows with this resizability. Set to None to ignore
+        """
+        if resizable is None:
+            entry = max(self.latest.values(), default=None, key=lambda e: e[0])
+        else:
+            entry = self.latest.get(bool(resizable))
+        return None if entry is None else entry[1]
+
+
+class LKPIndex:
+    """
+    Indexes the windows in a window history by executable, so that the last known instance of a
+    process can be found without searching the whole history. Titles are indexed by their words in
+    reverse order, so the closest title match can be found by walking down the tree.
+    """
+
+    def __init__(self):
+        self._seq = 0
+        self._roots: dict[str, LKPNode] = {}
+        self._exact: dict[tuple[str, str], LKPNode] = {}
+        self._synced: list[tuple[int, int]] = []
+        """ID and length of the window list of each history entry, as of the last sync"""
+
+    def add(self, window: Window):
+        self._seq += 1
+        node = self._roots.setdefault(window.executable, LKPNode())
+        node.add(self._seq, window)
+        for word in reversed(window.name.split()):
+            node = node.children.setdefault(word, LKPNode())
+            node.add(self._seq, window)
+        self._exact.setdefault((window.executable, window.name), LKPNode()).add(self._seq, window)
+
+    def clear(self):
+        self._seq = 0
+        self._roots.clear()
+        self._exact.clear()
+        self._synced = []
+
+    def sync(self, history: list['WindowHistory']):
+        """
+        Bring the index up to date with the history. If the history has only been added to since the
+        last sync then just the new windows are indexed, otherwise the whole index is rebuilt.
+        """
+        state = [(id(h.windows), len(h.windows)) for h in history]
+        if state == self._synced:
+            return
+        old = self._synced
+        last = len(old) - 1
+        appended = (
+            last >= 0
+            and len(state) >= len(old)
+            and state[:last] == old[:last]
+            and state[last][0] == old[last][0]
+            and state[last][1] >= old[last][1]
+        )
+        if appended:
+            first = last
+        else:
+            # entries have been removed or replaced (squash, cleanup etc), so start again
+            self.clear()
+            old, first = [], 0
+
+        for index in range(first, len(history)):
+            start = old[index][1] if index < len(old) else 0
+            for window in history[index].windows[start:]:
+                self.add(window)
+        self._synced = state
+
+    def find(self, window: Window, match_title=False, match_resizability=True) -> Optional[Window]:
+        """
+        Returns:
+            The most recent window from the same executable. If `match_title` is set, windows whose
+            titles share the most trailing words with `window` are prioritised, with exact matches first
+        """
+        resizable = window.resizable if match_resizability else None
+        if match_title and (exact := self._exact.get((window.executable, window.name))):
+            if (found := exact.get(resizable)) is not None:
+                return found
+
+        node = self._roots.get(window.executable)
+        if node is None:
+            return None
+        best = node.get(resizable)
+        if match_title:
+            for word in reversed(window.name.split()):
+                node = node.children.get(word)
+                if node is None:
+                    break
+                # deeper nodes share more words with the title, so prefer them
+                best = node.get(resizable) or best
+        return best
+
+
 @dataclass(slots=True)
-class Snapshot(JSONType):
+class Snapshot(Revisioned, JSONType):
     displays: list[Display] = field(default_factory=list)
     history: list[WindowHistory] = field(default_factory=list)
     mru: float | None = None
@@ -575,6 +945,13 @@ class Snapshot(JSONType):
     this class and members of another class
     """
 
+    def content_revision(self) -> tuple:
+        """
+        Returns:
+            A value that changes whenever this snapshot or any of its captures are changed. See `Revisioned`
+        """
+        return self.revision, tuple((id(entry), entry.revision) for entry in self.history)
+
     def cleanup(self, prune=True, ttl=0, maximum=10):
         """
         Perform a variety of operations to clean up the window history
@@ -592,7 +969,7 @@ class Snapshot(JSONType):
             self.history = self.history[-maximum:]
 
     @classmethod
-    def from_json(cls, data: dict) -> Optional['Snapshot']:
+    def from_json(cls, data: dict, memo: Optional[dict[int, Any]] = None) -> Optional['Snapshot']:
         """
         Returns:
             A new snapshot, or None if `data` is falsey
@@ -612,35 +989,23 @@ class Snapshot(JSONType):
                 else:
                     data['phony'] = 'Unnamed Layout'
 
-        return super(cls, cls).from_json(data)
+        return super(cls, cls).from_json(data, memo)
 
     def last_known_process_instance(self, window: Window, match_title=False, match_resizability=True) -> Window | None:
-        def compare_titles(base: str, other: str):
-            base_chunks = base.split()
-            if base == other:
-                # return number of chunks plus one to ensure exact matches get highest score
-                return len(base_chunks) + 1
-            score = 0
-            for a, b in zip(reversed(base_chunks), reversed(other.split())):
-                if a != b:
-                    return score
-                score += 1
-            return score
-
-        contenders: list[Window] = []
-        for history in reversed(self.history):
-            for archived in reversed(history.windows):
-                if archived.executable == window.executable:
-                    contenders.append(archived)
-
-        if match_resizability:
-            contenders = [c for c in contenders if c.resizable == window.resizable]
-
-        if match_title:
-            contenders.sort(key=lambda x: compare_titles(window.name, x.name), reverse=True)
+        """
+        Find the most recent window in the history that came from the same executable as `window`.
 
-        if contenders:
-            return contenders[0]
+        Args:
+            window: the window to find a previous instance of
+            match_title: prefer windows whose titles share the most trailing words with `window`
+            match_resizability: only return windows with the same resizability as `window`
+        """
+        # not a dataclass field, so that it doesn't get serialised
+        index: Optional[LKPIndex] = getattr(self, '_lkp_index', None)
+        if index is None:
+            index = self._lkp_index = LKPIndex()
+        index.sync(self.history)
+        return index.find(window, match_title=match_title, match_resizability=match_resizability)
 
     # use union because `|` doesn't like string forward refs
     def matches_display_config(self, config: Union[list[Display], 'Snapshot']) -> bool:
@@ -675,33 +1040,45 @@ class Snapshot(JSONType):
         """
 
         def should_keep(window: Window) -> bool:
-            try:
-                if prune:
-                    return (
-                        # window exists and hwnd still belongs to same process
-                        win32gui.IsWindow(window.id) == 1
-                        and window.id in exe_by_id
-                        and window.executable == exe_by_id[window.id]
-                    )
+            if prune:
                 return (
-                    # hwnd is not in use by another window
-                    window.id not in exe_by_id or window.executable == exe_by_id[window.id]
+                    # window exists and hwnd still belongs to same process
+                    window.id in alive and window.id in exe_by_id and window.executable == exe_by_id[window.id]
                 )
-            except Exception:
-                return False
+            return (
+                # hwnd is not in use by another window
+                window.id not in exe_by_id or window.executable == exe_by_id[window.id]
+            )
+
+        if len(self.history) < 2:
+            return
+
+        alive: set[int] = set()
+        if prune:
+            # check each hwnd once up front, rather than every time a capture is filtered
+            for hwnd in {window.id for history in self.history for window in history.windows}:
+                try:
+                    if win32gui.IsWindow(hwnd) == 1:
+                        alive.add(hwnd)
+                except pywintypes.error as e:
+                    log.debug(f'could not check whether window {hwnd} exists: {e}')
 
         index = len(self.history) - 1
-        exe_by_id = {}
+        exe_by_id: dict[int, str] = {}
+        # the lists that have already been filtered, so that we don't filter them again on the next iteration
+        filtered: tuple[list[Window], ...] = ()
         while index > 0:
+            conflict = False
             for window in self.history[index].windows:
-                if window.id not in exe_by_id:
-                    try:
-                        exe_by_id[window.id] = window.executable
-                    except KeyError:
-                        pass
+                if exe_by_id.setdefault(window.id, window.executable) != window.executable:
+                    conflict = True
 
-            current = self.history[index].windows = list(filter(should_keep, self.history[index].windows))
+            current = self.history[index].windows
+            # filtering again only has an effect if a hwnd was re-used within this capture
+            if conflict or not any(current is f for f in filtered):
+                current = self.history[index].windows = list(filter(should_keep, current))
             previous = self.history[index - 1].windows = list(filter(should_keep, self.history[index - 1].windows))
+            filtered = (current, previous)
 
             if len(current) > len(previous):
                 # if current is greater but contains all the items of previous
@@ -712,22 +1089,20 @@ class Snapshot(JSONType):
                 smaller, greater = current, previous
                 to_pop = index
 
-            for window_a in smaller:
-                if window_a in greater:
-                    continue
-
-                for window_b in greater:
-                    if (
-                        window_a.id == window_b.id
-                        and window_a.rect == window_b.rect
-                        and window_a.placement == window_b.placement
-                    ):
-                        break
-                else:
-                    break
+            # windows are deemed the same if they have the same hwnd and position. Captures share
+            # `Window` instances for windows that haven't changed, so check by identity first
+            greater_ids = set(map(id, greater))
+            rest = [w for w in smaller if id(w) not in greater_ids]
+            if rest:
+                hwnds = {w.id for w in rest}
+                greater_prints = {(w.id, w.rect, w.placement) for w in greater if w.id in hwnds}
+                squash = all((w.id, w.rect, w.placement) in greater_prints for w in rest)
             else:
-                # successful loop, all items in smaller are already present in greater.
-                # remove smaller
+                squash = True
+
+            if squash:
+                # all items in smaller are already present in greater. Remove smaller
                 self.history.pop(to_pop)
+                self.touch()
 
             index -= 1
@@ -9,11 +9,20 @@ import win32gui_struct
 from services import Service, ServiceCallback
 
 GUID_DEVINTERFACE_DISPLAY_DEVICE = '{E6F07B5F-EE97-4a90-B076-33F57BF4EAA7}'
+WM_DPICHANGED = 0x02E0
+SPI_SETLOGICALDPIOVERRIDE = 0x009F
+GEOMETRY_SETTINGS = (win32con.SPI_SETWORKAREA, win32con.SPI_SETNONCLIENTMETRICS, SPI_SETLOGICALDPIOVERRIDE)
+"""`WM_SETTINGCHANGE` actions that change the work area, border sizes or scaling of the displays"""
 
 
 @dataclass(slots=True)
 class DeviceChangeCallback(ServiceCallback):
     capture: Optional[Callable] = None
+    display_change: Optional[Callable] = None
+    """
+    Called when the display configuration may have changed, before the default callback.
+    Also called on its own when only the work area, border sizes or scaling may have changed
+    """
 
 
 class DeviceChangeService(Service):
@@ -40,8 +49,17 @@ class DeviceChangeService(Service):
 
             self.log.info('trigger PBT_APMRESUME[AUTOMATIC|CRITICAL|STANDBY|SUSPEND] signal')
             time.sleep(1)
+            self._run_callback('display_change')
         elif msg == win32con.WM_DISPLAYCHANGE:
             self.log.info('trigger WM_DISPLAYCHANGE')
+            self._run_callback('display_change')
+        elif msg == WM_DPICHANGED or (msg == win32con.WM_SETTINGCHANGE and wp in GEOMETRY_SETTINGS):
+            # windows stay where they are, but cached work areas and DPIs are now out of date
+            self.log.info(f'invalidate display geometry due to {msg=:x} {wp=:x}')
+            self._run_callback('display_change')
+            return False
+        elif msg == win32con.WM_SETTINGCHANGE:
+            return False
         elif msg == win32con.WM_WINDOWPOSCHANGING:
             self.log.info('trigger WM_WINDOWPOSCHANGING')
         else:
@@ -59,6 +77,8 @@ class DeviceChangeService(Service):
             win32con.WM_DISPLAYCHANGE: self.callback,
             win32con.WM_WINDOWPOSCHANGING: self.callback,
             win32con.WM_POWERBROADCAST: self.callback,
+            win32con.WM_SETTINGCHANGE: self.callback,
+            WM_DPICHANGED: self.callback,
             win32con.WM_CLOSE: self.callback,
         }
         win32gui.RegisterClass(wc)
@@ -0,0 +1,112 @@
+"""
+Pure Python model of the display layout, so that geometry queries can be answered without calling into Windows.
+"""
+
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+XandY = tuple[int, int]
+Rect = tuple[int, int, int, int]
+"""X, Y, X1, Y1"""
+
+
+def rect_fits(rect: Rect, target_rect: Rect, offset: int = 0) -> bool:
+    """
+    Whether `rect` lies within `target_rect`, allowing it to overhang each edge by `offset` pixels
+    """
+    return (
+        rect[0] >= target_rect[0] - offset
+        and rect[1] >= target_rect[1] - offset
+        and rect[2] <= target_rect[2] + offset
+        and rect[3] <= target_rect[3] + offset
+    )
+
+
+@dataclass(slots=True, frozen=True)
+class Monitor:
+    rect: Rect
+    work: Rect
+    """The monitor rect, excluding the taskbar and any other app bars"""
+    dpi: int = 96
+
+    def contains(self, point: XandY) -> bool:
+        return self.rect[0] <= point[0] < self.rect[2] and self.rect[1] <= point[1] < self.rect[3]
+
+    def distance(self, point: XandY) -> int:
+        """
+        Returns:
+            The squared distance from the point to the nearest edge of the monitor, or 0 if it is on the monitor
+        """
+        dx = max(self.rect[0] - point[0], 0, point[0] - (self.rect[2] - 1))
+        dy = max(self.rect[1] - point[1], 0, point[1] - (self.rect[3] - 1))
+        return dx * dx + dy * dy
+
+
+class DisplayGeometry:
+    """
+    An immutable snapshot of the monitors attached to the system. Monitors are indexed by
+    vertical strips between their left and right edges, so finding the monitor under a point
+    only needs to check the monitors that overlap that strip.
+    """
+
+    __slots__ = ('_edges', '_strips', 'frame_thickness', 'monitors')
+
+    def __init__(self, monitors: Iterable[Monitor], frame_thickness: int = 0):
+        """
+        Args:
+            monitors: the monitors, primary first
+            frame_thickness: size of the system resizable border and drop shadow, in pixels
+        """
+        self.monitors: tuple[Monitor, ...] = tuple(monitors)
+        self.frame_thickness = frame_thickness
+        self._edges: list[int] = sorted({m.rect[0] for m in self.monitors} | {m.rect[2] for m in self.monitors})
+        # strip `i` covers `_edges[i] <= x < _edges[i + 1]`
+        self._strips: list[tuple[Monitor, ...]] = [
+            tuple(m for m in self.monitors if m.rect[0] <= edge < m.rect[2]) for edge in self._edges
+        ]
+
+    def __len__(self):
+        return len(self.monitors)
+
+    def monitor_from_point(self, point: XandY) -> Optional[Monitor]:
+        """
+        Get the monitor that contains a point, or the closest one if the point is off-screen.
+        Equivalent to `MonitorFromPoint` with `MONITOR_DEFAULTTONEAREST`.
+
+        Returns:
+            The monitor, or None if there are no monitors
+        """
+        index = bisect_right(self._edges, point[0]) - 1
+        if 0 <= index < len(self._strips):
+            for monitor in self._strips[index]:
+                if monitor.contains(point):
+                    return monitor
+        return min(self.monitors, key=lambda m: m.distance(point), default=None)
+
+    def work_area(self, point: XandY) -> Optional[Rect]:
+        """
+        Returns:
+            The work area of the monitor closest to a point
+        """
+        monitor = self.monitor_from_point(point)
+        return None if monitor is None else monitor.work
+
+    def dpi(self, point: XandY) -> int:
+        """
+        Returns:
+            The DPI of the monitor closest to a point
+        """
+        monitor = self.monitor_from_point(point)
+        return 96 if monitor is None else monitor.dpi
+
+    def fits(self, rect: Rect, offset: Optional[int] = None) -> bool:
+        """
+        Whether a rect lies entirely within any one monitor
+
+        Args:
+            rect: the rect to check
+            offset: how far the rect may overhang each monitor edge. Defaults to `frame_thickness`
+        """
+        offset = self.frame_thickness if offset is None else offset
+        return any(rect_fits(rect, m.rect, offset) for m in self.monitors)
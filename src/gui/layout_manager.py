@@ -78,10 +78,11 @@ class EditResolutionWindow(Frame):
 
 
 class DisplayManager(wx.StaticBox):
-    def __init__(self, parent: wx.Frame | wx.Panel, layout: Snapshot, **kwargs):
+    def __init__(self, parent: wx.Frame | wx.Panel, layout: Snapshot, on_change: Optional[Callable] = None, **kwargs):
         wx.StaticBox.__init__(self, parent, **kwargs)
         self.layout = layout
         self.displays = layout.displays
+        self.on_change = on_change
 
         # create action buttons
         action_panel = wx.Panel(self)
@@ -138,6 +139,14 @@ class DisplayManager(wx.StaticBox):
         if not new:
             return
         self.displays.append(display)
+        self.changed()
+
+    def changed(self):
+        """Called whenever the displays are edited"""
+        for display in self.displays:
+            display.invalidate_matcher()
+        if self.on_change is not None:
+            self.on_change()
 
     def clone_display(self, *_):
         displays = enum_display_devices()
@@ -160,6 +169,7 @@ class DisplayManager(wx.StaticBox):
         while (item := self.list_control.GetFirstSelected()) != -1:
             self.displays.pop(item)
             self.list_control.DeleteItem(item)
+        self.changed()
 
     def duplicate_display(self, *_):
         for item in self.list_control.GetAllSelected():
@@ -208,10 +218,12 @@ class DisplayManager(wx.StaticBox):
         self.list_control.DeleteAllItems()
         for display in self.displays:
             self.append_display(display, new=False)
+        self.changed()
 
     def select_mode(self, evt: wx.CommandEvent):
         choice = 'any' if evt.GetSelection() == 1 else 'all'
         self.layout.comparison_params['display'] = choice
+        self.changed()
 
 
 class LayoutManager(wx.StaticBox):
@@ -409,6 +421,8 @@ class LayoutManager(wx.StaticBox):
                     self.snapshot_file.data.remove(layout)
 
             self.snapshot_file.data.extend(self.layouts[1:])
+            self.snapshot_file.rebuild_index()
+            self.snapshot_file.rules_changed()
 
             self.snapshot_file.save()
 
@@ -451,7 +465,9 @@ class LayoutPage(wx.Panel):
         else:
             name = layout.phony
 
-        self.display_manager = DisplayManager(self, layout, label=f'Displays for {name}')
+        self.display_manager = DisplayManager(
+            self, layout, on_change=self.snapshot.rules_changed, label=f'Displays for {name}'
+        )
 
         if layout == current or (layout.phony == 'Global' and layout.displays == []):
             self.display_manager.Disable()
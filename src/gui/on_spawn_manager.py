@@ -5,6 +5,7 @@ import wx.lib.scrolledpanel
 
 from common import load_json
 from gui.widgets import EVT_REARRANGE_LIST_SELECT, EditableListCtrl, RearrangeListCtrl, simple_box_sizer
+from window import invalidate_profile_matcher
 
 OnSpawnOperations = Literal['apply_lkp', 'apply_rules', 'move_to_mouse']
 
@@ -367,3 +368,4 @@ class OnSpawnPage(wx.lib.scrolledpanel.ScrolledPanel):
     def on_save(self, event = None):
         self.settings_file.set('on_window_spawn', self.settings)
         self.settings_file.save()
+        invalidate_profile_matcher()
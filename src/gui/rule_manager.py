@@ -10,7 +10,7 @@ import wx.lib.scrolledpanel
 from common import Rule, Snapshot, Window, size_from_rect
 from gui.widgets import EditableListCtrl, Frame, SelectionWindow
 from snapshot import SnapshotFile
-from window import capture_snapshot, restore_snapshot
+from window import capture_snapshot, invalidate_rule_indexes, restore_snapshot
 
 if TYPE_CHECKING:
     from gui.layout_manager import LayoutManager
@@ -179,7 +179,7 @@ class RuleSubsetManager(wx.StaticBox):
         rule.rule_name = 'Unnamed rule'
         self.rules.append(rule)
         self.append_rule(rule)
-        self.snapshot.save()
+        self.save_rules()
 
     def apply_rule(self, *_):
         rules = []
@@ -211,7 +211,7 @@ class RuleSubsetManager(wx.StaticBox):
                 )
                 self.rules.append(rule)
                 self.append_rule(rule)
-            self.snapshot.save()
+            self.save_rules()
 
         windows: list[Window] = sorted(capture_snapshot(), key=lambda w: w.name)
         options = {'Clone window names': True, 'Clone window executable paths': True}
@@ -221,13 +221,13 @@ class RuleSubsetManager(wx.StaticBox):
         while (item := self.list_control.GetFirstSelected()) != -1:
             self.rules.pop(item)
             self.list_control.DeleteItem(item)
-        self.snapshot.save()
+        self.save_rules()
 
     def duplicate_rule(self, *_):
         for item in self.list_control.GetAllSelected():
             self.rules.append(deepcopy(self.rules[item]))
             self.append_rule(self.rules[-1])
-        self.snapshot.save()
+        self.save_rules()
 
     def edit_rule(self, *_):
         alive_windows = {i.GetName(): i for i in self.GetChildren() if isinstance(i, Frame)}
@@ -261,7 +261,7 @@ class RuleSubsetManager(wx.StaticBox):
             self.insert_rule(new_index, rule)
             self.list_control.Select(new_index)
 
-        self.snapshot.save()
+        self.save_rules()
 
     def move_to(self, btn_event: wx.Event):
         options = {'Create a copy': False}
@@ -306,15 +306,22 @@ class RuleSubsetManager(wx.StaticBox):
                     rule.name = text
                 case 3:
                     rule.executable = text
+            invalidate_rule_indexes()
+            self.snapshot.rules_changed()
             window.populate_form()
 
+    def save_rules(self):
+        invalidate_rule_indexes()
+        self.snapshot.rules_changed()
+        self.snapshot.save()
+
     def refresh_list(self, selected=None):
         selected = selected or []
         self.list_control.DeleteAllItems()
         for index, rule in enumerate(self.rules):
             self.append_rule(rule)
             self.list_control.Select(index, on=index in selected)
-        self.snapshot.save()
+        self.save_rules()
 
 
 def _new_rule():
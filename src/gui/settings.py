@@ -38,8 +38,26 @@ class SettingsPanel(wx.Panel):
             '1 hour': 3600,
         }
         snap_freq_opt = wx.Choice(panel, id=2, choices=list(self.__snap_freq_choices.keys()))
+        adaptive_snap_opt = wx.CheckBox(panel, id=9, label='Reduce snapshot frequency when idle')
+        adaptive_snap_opt.SetToolTip(
+            'Gradually increase the time between snapshots while windows are not moving.'
+            ' The frequency is reset as soon as any windows move'
+        )
+        adaptive_ceil_txt = wx.StaticText(panel, label='Minimum snapshot frequency when idle')
+        adaptive_ceil_opt = wx.Choice(panel, id=10, choices=list(self.__snap_freq_choices.keys()))
+        event_snap_opt = wx.CheckBox(panel, id=8, label='Capture snapshots when windows move (requires restart)')
+        event_snap_opt.SetToolTip(
+            'Rather than capturing at a fixed frequency, capture windows shortly after they are moved or resized'
+        )
         save_freq_txt = wx.StaticText(panel, label='Save frequency')
         save_freq_opt = wx.SpinCtrl(panel, id=3, min=1, max=10)
+        self.__backend_choices = {'JSON': 'json', 'SQLite': 'sqlite'}
+        backend_txt = wx.StaticText(panel, label='History storage (requires restart)')
+        backend_txt.SetToolTip(
+            'How the snapshot history is stored. Switching to SQLite copies the existing history across.'
+            ' Switching back to JSON uses whatever was last saved as JSON'
+        )
+        backend_opt = wx.Choice(panel, id=11, choices=list(self.__backend_choices.keys()))
 
         prune_history_opt = wx.CheckBox(panel, id=4, label='Prune window history')
         prune_history_opt.SetToolTip(
@@ -69,7 +87,11 @@ class SettingsPanel(wx.Panel):
                 *header1,
                 pause_snap_opt,
                 (snap_freq_txt, snap_freq_opt),
+                adaptive_snap_opt,
+                (adaptive_ceil_txt, adaptive_ceil_opt),
+                event_snap_opt,
                 (save_freq_txt, save_freq_opt),
+                (backend_txt, backend_opt),
                 prune_history_opt,
                 (history_ttl_txt, history_ttl_opt),
                 (history_count_txt, history_count_opt),
@@ -86,7 +108,15 @@ class SettingsPanel(wx.Panel):
         snap_freq_opt.SetStringSelection(
             reverse_dict_lookup(self.__snap_freq_choices, self.settings.get('snapshot_freq', 60))
         )
+        adaptive_snap_opt.SetValue(self.settings.get('adaptive_snapshot_freq', False))
+        adaptive_ceil_opt.SetStringSelection(
+            reverse_dict_lookup(self.__snap_freq_choices, self.settings.get('adaptive_snapshot_ceiling', 600))
+        )
+        event_snap_opt.SetValue(self.settings.get('event_driven_snapshots', False))
         save_freq_opt.SetValue(self.settings.get('save_freq', 1))
+        backend_opt.SetStringSelection(
+            reverse_dict_lookup(self.__backend_choices, self.settings.get('history_backend', 'json'))
+        )
         prune_history_opt.SetValue(self.settings.get('prune_history', True))
         history_ttl_opt.SetTime(self.settings.get('window_history_ttl', 0))
         history_count_opt.SetValue(self.settings.get('max_snapshots', 10))
@@ -95,7 +125,11 @@ class SettingsPanel(wx.Panel):
         # bind events
         pause_snap_opt.Bind(wx.EVT_CHECKBOX, self.on_setting)
         snap_freq_opt.Bind(wx.EVT_CHOICE, self.on_setting)
+        adaptive_snap_opt.Bind(wx.EVT_CHECKBOX, self.on_setting)
+        adaptive_ceil_opt.Bind(wx.EVT_CHOICE, self.on_setting)
+        event_snap_opt.Bind(wx.EVT_CHECKBOX, self.on_setting)
         save_freq_opt.Bind(wx.EVT_SPINCTRL, self.on_setting)
+        backend_opt.Bind(wx.EVT_CHOICE, self.on_setting)
         prune_history_opt.Bind(wx.EVT_CHECKBOX, self.on_setting)
         history_ttl_opt.Bind(EVT_TIME_SPAN_SELECT, self.on_setting)
         history_count_opt.Bind(wx.EVT_SPINCTRL, self.on_setting)
@@ -119,9 +153,17 @@ class SettingsPanel(wx.Panel):
                 self.settings.set('pause_snapshots', widget.GetValue())
             elif event.Id == 4:
                 self.settings.set('prune_history', widget.GetValue())
+            elif event.Id == 8:
+                self.settings.set('event_driven_snapshots', widget.GetValue())
+            elif event.Id == 9:
+                self.settings.set('adaptive_snapshot_freq', widget.GetValue())
         elif isinstance(widget, wx.Choice):
             if event.Id == 2:
                 self.settings.set('snapshot_freq', self.__snap_freq_choices[widget.GetStringSelection()])
+            elif event.Id == 10:
+                self.settings.set('adaptive_snapshot_ceiling', self.__snap_freq_choices[widget.GetStringSelection()])
+            elif event.Id == 11:
+                self.settings.set('history_backend', self.__backend_choices[widget.GetStringSelection()])
             elif event.Id == 7:
                 level: str = widget.GetStringSelection().upper()
                 self.settings.set('log_level', level)
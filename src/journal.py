@@ -0,0 +1,394 @@
+"""
+Append-only journal for the snapshot history, so that saving only has to write what changed since the
+last save rather than re-serialising every snapshot.
+
+The journal is a JSON-lines file of records that are replayed on top of `history.json` (the base file)
+at startup. Each record sets some part of the state outright, so replaying a record more than once is
+harmless. Once the journal grows past a size threshold it is compacted, meaning the full state is written
+to the base file and the journal is started afresh.
+
+Records:
+    `{"op": "truncate", "length": n}`: remove all snapshots from index `n` onwards
+    `{"op": "snapshot", "index": i, "data": {...}}`: replace (or append) a whole snapshot
+    `{"op": "meta", "index": i, "data": {...}}`: replace every snapshot field except the history
+    `{"op": "history", "index": i, "times": [...], "entries": [...]}`: set the history to the captures
+        with these timestamps, where `entries` are new or changed captures
+
+Consecutive captures are usually near-identical, so most captures are stored as a delta against the capture
+before them: `{"time": t, "base": previous_time, "delta": [...]}`, where each item of `delta` is either the
+index of an unchanged window in the previous capture or a new/changed window. Every `KEYFRAME_INTERVAL`th
+capture is stored in full. Deltas are decoded when loading, with unchanged windows sharing one object.
+
+The base file records its format version (see `FORMAT_VERSION`), so that a base file written by a newer
+version is never mistaken for one that this version can read.
+"""
+
+import json
+import logging
+import os
+import threading
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Iterable, Optional
+
+from common import Snapshot, WindowHistory
+
+log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+"""
+Version of the base file format. Version 1 is a plain list of snapshots with every capture in full.
+Version 2 is `{"version": 2, "snapshots": [...]}`, with captures delta encoded
+"""
+KEYFRAME_INTERVAL = 10
+"""Store every Nth capture in full, so that a bad capture can only break the deltas up to the next keyframe"""
+
+
+def encode_capture(entry: WindowHistory, previous: Optional[WindowHistory]) -> dict[str, Any]:
+    """
+    Args:
+        entry: the capture to encode
+        previous: the capture before `entry`. If None, `entry` is encoded in full
+
+    Returns:
+        The capture in JSON form, as a delta against `previous` if given
+    """
+    if previous is None:
+        return asdict(entry)
+    # captures share `Window` instances for unchanged windows, so check by identity first
+    positions = {id(window): index for index, window in enumerate(previous.windows)}
+    by_hwnd: dict[int, int] = {}
+    for index, window in enumerate(previous.windows):
+        by_hwnd.setdefault(window.id, index)
+
+    delta = []
+    for window in entry.windows:
+        index = positions.get(id(window))
+        candidate = by_hwnd.get(window.id) if index is None else None
+        if candidate is not None and previous.windows[candidate] == window:
+            index = candidate
+        delta.append(asdict(window) if index is None else index)
+    return {'time': entry.time, 'base': previous.time, 'delta': delta}
+
+
+def encode_history(history: list[WindowHistory]) -> list[dict[str, Any]]:
+    return [
+        encode_capture(entry, None if index % KEYFRAME_INTERVAL == 0 else history[index - 1])
+        for index, entry in enumerate(history)
+    ]
+
+
+def decode_capture(entry: dict[str, Any], captures: dict[float, dict[str, Any]]) -> Optional[dict[str, Any]]:
+    """
+    Args:
+        entry: a capture in JSON form, either in full or as a delta
+        captures: previously decoded captures, keyed by time
+
+    Returns:
+        The capture in full, or None if the capture it is based on is missing
+    """
+    if 'delta' not in entry:
+        return entry
+    base = captures.get(entry['base'])
+    if base is None:
+        log.warning(f'drop capture {entry["time"]}, base capture {entry["base"]} is missing')
+        return None
+    windows = base['windows']
+    return {'time': entry['time'], 'windows': [windows[i] if isinstance(i, int) else i for i in entry['delta']]}
+
+
+def decode_history(history: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    result = []
+    captures: dict[float, dict[str, Any]] = {}
+    for entry in history:
+        if (decoded := decode_capture(entry, captures)) is not None:
+            captures[decoded['time']] = decoded
+            result.append(decoded)
+    return result
+
+
+def snapshot_to_json(snapshot: Snapshot) -> dict[str, Any]:
+    """
+    Returns:
+        The snapshot in JSON form, with the history delta encoded
+    """
+    data = snapshot_meta(snapshot)
+    data['history'] = encode_history(snapshot.history)
+    return data
+
+
+def snapshot_meta(snapshot: Snapshot) -> dict[str, Any]:
+    """
+    Returns:
+        Every field of the snapshot except the history, in JSON form
+    """
+    data = asdict(replace(snapshot, history=[]))
+    del data['history']
+    return data
+
+
+def history_signature(snapshot: Snapshot) -> dict[float, tuple[int, ...]]:
+    """
+    Returns:
+        The IDs of the window objects in each capture, keyed by capture time. This changes
+        whenever windows are added to, removed from or replaced within a capture
+    """
+    return {entry.time: tuple(map(id, entry.windows)) for entry in snapshot.history}
+
+
+@dataclass(slots=True)
+class JournalState:
+    snapshot: Snapshot
+    """Held to keep the snapshot's ID from being re-used"""
+    meta: dict[str, Any]
+    history: dict[float, tuple[int, ...]]
+
+    @classmethod
+    def of(cls, snapshot: Snapshot) -> 'JournalState':
+        return cls(snapshot, snapshot_meta(snapshot), history_signature(snapshot))
+
+
+def write_json(path: str, data: Any):
+    """Write JSON to a temp file, then swap it into place so that a crash can't leave a half-written file"""
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+
+class HistoryJournal:
+    def __init__(self, base_file: str, journal_file: str, max_size: int = 1024 * 1024):
+        """
+        Args:
+            base_file: the file holding the fully serialised snapshots
+            journal_file: the file that records are appended to
+            max_size: compact the journal into the base file once it is at least this many bytes
+        """
+        self.base_file = base_file
+        self.file = journal_file
+        self.old_file = journal_file + '.old'
+        """The previous journal, which is kept until it has been compacted into the base file"""
+        self.max_size = max_size
+        self._lock = threading.RLock()
+        self._state: list[JournalState] = []
+        """What is currently on disk"""
+        self._pending: Optional[list[JournalState]] = None
+        """What will be on disk once the records from the last `diff` or `checkpoint` are written"""
+        try:
+            self.size = os.path.getsize(self.file)
+        except OSError:
+            self.size = 0
+
+    def close(self):
+        """Release any resources held by the journal"""
+
+    def load(self) -> list[dict]:
+        """
+        Returns:
+            The saved snapshots in JSON form, with the journal applied
+        """
+        try:
+            with open(self.base_file, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = []
+        if isinstance(data, dict):
+            version = data.get('version')
+            if not isinstance(version, int) or version > FORMAT_VERSION:
+                self._set_aside(version)
+                return []
+            data = data.get('snapshots', [])
+        # version 1 files are a plain list of full captures, which decode as-is
+        return self.replay(data)
+
+    def _set_aside(self, version: Any):
+        """Rename the base file and journals, so that a newer version's history isn't overwritten"""
+        log.error(
+            f'{self.base_file!r} has unsupported format version {version!r}, set it aside and start a new history'
+        )
+        for file in (self.base_file, self.old_file, self.file):
+            if os.path.exists(file):
+                os.replace(file, f'{file}.v{version}')
+        self.size = 0
+
+    def replay(self, data: list[dict]) -> list[dict]:
+        """
+        Apply the journal to the contents of the base file
+
+        Args:
+            data: the snapshots loaded from the base file, in JSON form. Modified in place
+
+        Returns:
+            `data`
+        """
+        for snapshot in data:
+            try:
+                snapshot['history'] = decode_history(snapshot['history'])
+            except (KeyError, IndexError, TypeError):
+                pass
+        for file in (self.old_file, self.file):
+            for record in self._read(file):
+                try:
+                    self._apply(data, record)
+                except (KeyError, IndexError, TypeError, AttributeError):
+                    log.warning(f'skip invalid journal record {record!r:.200}')
+        return data
+
+    def _read(self, file: str) -> Iterable[dict]:
+        try:
+            with open(file, 'r') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # probably the tail of a record that was being written during a crash
+                        log.warning(f'stop reading journal {file!r}, malformed record {line!r:.200}')
+                        return
+        except FileNotFoundError:
+            return
+
+    @staticmethod
+    def _apply(data: list[dict], record: dict):
+        match record['op']:
+            case 'truncate':
+                del data[record['length'] :]
+            case 'snapshot':
+                snapshot = record['data']
+                snapshot['history'] = decode_history(snapshot.get('history', []))
+                if record['index'] < len(data):
+                    data[record['index']] = snapshot
+                else:
+                    data.append(snapshot)
+            case 'meta':
+                data[record['index']].update(record['data'])
+            case 'history':
+                snapshot = data[record['index']]
+                entries = {entry['time']: entry for entry in snapshot.get('history', ())}
+                for entry in record['entries']:
+                    if (decoded := decode_capture(entry, entries)) is not None:
+                        entries[decoded['time']] = decoded
+                snapshot['history'] = [entries[t] for t in record['times'] if t in entries]
+            case op:
+                raise KeyError(op)
+
+    def track(self, snapshots: list[Snapshot]):
+        """
+        Mark `snapshots` as being what is currently on disk, so that future records are relative to them
+        """
+        with self._lock:
+            self._state = [JournalState.of(snapshot) for snapshot in snapshots]
+            self._pending = None
+
+    def _written(self):
+        """Mark the state from the last `diff` or `checkpoint` as being on disk"""
+        with self._lock:
+            if self._pending is not None:
+                self._state, self._pending = self._pending, None
+
+    def diff(self, snapshots: list[Snapshot]) -> list[dict]:
+        """
+        Work out which records are needed to bring the journal up to date with `snapshots`. They are
+        only treated as written once `append` succeeds, so if it fails, the next `diff` includes them again
+
+        Returns:
+            The records, in the order they should be written
+        """
+        with self._lock:
+            records = []
+            state = self._state
+            pending: list[JournalState] = []
+            # snapshots are identified by position, so anything after the first snapshot that
+            # has been added, removed or moved must be re-written in full
+            prefix = 0
+            while prefix < min(len(state), len(snapshots)) and state[prefix].snapshot is snapshots[prefix]:
+                prefix += 1
+            if prefix < len(state):
+                records.append({'op': 'truncate', 'length': prefix})
+
+            for index, snapshot in enumerate(snapshots[:prefix]):
+                previous = state[index]
+                current = JournalState.of(snapshot)
+                pending.append(current)
+                if current.meta != previous.meta:
+                    records.append({'op': 'meta', 'index': index, 'data': current.meta})
+
+                history = current.history
+                if history == previous.history:
+                    continue
+                if len(history) != len(snapshot.history):
+                    # duplicate timestamps, so captures can't be told apart
+                    records.append({'op': 'snapshot', 'index': index, 'data': snapshot_to_json(snapshot)})
+                else:
+                    records.append(
+                        {
+                            'op': 'history',
+                            'index': index,
+                            'times': list(history),
+                            'entries': [
+                                encode_capture(entry, None if i % KEYFRAME_INTERVAL == 0 else snapshot.history[i - 1])
+                                for i, entry in enumerate(snapshot.history)
+                                if previous.history.get(entry.time) != history[entry.time]
+                            ],
+                        }
+                    )
+
+            for index in range(prefix, len(snapshots)):
+                records.append({'op': 'snapshot', 'index': index, 'data': snapshot_to_json(snapshots[index])})
+                pending.append(JournalState.of(snapshots[index]))
+            self._pending = pending
+            return records
+
+    def append(self, records: list[dict]):
+        """
+        Write records from `diff` to the journal. Raises an exception if they could not be written
+        """
+        with self._lock:
+            if records:
+                with open(self.file, 'a') as f:
+                    f.write(''.join(json.dumps(record) + '\n' for record in records))
+                    self.size = f.tell()
+            self._written()
+
+    def needs_compaction(self) -> bool:
+        return self.size >= self.max_size
+
+    def checkpoint(self, snapshots: list[Snapshot]) -> list[dict]:
+        """
+        Serialise the full state, ready to be passed to `compact`. Once `compact` succeeds, records from
+        future calls to `diff` are relative to this state.
+
+        Args:
+            snapshots: the complete, current state. Should have been passed to `diff` already
+        """
+        with self._lock:
+            data = [snapshot_to_json(snapshot) for snapshot in snapshots]
+            self._pending = [JournalState.of(snapshot) for snapshot in snapshots]
+            return data
+
+    def compact(self, data: list[dict]):
+        """
+        Write the full state to the base file and start a new journal. Any records produced before
+        `data` was checkpointed must have been appended already, and none produced after it.
+
+        Args:
+            data: the result of `checkpoint`
+
+        Raises:
+            Exception: if the base file could not be written. The journal is kept, so nothing is lost
+        """
+        with self._lock:
+            # keep the old journal around until `data` is safely written, in case we crash in the meantime
+            if os.path.exists(self.file):
+                if os.path.exists(self.old_file):
+                    # previous compaction failed, so keep both journals' records
+                    with open(self.file, 'r') as src, open(self.old_file, 'a') as dst:
+                        dst.write(src.read())
+                    os.remove(self.file)
+                else:
+                    os.replace(self.file, self.old_file)
+            self.size = 0
+
+            write_json(self.base_file, {'version': FORMAT_VERSION, 'snapshots': data})
+            if os.path.exists(self.old_file):
+                os.remove(self.old_file)
+            self._written()
+            log.info(f'compacted journal into {self.base_file!r}')
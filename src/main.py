@@ -5,7 +5,6 @@ import os
 import signal
 import sys
 import time
-from typing import Optional
 
 import psutil
 import win32con
@@ -13,13 +12,13 @@ import win32gui
 import wx
 
 import named_pipe
-from common import Window, XandY, load_json, local_path, match, single_call
+from common import CaptureContext, Window, XandY, load_json, local_path, single_call
 from device import DeviceChangeCallback, DeviceChangeService
 from gui import TaskbarIcon, WxApp, about_dialog, radio_menu
 from gui.wx_app import spawn_gui
 from services import ServiceCallback
-from snapshot import SnapshotFile, SnapshotService
-from window import WindowSpawnService, apply_rules, is_window_valid, restore_snapshot
+from snapshot import SnapshotFile, SnapshotService, display_cache
+from window import WindowSpawnService, apply_rules, get_profile_matcher, is_window_valid, restore_snapshot
 
 
 class LoggingFilter(logging.Filter):
@@ -83,21 +82,25 @@ def clear_restore_options():
         win32con.MB_YESNO | win32con.MB_ICONWARNING,
     )
     if result == win32con.IDYES:
-        snap.get_current_snapshot().history.clear()
+        current = snap.get_current_snapshot()
+        current.history.clear()
+        current.touch()
 
 
 def rescue_windows(snap: SnapshotFile):
     def callback(hwnd, _):
-        if not is_window_valid(hwnd):
+        if not is_window_valid(hwnd, ctx):
             return
-        window = Window.from_hwnd(hwnd)
-        if not window.fits_display_config(displays):
+        window = Window.from_hwnd(hwnd, ctx=ctx)
+        if not window.fits_display_config(displays, geometry):
             rect = [0, 0, *window.size]
             logging.info(f'rescue window {window.name!r} {window.rect} -> {rect}')
             window.move((0, 0))
 
     displays = snap.get_current_snapshot().displays
-    win32gui.EnumWindows(callback, None)
+    geometry = display_cache.get_geometry()
+    with CaptureContext() as ctx:
+        win32gui.EnumWindows(callback, None)
 
 
 def on_window_spawn(windows: list[Window]):
@@ -108,9 +111,10 @@ def on_window_spawn(windows: list[Window]):
     time.sleep(0.05)
     current_snap = snap.get_current_snapshot()
     rules = snap.get_rules(compatible_with=True, exclusive=True)
+    geometry = display_cache.get_geometry()
 
     def lkp(window: Window, match_resizability: bool) -> bool:
-        last_instance = current_snap.last_known_process_instance(
+        last_instance = snap.last_known_process_instance(
             window, match_title=True, match_resizability=match_resizability
         )
         if not last_instance:
@@ -127,7 +131,7 @@ def on_window_spawn(windows: list[Window]):
             rect = placement[4]
             placement = (placement[0], show_cmd, (-1, -1), (-1, -1), placement[4])
 
-        window.set_pos(rect, placement)
+        window.set_pos(rect, placement, geometry)
         return True
 
     def mtm(window: Window, fuzzy_mtm: bool) -> bool:
@@ -136,35 +140,13 @@ def on_window_spawn(windows: list[Window]):
             # if cursor X between window X and X1, and cursor Y between window Y and Y1
             if window.rect[0] <= cursor_pos[0] <= window.rect[2] and window.rect[1] <= cursor_pos[1] <= window.rect[3]:
                 return True
-        window.center_on(cursor_pos)
+        window.center_on(cursor_pos, geometry)
         return True
 
-    def find_matching_profile(window: Window) -> Optional[dict]:
-        matches = []
-        for profile in on_spawn_settings.get('profiles', []):
-            if not profile.get('enabled', False):
-                continue
-            apply_to = profile.get('apply_to', {})
-            if not apply_to:
-                continue
-            name = apply_to.get('name', '') or None
-            exe = apply_to.get('executable', '') or None
-            if not name and not exe:
-                continue
-            score = 0
-            if name:
-                score += match(name, window.name)
-            if exe:
-                score += match(exe, window.executable)
-            if score:
-                matches.append((score, profile))
-        if not matches:
-            return None
-        return sorted(matches, key=lambda x: x[0])[0][1]
-
+    profile_matcher = get_profile_matcher(on_spawn_settings)
     capture_snapshot = 0
     for window in windows:
-        profile = find_matching_profile(window) or on_spawn_settings
+        profile = profile_matcher.find(window) or on_spawn_settings
         log.debug(f'OWS profile {profile.get("name")!r} matches window {window}')
         if window.parent is not None and profile.get('ignore_children', True):
             continue
@@ -180,13 +162,14 @@ def on_window_spawn(windows: list[Window]):
                 break
             elif op_name == 'move_to_mouse' and mtm(window, profile.get('fuzzy_mtm', True)):
                 break
-            elif op_name == 'apply_rules' and apply_rules(rules, window):
+            elif op_name == 'apply_rules' and apply_rules(rules, window, geometry):
                 break
         capture_snapshot = max(capture_snapshot, profile.get('capture_snapshot', 2))
 
     if capture_snapshot == 2:
         # these are all newly spawned windows so we don't have to worry about merging them into the history
         current_snap.history[-1].windows.extend(windows)
+        current_snap.history[-1].touch()
     elif capture_snapshot == 1:
         snap.update()
 
@@ -205,7 +188,7 @@ def shutdown(*_):
     snapshot_service.stop()
     window_spawn_thread.stop()
     log.info('save snapshot before shutting down')
-    snap.save()
+    snap.close()
     log.debug('destroy WxApp')
     app.ExitMainLoop()
     app.Destroy()
@@ -315,7 +298,9 @@ if __name__ == '__main__':
         app.enable_sigterm(parent_process)
 
     with TaskbarIcon(menu_options, on_click=update_systray_options, on_exit=shutdown):
-        monitor_thread = DeviceChangeService(DeviceChangeCallback(snap.restore, shutdown, snap.update), snap.lock)
+        monitor_thread = DeviceChangeService(
+            DeviceChangeCallback(snap.restore, shutdown, snap.update, display_cache.invalidate), snap.lock
+        )
         monitor_thread.start()
         window_spawn_thread = WindowSpawnService(ServiceCallback(on_window_spawn))
         window_spawn_thread.start()
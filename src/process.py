@@ -0,0 +1,242 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import psutil
+import pythoncom
+import wmi
+
+from win32_extras import QueryFullProcessImageName
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class ProcessInfo:
+    pid: int
+    create_time: float
+    executable: str
+
+
+@dataclass(slots=True)
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+@dataclass(slots=True)
+class ResolverStats:
+    calls: int = 0
+    resolved: int = 0
+    failures: int = 0
+    total_time: float = 0
+    """Total time spent resolving, in seconds"""
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0
+
+
+def get_create_time(pid: int) -> Optional[float]:
+    """
+    Returns:
+        The creation time of a process, or None if it could not be determined
+    """
+    try:
+        return psutil.Process(pid).create_time()
+    except (psutil.Error, OSError):
+        return None
+
+
+class ExecutableResolver(ABC):
+    """
+    Base class for anything that can map PIDs to executable paths. Subclasses implement `_resolve`,
+    and this class takes care of timing calls and counting failures.
+    """
+
+    def __init__(self):
+        self.log = log.getChild(self.__class__.__name__)
+        self.stats = ResolverStats()
+
+    def resolve(self, pids: Iterable[int]) -> dict[int, str]:
+        """
+        Returns:
+            A dict of PID to executable path. Processes that could not be resolved are omitted
+        """
+        pids = set(pids)
+        if not pids:
+            return {}
+        start = time.perf_counter()
+        try:
+            result = {pid: exe for pid, exe in self._resolve(pids).items() if exe}
+        except Exception:
+            self.log.exception(f'failed to resolve executables for {len(pids)} processes')
+            result = {}
+        self.stats.calls += 1
+        self.stats.total_time += time.perf_counter() - start
+        self.stats.resolved += len(result)
+        self.stats.failures += len(pids) - len(result)
+        return result
+
+    @abstractmethod
+    def _resolve(self, pids: set[int]) -> dict[int, str]:
+        pass
+
+
+class NativeResolver(ExecutableResolver):
+    """Resolves executables with `QueryFullProcessImageName`. Cheap, but fails on some protected processes"""
+
+    def _resolve(self, pids):
+        result = {}
+        for pid in pids:
+            try:
+                result[pid] = QueryFullProcessImageName(pid)
+            except OSError:
+                pass
+        return result
+
+
+class PsutilResolver(ExecutableResolver):
+    def _resolve(self, pids):
+        result = {}
+        for pid in pids:
+            try:
+                result[pid] = psutil.Process(pid).exe()
+            except (psutil.Error, OSError):
+                pass
+        return result
+
+
+class WMIResolver(ExecutableResolver):
+    """Resolves executables with a single WMI query. Slow, but works for most protected processes"""
+
+    def _resolve(self, pids):
+        if threading.current_thread() != threading.main_thread():
+            pythoncom.CoInitialize()
+        w = wmi.WMI()
+        # https://stackoverflow.com/a/14973422
+        where = ' OR '.join(f'ProcessId = {pid}' for pid in sorted(pids))
+        processes = w.query(f'SELECT ProcessId, ExecutablePath FROM Win32_Process WHERE {where}')
+        return {p.ProcessId: p.ExecutablePath for p in processes}
+
+
+class InMemoryResolver(ExecutableResolver):
+    """Resolves executables from a pre-defined mapping"""
+
+    def __init__(self, executables: dict[int, str]):
+        super().__init__()
+        self.executables = executables
+
+    def _resolve(self, pids):
+        return {pid: self.executables[pid] for pid in pids if pid in self.executables}
+
+
+class ResolverChain(ExecutableResolver):
+    """
+    Tries each resolver in order, passing any processes that could not be resolved on to the next one
+    """
+
+    def __init__(self, resolvers: Iterable[ExecutableResolver]):
+        super().__init__()
+        self.resolvers = list(resolvers)
+
+    def _resolve(self, pids):
+        result = {}
+        for resolver in self.resolvers:
+            result.update(resolver.resolve(pids - result.keys()))
+            if len(result) == len(pids):
+                break
+        return result
+
+    def get_stats(self) -> dict[str, ResolverStats]:
+        return {r.__class__.__name__: r.stats for r in self.resolvers}
+
+
+class ProcessCache:
+    """
+    Caches process metadata so that windows belonging to an already-seen process don't have
+    to be resolved again. Entries are identified by PID and process creation time, so a recycled
+    PID will not return the executable of the process that previously held it.
+    """
+
+    def __init__(self, resolver: Optional[ExecutableResolver] = None):
+        """
+        Args:
+            resolver: used to look up processes that are not cached. Defaults to a
+                `ResolverChain` of the native, psutil and WMI resolvers
+        """
+        self._lock = threading.RLock()
+        self._cache: dict[int, ProcessInfo] = {}
+        self.stats = CacheStats()
+        self.resolver = resolver or ResolverChain((NativeResolver(), PsutilResolver(), WMIResolver()))
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get_executable(self, pid: int) -> str:
+        """
+        Returns:
+            The executable path of a process, or an empty string if it could not be resolved
+        """
+        return self.get_executables((pid,)).get(pid, '')
+
+    def get_executables(self, pids: Iterable[int]) -> dict[int, str]:
+        """
+        Get the executable paths for a number of processes. Any processes that are not
+        already cached are passed to the resolver in a single batch.
+
+        Returns:
+            A dict of PID to executable path. Processes that could not be found are omitted
+        """
+        result: dict[int, str] = {}
+        create_times: dict[int, Optional[float]] = {}
+        with self._lock:
+            for pid in set(pids):
+                create_time = create_times[pid] = get_create_time(pid)
+                cached = self._cache.get(pid)
+                if cached is not None:
+                    if create_time is not None and cached.create_time == create_time:
+                        self.stats.hits += 1
+                        result[pid] = cached.executable
+                        continue
+                    # PID has been recycled by another process (or the original has exited)
+                    del self._cache[pid]
+                    self.stats.evictions += 1
+                self.stats.misses += 1
+
+        missing = create_times.keys() - result.keys()
+        if not missing:
+            return result
+
+        queried = self.resolver.resolve(missing)
+        with self._lock:
+            for pid, executable in queried.items():
+                if (create_time := create_times.get(pid)) is not None:
+                    self._cache[pid] = ProcessInfo(pid=pid, create_time=create_time, executable=executable)
+        result.update(queried)
+        return result
+
+    def prune(self, alive: Optional[Iterable[int]] = None):
+        """
+        Evict processes that have exited
+
+        Args:
+            alive: PIDs of running processes. Queried from the system if not given
+        """
+        alive = set(psutil.pids() if alive is None else alive)
+        with self._lock:
+            for pid in [pid for pid in self._cache if pid not in alive]:
+                del self._cache[pid]
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.stats = CacheStats()
+
+
+process_cache = ProcessCache()
@@ -1,15 +1,37 @@
 import logging
 import re
+import threading
 import time
-from dataclasses import asdict
-from typing import Iterator, Literal, Optional
+from contextlib import ExitStack
+from copy import deepcopy
+from typing import Iterable, Iterator, Literal, Optional
 
 import pywintypes
 import win32api
-
-from common import Display, JSONFile, Snapshot, WindowHistory, load_json, local_path, size_from_rect
-from services import Service
-from window import capture_snapshot, restore_snapshot
+import win32con
+import win32gui
+
+from common import (
+    Display,
+    DisplayFingerprint,
+    JSONFile,
+    Rule,
+    Snapshot,
+    Window,
+    WindowHistory,
+    display_fingerprint,
+    get_system_frame_thickness,
+    load_json,
+    local_path,
+    size_from_rect,
+)
+from geometry import DisplayGeometry, Monitor
+from journal import HistoryJournal
+from services import Service, ServiceCallback
+from sqlite_store import SqliteHistoryStore
+from win32_extras import GetDpiForMonitor
+from window import IncrementalCapture, capture_snapshot, restore_snapshot
+from window_events import DirtyWindowTracker, WindowEventService
 
 log = logging.getLogger(__name__)
 
@@ -35,32 +57,243 @@ def enum_display_devices() -> list[Display]:
     return result
 
 
+def get_display_geometry() -> DisplayGeometry:
+    monitors = []
+    for monitor in win32api.EnumDisplayMonitors():
+        try:
+            info = win32api.GetMonitorInfo(monitor[0])  # type: ignore
+        except pywintypes.error:
+            log.exception(f'GetMonitorInfo failed on handle {monitor[0]}')
+            continue
+        item = Monitor(rect=info['Monitor'], work=info['Work'], dpi=GetDpiForMonitor(monitor[0].handle) or 96)
+        if info['Flags'] & win32con.MONITORINFOF_PRIMARY:
+            # primary first, so that it wins any ties when looking for the closest monitor
+            monitors.insert(0, item)
+        else:
+            monitors.append(item)
+    return DisplayGeometry(monitors, frame_thickness=get_system_frame_thickness())
+
+
+class DisplayCache:
+    """
+    Caches the current display topology so that it doesn't have to be re-enumerated on every lookup.
+    `invalidate` should be called whenever the displays, their work areas or their DPIs might have changed
+    (eg: `WM_DISPLAYCHANGE`, or `WM_SETTINGCHANGE` when the taskbar moves).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._displays: Optional[list[Display]] = None
+        self._geometry: Optional[DisplayGeometry] = None
+        self.version = 0
+        """Incremented every time the cache is invalidated"""
+
+    def get(self) -> list[Display]:
+        """
+        Returns:
+            The current displays. This list is shared, so should not be modified
+        """
+        with self._lock:
+            if self._displays is None:
+                displays = enum_display_devices()
+                if not displays:
+                    # probably caught mid display change. Don't cache it
+                    return displays
+                self._displays = displays
+            return self._displays
+
+    def get_geometry(self) -> Optional[DisplayGeometry]:
+        """
+        Returns:
+            The current display geometry, or None if no monitors could be found
+        """
+        with self._lock:
+            if self._geometry is None:
+                geometry = get_display_geometry()
+                if not geometry:
+                    return None
+                self._geometry = geometry
+            return self._geometry
+
+    def invalidate(self):
+        with self._lock:
+            self._displays = None
+            self._geometry = None
+            self.version += 1
+            log.debug(f'display cache invalidated, version={self.version}')
+
+
+display_cache = DisplayCache()
+
+
 class SnapshotFile(JSONFile):
     data: list[Snapshot]
 
     def __init__(self):
         super().__init__(local_path('history.json'))
+        self._capture = IncrementalCapture()
+        self._update_lock = threading.Lock()
+        """Serialises `update` calls, so captures are added to the history in the order they were taken"""
+        self._last_updated: Optional[Snapshot] = None
+        """The snapshot that the most recent capture was added to"""
+        self._index: dict[DisplayFingerprint, Snapshot] = {}
+        """Non-phony snapshots, keyed by their display configuration"""
+        self.rules_revision = 0
+        """Incremented whenever rules or layouts are edited. See `rules_changed`"""
+        self._rules_cache: dict[tuple, tuple[Snapshot, tuple[Rule, ...]]] = {}
+        settings = load_json('settings')
+        self.journal: HistoryJournal
+        self.store: Optional[SqliteHistoryStore] = None
+        """The journal, if the SQLite backend is selected. Lookups are answered with its indexed queries"""
+        if settings.get('history_backend', 'json') == 'sqlite':
+            self.journal = self.store = SqliteHistoryStore(
+                local_path('history.db'), self.file, local_path('history.journal')
+            )
+        else:
+            self.journal = HistoryJournal(
+                self.file, local_path('history.journal'), max_size=settings.get('journal_compact_size', 1024 * 1024)
+            )
+        self.writer = SnapshotWriter(self)
+        self._saved_revision: Optional[tuple] = None
+        """The revision of the data when it was last queued for saving"""
+        self.skipped_writes = 0
+        """The number of times `save` was called with nothing to save"""
         self.load()
 
     def load(self):
-        super().load(default=[])
+        raw = self.journal.load()
+        self.data = []
         g_phony_found = False
-        for index in range(len(self.data)):
-            snapshot: Snapshot = Snapshot.from_json(self.data[index]) or Snapshot()
-            self.data[index] = snapshot
+        # windows that are unchanged between captures are decoded to the same dict, so share the `Window` too.
+        # The memo is keyed by ID, so `raw` must stay alive until we are done with it
+        memo = {}
+        for item in raw:
+            snapshot: Snapshot = Snapshot.from_json(item, memo) or Snapshot()
+            self.data.append(snapshot)
             snapshot.history.sort(key=lambda a: a.time)
 
             if snapshot.phony == 'Global' and snapshot.displays == []:
                 g_phony_found = True
 
+        self.journal.track(self.data)
+        self._saved_revision = self.revision()
         if not g_phony_found:
             self.data.append(Snapshot(phony='Global'))
 
         self.data = list(filter(None, self.data))
+        self.rebuild_index()
+        self.rules_changed()
+
+    def rebuild_index(self):
+        """
+        Re-index the snapshots by display configuration. Should be called after
+        snapshots are added, removed or have their displays edited
+        """
+        with self.lock:
+            self._index = {}
+            for snapshot in self.data:
+                if not snapshot.phony:
+                    # keep the first snapshot in the list, in case of duplicates
+                    self._index.setdefault(display_fingerprint(snapshot.displays), snapshot)
+
+    def rules_changed(self):
+        """
+        Should be called after any rules or layouts are edited, so that `get_rules` doesn't
+        return stale results
+        """
+        with self.lock:
+            self.rules_revision += 1
+            self._rules_cache.clear()
+
+    def find_snapshot(self, displays: list[Display]) -> Optional[Snapshot]:
+        """
+        Returns:
+            The non-phony snapshot for a display configuration, or None if there isn't one
+        """
+        key = display_fingerprint(displays)
+        with self.lock:
+            snapshot = self._index.get(key)
+            if snapshot is None or snapshot.phony or display_fingerprint(snapshot.displays) != key:
+                # index is missing or out of date, probably because `data` was edited directly
+                self.rebuild_index()
+                snapshot = self._index.get(key)
+            return snapshot
+
+    def revision(self) -> tuple:
+        """
+        Returns:
+            A value that changes whenever the snapshots are changed. Edits to rules and layouts
+            are picked up through `rules_changed`
+        """
+        with self.lock:
+            return self.rules_revision, tuple((id(s), s.content_revision()) for s in self.data)
 
     def save(self):
+        """
+        Queue any changes since the last save to be written to disk. This does not block.
+        See `SnapshotWriter`
+        """
         with self.lock:
-            return super().save([asdict(i) for i in self.data])
+            revision = self.revision()
+            if revision == self._saved_revision:
+                self.skipped_writes += 1
+                self._log.debug(f'nothing changed since last save, skip write ({self.skipped_writes} skipped)')
+                return
+            self._saved_revision = revision
+        self.writer.request()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for all queued changes to be written
+
+        Returns:
+            Whether all changes were written before the timeout
+        """
+        return self.writer.flush(timeout)
+
+    def _synced_store(self) -> Optional[SqliteHistoryStore]:
+        """
+        Write any outstanding changes to the SQLite store, so that positions returned by its queries
+        match `self.data`. The caller must hold `self.lock` until it is done with those positions
+
+        Returns:
+            The store, or None if the JSON backend is selected or the changes could not be written
+        """
+        if self.store is None:
+            return None
+        with self.lock:
+            self.save()
+            if not self.writer.write_now():
+                return None
+        return self.store
+
+    def _store_position(self, snap: Snapshot) -> Optional[int]:
+        """
+        Returns:
+            The position of a non-phony snapshot in the SQLite store, or None if it can't be looked up
+            there. See `_synced_store`
+        """
+        if (store := self._synced_store()) is None:
+            return None
+        position = store.find_snapshot(display_fingerprint(snap.displays))
+        # only the first snapshot for a display config is found, in case of duplicates
+        return position if position is not None and self.data[position] is snap else None
+
+    def compact(self):
+        """
+        Write every snapshot to the base file and start a new journal
+        """
+        self.writer.request(compact=True)
+        self.flush()
+
+    def close(self):
+        """
+        Write any outstanding changes and stop the writer thread
+        """
+        self.save()
+        self.flush()
+        self.writer.stop()
+        self.journal.close()
 
     def restore(self, timestamp: Optional[float] = None):
         with self.lock:
@@ -68,24 +301,45 @@ class SnapshotFile(JSONFile):
             if snap is None or not snap.history:
                 return
             rules = self.get_rules(compatible_with=snap)
+            geometry = display_cache.get_geometry()
 
-            history = snap.history
-
-            def restore_ts(timestamp: float):
-                for config in history:
-                    if config.time == timestamp:
-                        restore_snapshot(config.windows, rules)
-                        snap.mru = timestamp
-                        return True
+            def restore_capture(timestamp: Optional[float] = None) -> bool:
+                config = self.find_capture(snap, timestamp)
+                if config is None:
+                    return False
+                restore_snapshot(config.windows, rules, geometry)
+                if timestamp is not None:
+                    snap.mru = timestamp
+                return True
 
             self._log.info(f'restore snapshot, timestamp={timestamp}')
             if timestamp == -1:
-                restore_snapshot(history[-1].windows, rules)
+                restore_capture()
             elif timestamp:
-                restore_ts(timestamp)
-            else:
-                if not (snap.mru and restore_ts(snap.mru)):
-                    restore_snapshot(history[-1].windows, rules)
+                restore_capture(timestamp)
+            elif not (snap.mru and restore_capture(snap.mru)):
+                restore_capture()
+
+    def find_capture(self, snap: Snapshot, timestamp: Optional[float] = None) -> Optional[WindowHistory]:
+        """
+        Args:
+            snap: the snapshot to search the history of
+            timestamp: when the capture was taken. If not given, the most recent capture is returned
+
+        Returns:
+            The capture, or None if there isn't one
+        """
+        with self.lock:
+            if (position := self._store_position(snap)) is not None:
+                capture = self.store.find_capture(position, timestamp)
+                return None if capture is None else snap.history[capture]
+
+            if timestamp is None:
+                return snap.history[-1] if snap.history else None
+            for config in snap.history:
+                if config.time == timestamp:
+                    return config
+            return None
 
     def capture(self):
         """
@@ -93,23 +347,17 @@ class SnapshotFile(JSONFile):
         Use `update` instead.
         """
         self._log.info('capture snapshot')
-        return time.time(), enum_display_devices(), capture_snapshot()
+        return time.time(), display_cache.get(), capture_snapshot()
 
     def get_current_snapshot(self) -> Snapshot:
-        displays = enum_display_devices()
-
-        def find():
-            for ss in self.data:
-                if ss.phony:
-                    continue
-                if ss.displays == displays:
-                    return ss
+        displays = display_cache.get()
 
         with self.lock:
-            snap = find()
-            if snap is None:
-                self.update()
-                snap = find()
+            snap = self.find_snapshot(displays)
+            if snap is None and displays:
+                # callers may already hold `self.lock`, so `update` can't be used here (see `update`)
+                windows, changed = self._capture.capture()
+                snap = self._add_capture(time.time(), displays, windows, changed)
             return snap
 
     def get_compatible_snapshots(self, compatible_with: Optional[Snapshot] = None) -> Iterator[Snapshot]:
@@ -124,7 +372,19 @@ class SnapshotFile(JSONFile):
                     continue
                 yield snap
 
-    def get_rules(self, compatible_with: Optional[Snapshot | Literal[True]] = None, exclusive=False):
+    def get_rules(
+        self, compatible_with: Optional[Snapshot | Literal[True]] = None, exclusive=False
+    ) -> list[Rule] | tuple[Rule, ...]:
+        """
+        Args:
+            compatible_with: also include rules from layouts that are compatible with this snapshot.
+                If True, the current snapshot is used. If not given, only the current snapshot's rules are returned
+            exclusive: exclude the rules belonging to `compatible_with` itself
+
+        Returns:
+            The rules. Compatible rules are cached until `rules_changed` is called or the displays change,
+            so the same tuple is returned for repeat calls
+        """
         with self.lock:
             current = self.get_current_snapshot()
             if not compatible_with:
@@ -133,61 +393,390 @@ class SnapshotFile(JSONFile):
             if compatible_with is True:
                 compatible_with: Snapshot = current
 
+            key = (
+                id(compatible_with),
+                display_fingerprint(compatible_with.displays),
+                exclusive,
+                self.rules_revision,
+                display_cache.version,
+            )
+            # the snapshot is stored alongside the rules so that its ID can't be re-used while cached
+            if (cached := self._rules_cache.get(key)) is not None and cached[0] is compatible_with:
+                return cached[1]
+
             rules = [] if exclusive else compatible_with.rules.copy()
-            for snap in self.get_compatible_snapshots(compatible_with):
-                rules.extend(r for r in snap.rules if r.fits_display_config(compatible_with.displays))
-            return rules
+            geometry = display_cache.get_geometry()
+            if (store := self._synced_store()) is not None:
+                # only layouts can be compatible, and those without rules would add nothing
+                layouts = (self.data[position] for position in store.find_layouts_with_rules())
+                compatible = (
+                    snap
+                    for snap in layouts
+                    if snap != compatible_with and compatible_with.matches_display_config(snap.displays)
+                )
+            else:
+                compatible = self.get_compatible_snapshots(compatible_with)
+            for snap in compatible:
+                rules.extend(r for r in snap.rules if r.fits_display_config(compatible_with.displays, geometry))
+
+            if len(self._rules_cache) >= 32:
+                self._rules_cache.clear()
+            result = self._rules_cache[key] = (compatible_with, tuple(rules))
+            return result[1]
+
+    def last_known_process_instance(
+        self, window: Window, match_title=False, match_resizability=True
+    ) -> Optional[Window]:
+        """
+        Find the most recent window from the same executable as `window` in the current snapshot's
+        history. See `Snapshot.last_known_process_instance`
+        """
+        with self.lock:
+            snap = self.get_current_snapshot()
+            if (position := self._store_position(snap)) is None:
+                return snap.last_known_process_instance(
+                    window, match_title=match_title, match_resizability=match_resizability
+                )
+            instances = [
+                snap.history[capture].windows[index]
+                for capture, index in self.store.find_process_instances(position, window.executable)
+            ]
+
+        if match_resizability:
+            instances = [w for w in instances if bool(w.resizable) == bool(window.resizable)]
+        if not match_title:
+            return next(iter(instances), None)
+
+        words = window.name.split()
+
+        def shared_words(other: Window) -> int:
+            count = 0
+            for a, b in zip(reversed(words), reversed(other.name.split())):
+                if a != b:
+                    break
+                count += 1
+            return count
+
+        # same priority as `LKPIndex.find`: exact title, then most trailing words in common, then most recent.
+        # `max` keeps the first of equal items, and `instances` is most recent first
+        return max(instances, key=lambda w: (w.name == window.name, shared_words(w)), default=None)
 
     def prune_history(self):
         settings = load_json('settings')
+        prune = settings.get('prune_history', True)
+        ttl = settings.get('window_history_ttl', 0)
+        maximum = settings.get('max_snapshots', 10)
         with self.lock:
-            for snapshot in self.data:
-                if snapshot.phony:
-                    continue
-                snapshot.cleanup(
-                    prune=settings.get('prune_history', True),
-                    ttl=settings.get('window_history_ttl', 0),
-                    maximum=settings.get('max_snapshots', 10),
-                )
+            for snapshot in self._find_prunable(prune, ttl, maximum):
+                snapshot.cleanup(prune=prune, ttl=ttl, maximum=maximum)
+
+    def _find_prunable(self, prune: bool, ttl: float, maximum: int) -> list[Snapshot]:
+        """
+        Returns:
+            The non-phony snapshots that `Snapshot.cleanup` might change
+        """
+        if self.store is None:
+            return [snapshot for snapshot in self.data if not snapshot.phony]
+
+        # The store isn't synced first, since this is called for every capture. It can only be missing
+        # changes made since the last save, and the only ones that could need pruning are new captures
+        # in the most recently updated snapshot, which is always included
+        fingerprints = self.store.find_expired(time.time() - ttl if ttl else None, maximum)
+        if prune:
+            dead = set()
+            for hwnd in self.store.find_window_ids():
+                try:
+                    if win32gui.IsWindow(hwnd) != 1:
+                        dead.add(hwnd)
+                except pywintypes.error as e:
+                    log.debug(f'could not check whether window {hwnd} exists: {e}')
+            fingerprints |= self.store.find_snapshots_with_windows(dead)
+
+        found = {id(self._index[f]) for f in fingerprints if f in self._index}
+        if self._last_updated is not None:
+            found.add(id(self._last_updated))
+        return [snapshot for snapshot in self.data if id(snapshot) in found and not snapshot.phony]
+
+    def update(self, hwnds: Optional[Iterable[int]] = None) -> bool:
+        """
+        Captures a new snapshot, updates and prunes the history then saves to disk.
+        If no windows have changed since the last capture then the history is left as-is.
 
-    def update(self):
-        """Captures a new snapshot, updates and prunes the history then saves to disk"""
-        timestamp, displays, windows = self.capture()
+        Must not be called while holding `self.lock`, since `_update_lock` is always taken first.
 
-        if not displays:
-            return
+        Args:
+            hwnds: only re-capture these windows. See `IncrementalCapture.capture`
 
-        with self.lock:
-            wh = WindowHistory(time=timestamp, windows=windows)
-            for item in self.data:
-                if item.displays == displays:
-                    # add current config to history
-                    item.history.append(wh)
-                    item.mru = None
-                    break
-            else:
-                self.data.append(Snapshot(displays=displays, history=[wh]))
+        Returns:
+            Whether a new capture was added to the history
+        """
+        self._log.info('capture snapshot')
+        # `self.lock` is not held during the capture so that readers aren't blocked on it, but
+        # captures from the periodic, event-driven and manual paths must still not interleave
+        with self._update_lock:
+            timestamp, displays = time.time(), display_cache.get()
 
-            self.prune_history()
+            if not displays:
+                return False
 
-            self.save()
+            windows, changed = self._capture.capture(hwnds)
+
+            with self.lock:
+                return self._add_capture(timestamp, displays, windows, changed) is not None
+
+    def _add_capture(
+        self, timestamp: float, displays: list[Display], windows: list[Window], changed: bool
+    ) -> Optional[Snapshot]:
+        """
+        Add a capture to the history of the snapshot for `displays`, creating the snapshot if needed.
+        Must be called while holding `self.lock`
+
+        Returns:
+            The snapshot, or None if nothing has changed since the last capture so it was skipped
+        """
+        item = self.find_snapshot(displays)
+        if item is not None:
+            if not changed and item is self._last_updated and item.history:
+                self._log.debug('no windows changed since last capture, skip update')
+                return None
+            # add current config to history
+            item.history.append(WindowHistory(time=timestamp, windows=windows))
+            item.mru = None
+        else:
+            # displays are shared with the cache, so copy them in case the snapshot gets edited
+            item = Snapshot(displays=deepcopy(displays), history=[WindowHistory(time=timestamp, windows=windows)])
+            self.data.append(item)
+            self._index[display_fingerprint(displays)] = item
+        self._last_updated = item
+
+        self.prune_history()
+
+        self.save()
+        return item
+
+
+class SnapshotWriter(Service):
+    """
+    Writes snapshot changes to disk on a background thread, so that capture, restore and GUI threads
+    don't have to wait on disk I/O. Requests that arrive in quick succession are coalesced into one write.
+
+    The snapshot lock is only held while the changes are serialised. Encoding and writing them
+    happens outside the lock.
+    """
+
+    def __init__(self, snapshot: 'SnapshotFile', delay: float = 0.5):
+        """
+        Args:
+            snapshot: the snapshot file to write
+            delay: how long to wait for more requests before writing
+        """
+        super().__init__(None)
+        self.snapshot = snapshot
+        self.delay = delay
+        self.writes = 0
+        """The number of writes made"""
+        self._cond = threading.Condition()
+        self._requested = 0
+        self._written = 0
+        self._flushing = False
+        self._compact = False
+        self._write_lock = threading.Lock()
+        """Held from working out the changes until they are written, so that writes can't be reordered"""
+
+    def request(self, compact=False):
+        """
+        Ask for the snapshot file to be written
+
+        Args:
+            compact: also compact the journal into the base file
+        """
+        with self._cond:
+            if self._thread is None:
+                self.start()
+            self._requested += 1
+            self._compact = self._compact or compact
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every request made so far has been written
+
+        Returns:
+            Whether everything was written before the timeout
+        """
+        with self._cond:
+            target = self._requested
+            if self._written >= target:
+                return True
+            if self._thread.is_alive():
+                self._flushing = True
+                self._cond.notify_all()
+                return self._cond.wait_for(lambda: self._written >= target, timeout)
+
+        # writer has been stopped, so write on this thread instead
+        self.write_now()
+        return True
+
+    def write_now(self) -> bool:
+        """
+        Write every request made so far on this thread, rather than waiting for the writer thread.
+        Unlike `flush`, this can be called while holding the snapshot lock
+
+        Returns:
+            Whether everything was written successfully
+        """
+        with self._cond:
+            target = self._requested
+            if self._written >= target:
+                return True
+        if not self._write():
+            return False
+        with self._cond:
+            self._written = max(self._written, target)
+            self._cond.notify_all()
+        return True
+
+    def stop(self, timeout=10) -> bool:
+        self._kill_signal.set()
+        with self._cond:
+            self._cond.notify_all()
+        return super().stop(timeout)
+
+    def _runner(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._requested > self._written or self._kill_signal.is_set())
+                if self._requested == self._written:
+                    return
+                # give any other requests in this burst a chance to arrive
+                self._cond.wait_for(lambda: self._flushing or self._kill_signal.is_set(), self.delay)
+                target = self._requested
+
+            self._write()
+
+            with self._cond:
+                self._written = max(self._written, target)
+                if self._written >= self._requested:
+                    self._flushing = False
+                self._cond.notify_all()
+
+    def _write(self) -> bool:
+        """
+        Returns:
+            Whether the changes were written successfully. Failures are logged
+        """
+        journal = self.snapshot.journal
+        try:
+            with ExitStack() as stack:
+                with self.snapshot.lock:
+                    # always taken after the snapshot lock, so that `write_now` can be called while holding it
+                    stack.enter_context(self._write_lock)
+                    records = journal.diff(self.snapshot.data)
+                    checkpoint = None
+                    if self._compact or journal.needs_compaction():
+                        self._compact = False
+                        checkpoint = journal.checkpoint(self.snapshot.data)
+
+                journal.append(records)
+                if checkpoint is not None:
+                    journal.compact(checkpoint)
+                self.writes += 1
+            return True
+        except Exception:
+            # the journal may now end in a partial record, which would hide anything appended after it
+            self._compact = True
+            self.log.exception('failed to write snapshot file')
+            return False
+
+
+class AdaptiveInterval:
+    """
+    Works out how long to wait between captures. The interval starts at `base` and is multiplied by
+    `factor` every time a capture finds that nothing has changed, up to `ceiling`. As soon as a
+    capture finds that windows have moved, the interval drops back down to `base`.
+    """
+
+    def __init__(self, base: float, ceiling: float, factor: float = 2):
+        self.base = base
+        self.ceiling = ceiling
+        self.factor = factor
+        self.current = base
+
+    def next(self, changed: bool) -> float:
+        """
+        Args:
+            changed: whether the most recent capture found any changes
+
+        Returns:
+            The number of seconds to wait until the next capture
+        """
+        if changed:
+            self.current = self.base
+        else:
+            self.current = self.current * self.factor
+        # clamp in case base/ceiling have been changed since the last call
+        self.current = max(self.base, min(self.current, max(self.base, self.ceiling)))
+        return self.current
 
 
 class SnapshotService(Service):
     def _runner(self, snapshot: SnapshotFile):
-        count = 0
         settings = load_json('settings')
+        if settings.get('event_driven_snapshots', False):
+            self._run_event_driven(snapshot)
+            return
+
+        count = 0
+        interval = AdaptiveInterval(settings.get('snapshot_freq', 30), settings.get('adaptive_snapshot_ceiling', 600))
         while not self._kill_signal.is_set():
+            changed = False
             if not settings.get('pause_snapshots', False):
-                snapshot.update()
+                changed = snapshot.update()
                 count += 1
 
             if count >= settings.get('save_freq', 1):
                 snapshot.save()
                 count = 0
 
+            if settings.get('adaptive_snapshot_freq', False):
+                interval.base = settings.get('snapshot_freq', 30)
+                interval.ceiling = settings.get('adaptive_snapshot_ceiling', 600)
+                delay = interval.next(changed)
+                self.log.debug(f'next capture in {delay}s')
+            else:
+                delay = settings.get('snapshot_freq', 30)
+
             sleep_start = time.time()
-            while time.time() - sleep_start < settings.get('snapshot_freq', 30):
+            while time.time() - sleep_start < delay:
                 time.sleep(0.5)
                 if self._kill_signal.is_set():
                     return
+
+    def _run_event_driven(self, snapshot: SnapshotFile):
+        """
+        Rather than polling, listen for window events and capture the affected windows
+        once they have settled down
+        """
+        settings = load_json('settings')
+        tracker = DirtyWindowTracker(quiet_period=settings.get('snapshot_quiet_period', 1))
+        events = WindowEventService(ServiceCallback(tracker.push))
+        events.start()
+        try:
+            # do a full capture to start off with, so that we have something to compare future events against
+            snapshot.update()
+            count = 0
+            while not self._kill_signal.wait(timeout=0.1):
+                if settings.get('pause_snapshots', False):
+                    continue
+                dirty = tracker.pop_ready()
+                if not dirty:
+                    continue
+                self.log.debug(f'capture {len(dirty)} changed windows')
+                snapshot.update(dirty)
+                count += 1
+
+                if count >= settings.get('save_freq', 1):
+                    snapshot.save()
+                    count = 0
+        finally:
+            events.stop()
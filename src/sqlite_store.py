@@ -0,0 +1,430 @@
+"""
+SQLite storage for the snapshot history, as an alternative to `history.json` and its journal.
+Selected with the `history_backend` setting.
+
+Each journal record is applied to the database as a single transaction, so there is nothing to compact.
+Windows are stored once per distinct window state and referenced from each capture they appear in,
+which does the same job as the delta encoding used by the JSON backend.
+
+The full history is still loaded into memory at startup, but `SnapshotFile` answers its restore, rule,
+last known process and pruning lookups with the indexed queries below. Snapshots are identified by their
+position, which matches their index in `SnapshotFile.data` once all outstanding records have been appended.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from typing import Any, Iterable, Optional
+
+from common import Display, DisplayFingerprint, display_fingerprint
+from journal import HistoryJournal, decode_capture, decode_history
+
+log = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+"""Stored in `PRAGMA user_version`. Increment when the schema changes"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    phony TEXT NOT NULL,
+    mru REAL,
+    comparison_params TEXT NOT NULL,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_position ON snapshots (position);
+CREATE INDEX IF NOT EXISTS snapshots_fingerprint ON snapshots (fingerprint, position);
+
+CREATE TABLE IF NOT EXISTS displays (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS displays_snapshot ON displays (snapshot_id, position);
+
+CREATE TABLE IF NOT EXISTS rules (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rules_snapshot ON rules (snapshot_id, position);
+
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captures_time ON captures (snapshot_id, time);
+CREATE INDEX IF NOT EXISTS captures_age ON captures (time);
+
+CREATE TABLE IF NOT EXISTS windows (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL UNIQUE,
+    hwnd INTEGER,
+    executable TEXT
+);
+CREATE INDEX IF NOT EXISTS windows_hwnd ON windows (hwnd);
+CREATE INDEX IF NOT EXISTS windows_executable ON windows (executable);
+
+CREATE TABLE IF NOT EXISTS capture_windows (
+    capture_id INTEGER NOT NULL REFERENCES captures (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    window_id INTEGER NOT NULL REFERENCES windows (id),
+    PRIMARY KEY (capture_id, position)
+);
+CREATE INDEX IF NOT EXISTS capture_windows_window ON capture_windows (window_id);
+"""
+
+
+def encode_fingerprint(fingerprint: DisplayFingerprint) -> str:
+    return json.dumps(fingerprint)
+
+
+def decode_fingerprint(data: str) -> DisplayFingerprint:
+    return tuple((uid, name, tuple(resolution), tuple(rect)) for uid, name, resolution, rect in json.loads(data))
+
+
+class SqliteHistoryStore(HistoryJournal):
+    def __init__(self, db_file: str, base_file: str, journal_file: str):
+        """
+        Args:
+            db_file: the SQLite database
+            base_file: `history.json`, to migrate from if the database is empty
+            journal_file: the journal belonging to `base_file`
+        """
+        super().__init__(base_file, journal_file)
+        self.db_file = db_file
+        self._db = self._connect()
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version > SCHEMA_VERSION:
+            # same as the JSON backend, don't overwrite a newer version's history
+            log.error(f'{db_file!r} has unsupported schema version {version}, set it aside and start a new history')
+            self._db.close()
+            os.replace(db_file, f'{db_file}.v{version}')
+            self._db = self._connect()
+            version = SCHEMA_VERSION
+        data = []
+        if version < SCHEMA_VERSION:
+            # rebuild the tables from their contents, rather than migrating each schema change
+            if self._has_snapshots():
+                log.info(f'upgrade {db_file!r} from schema version {version} to {SCHEMA_VERSION}')
+                data = self._read_all()
+            with self._db:
+                for table in ('capture_windows', 'windows', 'captures', 'rules', 'displays', 'snapshots'):
+                    self._db.execute(f'DROP TABLE IF EXISTS {table}')
+        self._db.executescript(SCHEMA)
+        self._db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        if data:
+            self.compact(data)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_file, check_same_thread=False)
+        db.execute('PRAGMA foreign_keys = ON')
+        return db
+
+    def _has_snapshots(self) -> bool:
+        try:
+            return self._db.execute('SELECT 1 FROM snapshots LIMIT 1').fetchone() is not None
+        except sqlite3.OperationalError:
+            # table doesn't exist yet
+            return False
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def load(self) -> list[dict]:
+        with self._lock:
+            if not self._has_snapshots():
+                data = super().load()
+                if data:
+                    log.info(f'migrate {len(data)} snapshots from {self.base_file!r} to {self.db_file!r}')
+                    self.compact(data)
+                return data
+            return self._read_all()
+
+    def _read_all(self) -> list[dict]:
+        db = self._db
+        # windows that appear in multiple captures are decoded once and shared
+        window_cache: dict[int, dict] = {}
+
+        def get_window(window_id: int, data: str) -> dict:
+            if (window := window_cache.get(window_id)) is None:
+                window = window_cache[window_id] = json.loads(data)
+            return window
+
+        result = []
+        for snapshot_id, mru, phony, comparison_params in db.execute(
+            'SELECT id, mru, phony, comparison_params FROM snapshots ORDER BY position'
+        ):
+            history = []
+            for capture_id, time in db.execute(
+                'SELECT id, time FROM captures WHERE snapshot_id = ? ORDER BY position', (snapshot_id,)
+            ):
+                rows = db.execute(
+                    'SELECT w.id, w.data FROM capture_windows c JOIN windows w ON w.id = c.window_id'
+                    ' WHERE c.capture_id = ? ORDER BY c.position',
+                    (capture_id,),
+                )
+                history.append({'time': time, 'windows': [get_window(*row) for row in rows]})
+            result.append(
+                {
+                    'displays': self._read_list('displays', snapshot_id),
+                    'history': history,
+                    'mru': mru,
+                    'rules': self._read_list('rules', snapshot_id),
+                    'phony': phony,
+                    'comparison_params': json.loads(comparison_params),
+                }
+            )
+        return result
+
+    def _read_list(self, table: str, snapshot_id: int) -> list[dict]:
+        rows = self._db.execute(f'SELECT data FROM {table} WHERE snapshot_id = ? ORDER BY position', (snapshot_id,))
+        return [json.loads(data) for (data,) in rows]
+
+    def append(self, records: list[dict]):
+        with self._lock:
+            if records:
+                with self._db:
+                    for record in records:
+                        self._apply_record(record)
+                    self._delete_unused_windows()
+            self._written()
+
+    def needs_compaction(self) -> bool:
+        return False
+
+    def compact(self, data: list[dict]):
+        """Replace everything in the database with `data`"""
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM snapshots')
+            for position, snapshot in enumerate(data):
+                self._insert_snapshot(position, snapshot)
+            self._delete_unused_windows()
+        self._written()
+
+    def find_snapshot(self, fingerprint: DisplayFingerprint) -> Optional[int]:
+        """
+        Returns:
+            The position of the first non-phony snapshot for a display configuration, or None if there isn't one
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT position FROM snapshots WHERE fingerprint = ? ORDER BY position LIMIT 1',
+                (encode_fingerprint(fingerprint),),
+            ).fetchone()
+            return None if row is None else row[0]
+
+    def find_capture(self, snapshot: int, time: Optional[float] = None) -> Optional[int]:
+        """
+        Args:
+            snapshot: the position of the snapshot
+            time: when the capture was taken. If not given, the most recent capture is returned
+
+        Returns:
+            The position of the capture within the snapshot's history, or None if there isn't one
+        """
+        query = 'SELECT position FROM captures WHERE snapshot_id = (SELECT id FROM snapshots WHERE position = ?)'
+        with self._lock:
+            if time is None:
+                row = self._db.execute(f'{query} ORDER BY time DESC LIMIT 1', (snapshot,)).fetchone()
+            else:
+                row = self._db.execute(f'{query} AND time = ?', (snapshot, time)).fetchone()
+            return None if row is None else row[0]
+
+    def find_layouts_with_rules(self) -> list[int]:
+        """
+        Returns:
+            The positions of phony snapshots that have at least one rule, in order
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT position FROM snapshots s WHERE phony != ''"
+                ' AND EXISTS (SELECT 1 FROM rules r WHERE r.snapshot_id = s.id) ORDER BY position'
+            )
+            return [position for (position,) in rows]
+
+    def find_process_instances(self, snapshot: int, executable: str) -> list[tuple[int, int]]:
+        """
+        Args:
+            snapshot: the position of the snapshot to search the history of
+            executable: the executable the windows came from
+
+        Returns:
+            The capture and window positions of every window from `executable`, most recent first
+        """
+        with self._lock:
+            return self._db.execute(
+                'SELECT c.position, cw.position FROM windows w'
+                ' JOIN capture_windows cw ON cw.window_id = w.id'
+                ' JOIN captures c ON c.id = cw.capture_id'
+                ' JOIN snapshots s ON s.id = c.snapshot_id'
+                ' WHERE w.executable = ? AND s.position = ?'
+                ' ORDER BY c.position DESC, cw.position DESC',
+                (executable, snapshot),
+            ).fetchall()
+
+    def find_expired(self, before: Optional[float], maximum: int) -> set[DisplayFingerprint]:
+        """
+        Args:
+            before: find snapshots with captures taken before this time. Set to None to ignore
+            maximum: find snapshots with more than this many captures
+
+        Returns:
+            The display configurations of the non-phony snapshots found
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT s.fingerprint FROM snapshots s JOIN captures c ON c.snapshot_id = s.id'
+                ' WHERE s.fingerprint IS NOT NULL GROUP BY s.id HAVING COUNT(*) > ?',
+                (maximum,),
+            ).fetchall()
+            if before is not None:
+                rows += self._db.execute(
+                    'SELECT fingerprint FROM snapshots WHERE fingerprint IS NOT NULL'
+                    ' AND id IN (SELECT snapshot_id FROM captures WHERE time < ?)',
+                    (before,),
+                ).fetchall()
+            return {decode_fingerprint(fingerprint) for (fingerprint,) in rows}
+
+    def find_window_ids(self) -> set[int]:
+        """
+        Returns:
+            The hwnd of every window in the history
+        """
+        with self._lock:
+            return {hwnd for (hwnd,) in self._db.execute('SELECT DISTINCT hwnd FROM windows WHERE hwnd IS NOT NULL')}
+
+    def find_snapshots_with_windows(self, hwnds: Iterable[int]) -> set[DisplayFingerprint]:
+        """
+        Returns:
+            The display configurations of the non-phony snapshots with any of these windows in their history
+        """
+        hwnds = list(hwnds)
+        if not hwnds:
+            return set()
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT DISTINCT s.fingerprint FROM windows w'
+                ' JOIN capture_windows cw ON cw.window_id = w.id'
+                ' JOIN captures c ON c.id = cw.capture_id'
+                ' JOIN snapshots s ON s.id = c.snapshot_id'
+                f' WHERE w.hwnd IN ({",".join("?" * len(hwnds))}) AND s.fingerprint IS NOT NULL',
+                hwnds,
+            )
+            return {decode_fingerprint(fingerprint) for (fingerprint,) in rows}
+
+    def _delete_unused_windows(self):
+        self._db.execute(
+            'DELETE FROM windows WHERE NOT EXISTS (SELECT 1 FROM capture_windows WHERE window_id = windows.id)'
+        )
+
+    def _snapshot_id(self, position: int) -> Optional[int]:
+        row = self._db.execute('SELECT id FROM snapshots WHERE position = ?', (position,)).fetchone()
+        return None if row is None else row[0]
+
+    def _apply_record(self, record: dict):
+        db = self._db
+        match record['op']:
+            case 'truncate':
+                db.execute('DELETE FROM snapshots WHERE position >= ?', (record['length'],))
+            case 'snapshot':
+                db.execute('DELETE FROM snapshots WHERE position = ?', (record['index'],))
+                self._insert_snapshot(record['index'], record['data'])
+            case 'meta':
+                snapshot_id = self._snapshot_id(record['index'])
+                db.execute('DELETE FROM displays WHERE snapshot_id = ?', (snapshot_id,))
+                db.execute('DELETE FROM rules WHERE snapshot_id = ?', (snapshot_id,))
+                self._write_meta(snapshot_id, record['data'])
+            case 'history':
+                snapshot_id = self._snapshot_id(record['index'])
+                # captures that deltas are based on, whether from the database or earlier in this record
+                bases: dict[float, Optional[dict]] = {}
+                changed = []
+                for entry in record['entries']:
+                    if 'delta' in entry and entry['base'] not in bases:
+                        bases[entry['base']] = self._read_capture(snapshot_id, entry['base'])
+                    if (decoded := decode_capture(entry, bases)) is not None:
+                        bases[decoded['time']] = decoded
+                        changed.append(decoded)
+
+                times = record['times']
+                db.execute(
+                    f'DELETE FROM captures WHERE snapshot_id = ? AND time NOT IN ({",".join("?" * len(times))})',
+                    (snapshot_id, *times),
+                )
+                for entry in changed:
+                    db.execute('DELETE FROM captures WHERE snapshot_id = ? AND time = ?', (snapshot_id, entry['time']))
+                    self._insert_capture(snapshot_id, 0, entry)
+                db.executemany(
+                    'UPDATE captures SET position = ? WHERE snapshot_id = ? AND time = ?',
+                    ((position, snapshot_id, time) for position, time in enumerate(times)),
+                )
+            case op:
+                raise KeyError(op)
+
+    def _read_capture(self, snapshot_id: int, time: float) -> Optional[dict]:
+        row = self._db.execute(
+            'SELECT id FROM captures WHERE snapshot_id = ? AND time = ?', (snapshot_id, time)
+        ).fetchone()
+        if row is None:
+            return None
+        rows = self._db.execute(
+            'SELECT w.data FROM capture_windows c JOIN windows w ON w.id = c.window_id'
+            ' WHERE c.capture_id = ? ORDER BY c.position',
+            (row[0],),
+        )
+        return {'time': time, 'windows': [json.loads(data) for (data,) in rows]}
+
+    def _insert_snapshot(self, position: int, snapshot: dict[str, Any]):
+        cursor = self._db.execute(
+            'INSERT INTO snapshots (position, phony, mru, comparison_params) VALUES (?, ?, ?, ?)',
+            (position, '', None, '{}'),
+        )
+        self._write_meta(cursor.lastrowid, snapshot)
+        for index, entry in enumerate(decode_history(snapshot.get('history', []))):
+            self._insert_capture(cursor.lastrowid, index, entry)
+
+    def _write_meta(self, snapshot_id: int, meta: dict[str, Any]):
+        fingerprint = None
+        if not meta.get('phony'):
+            fingerprint = encode_fingerprint(display_fingerprint(map(Display.from_json, meta.get('displays', []))))
+        self._db.execute(
+            'UPDATE snapshots SET phony = ?, mru = ?, comparison_params = ?, fingerprint = ? WHERE id = ?',
+            (
+                meta.get('phony') or '',
+                meta.get('mru'),
+                json.dumps(meta.get('comparison_params', {})),
+                fingerprint,
+                snapshot_id,
+            ),
+        )
+        for table in ('displays', 'rules'):
+            self._db.executemany(
+                f'INSERT INTO {table} (snapshot_id, position, data) VALUES (?, ?, ?)',
+                ((snapshot_id, index, json.dumps(item)) for index, item in enumerate(meta.get(table, []))),
+            )
+
+    def _insert_capture(self, snapshot_id: int, position: int, entry: dict[str, Any]):
+        capture_id = self._db.execute(
+            'INSERT INTO captures (snapshot_id, position, time) VALUES (?, ?, ?)',
+            (snapshot_id, position, entry['time']),
+        ).lastrowid
+        self._db.executemany(
+            'INSERT INTO capture_windows (capture_id, position, window_id) VALUES (?, ?, ?)',
+            ((capture_id, index, self._window_id(window)) for index, window in enumerate(entry['windows'])),
+        )
+
+    def _window_id(self, window: dict[str, Any]) -> int:
+        data = json.dumps(window)
+        row = self._db.execute('SELECT id FROM windows WHERE data = ?', (data,)).fetchone()
+        if row is not None:
+            return row[0]
+        return self._db.execute(
+            'INSERT INTO windows (data, hwnd, executable) VALUES (?, ?, ?)',
+            (data, window.get('id'), window.get('executable')),
+        ).lastrowid
@@ -2,7 +2,8 @@
 Module for wrangling additional functions out of Windows that the `win32api` family of packages doesn't expose.
 '''
 import ctypes
-from ctypes.wintypes import HWND, DWORD, RECT
+from ctypes.wintypes import BOOL, DWORD, HANDLE, HMODULE, HWND, LONG, LPWSTR, PDWORD, RECT
+from typing import Callable, Optional
 
 
 dwmapi = ctypes.WinDLL('dwmapi')
@@ -33,4 +34,78 @@ def GetDpiForMonitor(monitor: int) -> int:
     return dpi_x.value
 
 
-__all__ = ['DwmGetWindowAttribute', 'GetDpiForMonitor']
+kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+# without these, ctypes treats the process handle as a C int, which truncates it on 64 bit
+kernel32.OpenProcess.restype = HANDLE
+kernel32.OpenProcess.argtypes = (DWORD, BOOL, DWORD)
+kernel32.QueryFullProcessImageNameW.restype = BOOL
+kernel32.QueryFullProcessImageNameW.argtypes = (HANDLE, DWORD, LPWSTR, PDWORD)
+kernel32.CloseHandle.restype = BOOL
+kernel32.CloseHandle.argtypes = (HANDLE,)
+
+
+def QueryFullProcessImageName(pid: int) -> str:
+    '''
+    Opens a process with limited query rights and returns the path to its executable using
+    `kernel32.QueryFullProcessImageNameW`. Raises `OSError` if either step fails.
+
+    See: https://learn.microsoft.com/en-us/windows/win32/api/winbase/nf-winbase-queryfullprocessimagenamew
+    '''
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        raise ctypes.WinError(ctypes.get_last_error())
+    try:
+        size = DWORD(32768)
+        buffer = ctypes.create_unicode_buffer(size.value)
+        if not kernel32.QueryFullProcessImageNameW(handle, 0, buffer, ctypes.byref(size)):
+            raise ctypes.WinError(ctypes.get_last_error())
+        return buffer.value
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+user32 = ctypes.WinDLL('user32')
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+WinEventProc = ctypes.WINFUNCTYPE(None, HANDLE, DWORD, HWND, LONG, LONG, DWORD, DWORD)
+'''hWinEventHook, event, hwnd, idObject, idChild, idEventThread, dwmsEventTime'''
+# without these, ctypes treats the hook handle as a C int, which truncates it on 64 bit
+user32.SetWinEventHook.restype = HANDLE
+user32.SetWinEventHook.argtypes = (DWORD, DWORD, HMODULE, WinEventProc, DWORD, DWORD, DWORD)
+user32.UnhookWinEvent.restype = BOOL
+user32.UnhookWinEvent.argtypes = (HANDLE,)
+
+
+def SetWinEventHook(event_min: int, event_max: int, callback: Callable) -> tuple[Optional[int], Callable]:
+    '''
+    Exposes the `user32.SetWinEventHook` function as an out-of-context hook for all processes
+    except this one. Must be called from a thread that pumps messages.
+
+    See: https://learn.microsoft.com/en-us/windows/win32/api/winuser/nf-winuser-setwineventhook
+
+    Returns:
+        The hook handle (None if the hook could not be set) and the wrapped callback. A reference to the
+        callback must be kept until the hook is removed, otherwise it will be garbage collected.
+    '''
+    proc = WinEventProc(callback)
+    hook = user32.SetWinEventHook(
+        event_min, event_max, None, proc, 0, 0, WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS
+    )
+    return hook, proc
+
+
+def UnhookWinEvent(hook: int) -> bool:
+    '''
+    See: https://learn.microsoft.com/en-us/windows/win32/api/winuser/nf-winuser-unhookwinevent
+    '''
+    return bool(user32.UnhookWinEvent(hook))
+
+
+__all__ = [
+    'DwmGetWindowAttribute',
+    'GetDpiForMonitor',
+    'QueryFullProcessImageName',
+    'SetWinEventHook',
+    'UnhookWinEvent',
+]
@@ -1,16 +1,23 @@
 import ctypes
 import ctypes.wintypes
 import logging
+import re
+import threading
 import time
-from typing import Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, Optional, Sequence
 
+import pythoncom
 import pyvda
 import pywintypes
 import win32con
 import win32gui
 from comtypes import GUID
 
-from common import Rule, Window, load_json, match
+from common import CaptureContext, Placement, Rect, Rule, Window, compile_match, load_json, size_from_rect
+from geometry import DisplayGeometry
+from process import ResolverChain, process_cache
 from services import Service
 
 log = logging.getLogger(__name__)
@@ -28,6 +35,7 @@ class WindowSpawnService(Service):
     def _runner(self):
         def get_windows() -> dict[int, bool]:
             def fill(h, *_):
+                seen.add(h)
                 resizable = win32gui.GetWindowLong(h, win32con.GWL_STYLE) & win32con.WS_THICKFRAME
                 # if we've already seen this window and it hasn't changed its resizability status
                 if h in old and old[h] == resizable:
@@ -35,13 +43,16 @@ class WindowSpawnService(Service):
                 hwnds[h] = resizable
 
             hwnds = {}
+            seen: set[int] = set()
             win32gui.EnumWindows(fill, None)
+            cloak_cache.prune(seen)
             return hwnds
 
         def window_valid(hwnd):
-            return is_window_valid(hwnd) and (
+            ctx = CaptureContext.current()
+            return is_window_valid(hwnd, ctx) and (
                 not settings.get('on_window_spawn', {}).get('skip_non_resizable', False)
-                or win32gui.GetWindowLong(hwnd, win32con.GWL_STYLE) & win32con.WS_THICKFRAME
+                or ctx.get_style(hwnd) & win32con.WS_THICKFRAME
             )
 
         settings = load_json('settings')
@@ -57,7 +68,8 @@ class WindowSpawnService(Service):
                 # wait for window to load in before checking validity
                 time.sleep(0.1)
                 try:
-                    windows = [Window.from_hwnd(h) for h in new if window_valid(h)]
+                    with CaptureContext():
+                        windows = [Window.from_hwnd(h) for h in new if window_valid(h)]
                 except Exception:
                     self.log.info('failed to get list of newly spawned windows')
                 else:
@@ -67,116 +79,601 @@ class WindowSpawnService(Service):
                         except Exception:
                             self.log.exception('failed to run callback on new window spawn')
             old.update(new)
-            old = {h: r for h, r in old.items() if is_window_valid(h)}
+            with CaptureContext():
+                old = {h: r for h, r in old.items() if is_window_valid(h)}
 
 
-def is_window_cloaked(hwnd) -> bool:
+def get_dwm_cloak_state(hwnd: int) -> int:
     # https://stackoverflow.com/a/64597308
     # https://learn.microsoft.com/en-us/windows/win32/api/dwmapi/nf-dwmapi-dwmgetwindowattribute
     # https://learn.microsoft.com/en-us/windows/win32/api/dwmapi/ne-dwmapi-dwmwindowattribute
     cloaked = ctypes.c_int(0)
     ctypes.windll.dwmapi.DwmGetWindowAttribute(hwnd, 14, ctypes.byref(cloaked), ctypes.sizeof(cloaked))
-    if cloaked.value != 0:
+    return cloaked.value
+
+
+class CloakCache:
+    """
+    Caches whether cloaked windows are hidden or just on another virtual desktop, since working that
+    out involves several COM calls. Entries are invalidated when the window's DWM cloak state changes,
+    when the window is destroyed (see `prune`) and when the user switches virtual desktop.
+
+    Args:
+        desktop_check_interval: how often, in seconds, cache lookups check for a virtual desktop switch
+        clock: returns the current time in seconds
+    """
+
+    def __init__(self, desktop_check_interval: float = 1, clock: Callable[[], float] = time.monotonic):
+        self._lock = threading.RLock()
+        self._entries: dict[int, tuple[int, bool]] = {}
+        """hwnd -> (DWM cloak state, whether window is cloaked)"""
+        self._current_desktop: Optional[GUID] = None
+        self._desktops: Optional[set[GUID]] = None
+        self.desktop_check_interval = desktop_check_interval
+        self._clock = clock
+        self._last_desktop_check: Optional[float] = None
+
+    def check_desktop_switch(self, max_age: float = 0):
+        """
+        Invalidate the cache if the current virtual desktop has changed since the last check
+
+        Args:
+            max_age: skip the check if the last one was less than this many seconds ago
+        """
+        now = self._clock()
+        with self._lock:
+            if self._last_desktop_check is not None and now - self._last_desktop_check < max_age:
+                return
+            self._last_desktop_check = now
+        try:
+            current = pyvda.VirtualDesktop.current().id
+        except Exception:
+            current = None
+        with self._lock:
+            if current != self._current_desktop:
+                self._current_desktop = current
+                self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._desktops = None
+
+    def discard(self, hwnd: int):
+        with self._lock:
+            self._entries.pop(hwnd, None)
+
+    def prune(self, alive: Iterable[int]):
+        """Remove entries for windows that no longer exist"""
+        alive = set(alive)
+        with self._lock:
+            for hwnd in [h for h in self._entries if h not in alive]:
+                del self._entries[hwnd]
+
+    def get_desktops(self, refresh=False) -> set[GUID]:
+        with self._lock:
+            if self._desktops is None or refresh:
+                self._desktops = {d.id for d in pyvda.get_virtual_desktops()}
+            return self._desktops
+
+    def is_cloaked(self, hwnd: int) -> bool:
+        state = get_dwm_cloak_state(hwnd)
+        if state == 0:
+            return False
+        self.check_desktop_switch(max_age=self.desktop_check_interval)
+        with self._lock:
+            cached = self._entries.get(hwnd)
+            if cached is not None and cached[0] == state:
+                return cached[1]
+
         try:
             # this seems to do a pretty decent job catching all cloaked windows
             # whilst allowing windows on other v_desktops
-            app_view = pyvda.AppView(hwnd=hwnd)
-            if app_view.desktop_id == GUID():  # GUID({"00000000..."})
-                return True
-            assert app_view.desktop.number > 0
+            desktop_id = pyvda.AppView(hwnd=hwnd).desktop_id
+            if desktop_id == GUID():  # GUID({"00000000..."})
+                cloaked = True
+            elif desktop_id in self.get_desktops():
+                cloaked = False
+            else:
+                # desktop might have been created since we last fetched them
+                cloaked = desktop_id not in self.get_desktops(refresh=True)
         except Exception:
+            # don't cache this, so that the lookup is retried next time
             return True
-    return False
 
+        with self._lock:
+            self._entries[hwnd] = (state, cloaked)
+        return cloaked
+
+
+cloak_cache = CloakCache()
 
-def is_window_valid(hwnd: int) -> bool:
-    if not win32gui.IsWindow(hwnd):
+
+def is_window_cloaked(hwnd) -> bool:
+    return cloak_cache.is_cloaked(hwnd)
+
+
+def get_titlebar_state(hwnd: int) -> int:
+    titlebar = TitleBarInfo()
+    titlebar.cbSize = ctypes.sizeof(titlebar)
+    ctypes.windll.user32.GetTitleBarInfo(hwnd, ctypes.byref(titlebar))
+    return titlebar.rgState[0]
+
+
+def is_window_valid(hwnd: int, ctx: Optional[CaptureContext] = None) -> bool:
+    """
+    Args:
+        hwnd: the window handle
+        ctx: context to read window info from. Defaults to the active context, if any
+    """
+    ctx = ctx or CaptureContext.current()
+    # cheapest checks first so that most windows are rejected early
+    if not ctx.is_window(hwnd):
         return False
-    if not win32gui.IsWindowVisible(hwnd):
+    if not ctx.query(win32gui.IsWindowVisible, hwnd):
         return False
-    if not win32gui.GetWindowText(hwnd):
+    if ctx.get_rect(hwnd) == (0, 0, 0, 0):
         return False
-    if win32gui.GetWindowRect(hwnd) == (0, 0, 0, 0):
+    if not ctx.get_text(hwnd):
         return False
-    if is_window_cloaked(hwnd):
+    if ctx.query(get_titlebar_state, hwnd) & win32con.STATE_SYSTEM_INVISIBLE:
         return False
+    return not ctx.query(is_window_cloaked, hwnd)
 
-    titlebar = TitleBarInfo()
-    titlebar.cbSize = ctypes.sizeof(titlebar)
-    ctypes.windll.user32.GetTitleBarInfo(hwnd, ctypes.byref(titlebar))
-    return not titlebar.rgState[0] & win32con.STATE_SYSTEM_INVISIBLE
 
+@lru_cache
+def get_capture_pool(workers: int) -> ThreadPoolExecutor:
+    """Get a shared thread pool for collecting window info during captures"""
+    # window validity checks use COM (see `is_window_cloaked`), so initialise it once per worker
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='capture', initializer=pythoncom.CoInitialize)
 
-def capture_snapshot() -> list[Window]:
-    def callback(hwnd, *_):
-        if is_window_valid(hwnd):
+
+WindowSignature = tuple[Rect, Placement, str, int]
+"""Rect, placement, title, style"""
+
+
+def get_window_signature(hwnd: int, ctx: Optional[CaptureContext] = None) -> WindowSignature:
+    """Get the properties of a window that are used to detect whether it has changed"""
+    ctx = ctx or CaptureContext.current()
+    return (ctx.get_rect(hwnd), ctx.get_placement(hwnd), ctx.get_text(hwnd), ctx.get_style(hwnd))
+
+
+class IncrementalCapture:
+    """
+    Captures the current windows, re-using the `Window` objects from the previous capture
+    for any window whose signature (rect, placement, title and style) has not changed.
+    """
+
+    def __init__(self):
+        self._previous: dict[int, tuple[WindowSignature, Window]] = {}
+        self._lock = threading.Lock()
+        """Held for the whole of a capture, since each capture is compared against the one before it"""
+
+    def capture(self, hwnds: Optional[Iterable[int]] = None) -> tuple[list[Window], bool]:
+        """
+        Args:
+            hwnds: only re-check these windows, assuming all others are unchanged since the
+                last capture. By default, all windows are enumerated and checked
+
+        Returns:
+            The captured windows and whether any windows have changed since the last capture
+        """
+        with self._lock:
+            cloak_cache.check_desktop_switch()
+            with CaptureContext() as ctx:
+                return self._capture(ctx, hwnds)
+
+    def _capture(self, ctx: CaptureContext, hwnds: Optional[Iterable[int]]) -> tuple[list[Window], bool]:
+        def collect(hwnd: int) -> Optional[tuple[WindowSignature, int]]:
+            if not is_window_valid(hwnd, ctx):
+                return None
             try:
-                snapshot.append(Window.from_hwnd(hwnd))
+                return get_window_signature(hwnd, ctx), ctx.get_pid(hwnd)
             except pywintypes.error:
                 log.error(f'could not load window info for hwnd: {hwnd}')
+                return None
+
+        if hwnds is None:
+            order: list[int] = []
+            win32gui.EnumWindows(lambda hwnd, _: order.append(hwnd), None)
+            cloak_cache.prune(order)
+            to_check = order
+        else:
+            hwnds = set(hwnds)
+            # preserve the order of existing windows
+            order = list(self._previous) + sorted(hwnds - self._previous.keys())
+            to_check = [hwnd for hwnd in order if hwnd in hwnds]
+
+        workers = load_json('settings').get('capture_threads', 4)
+        if workers > 1 and len(to_check) > 1:
+            # `map` returns results in the same order as the inputs
+            collected = dict(zip(to_check, get_capture_pool(workers).map(collect, to_check)))
+        else:
+            collected = {hwnd: collect(hwnd) for hwnd in to_check}
+
+        current: dict[int, tuple[WindowSignature, Window] | None] = {}
+        pids: dict[int, int] = {}
+        signatures: dict[int, WindowSignature] = {}
+        for hwnd in order:
+            if hwnd not in collected:
+                # not re-checked this time, assume unchanged
+                current[hwnd] = self._previous[hwnd]
+                continue
+            if (result := collected[hwnd]) is None:
+                continue
+            signature, pid = result
+            previous = self._previous.get(hwnd)
+            if previous is not None and previous[0] == signature:
+                current[hwnd] = previous
+            else:
+                current[hwnd] = None
+                pids[hwnd] = pid
+                signatures[hwnd] = signature
+
+        if not pids and current.keys() == self._previous.keys():
+            return [entry[1] for entry in self._previous.values()], False
+
+        # resolve processes for all new/changed windows in one go
+        executables = process_cache.get_executables(pids.values())
+
+        for hwnd, pid in pids.items():
+            if pid not in executables:
+                log.warning(f'could not resolve executable for hwnd: {hwnd}, pid: {pid}')
+            rect, placement, name, _ = signature = signatures[hwnd]
+            window = Window(
+                id=hwnd,
+                name=name,
+                executable=executables.get(pid, ''),
+                size=size_from_rect(rect),
+                rect=rect,
+                placement=placement,
+            )
+            current[hwnd] = (signature, window)
+
+        process_cache.prune()
+        log.debug(f'process cache: {len(process_cache)} entries, {process_cache.stats}')
+        if isinstance(process_cache.resolver, ResolverChain):
+            log.debug(f'executable resolvers: {process_cache.resolver.get_stats()}')
+
+        self._previous = current  # type: ignore  # all `None` values were filled in above
+        return [entry[1] for entry in self._previous.values()], True
+
+
+def capture_snapshot() -> list[Window]:
+    return IncrementalCapture().capture()[0]
+
+
+class LazyWindow:
+    """
+    A handle to a live window that reads its properties on demand. Resolving the executable
+    means looking up the owning process, so it's only done when something actually needs it
+    """
+
+    def __init__(self, hwnd: int, ctx: Optional[CaptureContext] = None):
+        self.id = hwnd
+        self._ctx = ctx or CaptureContext.current()
+        self._executable: Optional[str] = None
+        self._window: Optional[Window] = None
+
+    @property
+    def name(self) -> str:
+        return self._ctx.get_text(self.id)
 
-    snapshot: list[Window] = []
-    win32gui.EnumWindows(callback, None)
-    return snapshot
+    @property
+    def rect(self) -> Rect:
+        return self._ctx.get_rect(self.id)
 
+    @property
+    def executable(self) -> str:
+        if self._executable is None:
+            self._executable = process_cache.get_executable(self._ctx.get_pid(self.id))
+        return self._executable
 
-def find_matching_rules(rules: list[Rule], window: Window) -> Iterator[Rule]:
-    matching: list[tuple[int, Rule]] = []
-    for rule in rules:
-        points = 0
-        for attr in ('name', 'executable'):
-            rv = getattr(rule, attr)
-            wv = getattr(window, attr)
-            p = match(rv, wv)
-            if not p:
+    def resolve(self) -> Window:
+        """
+        Returns:
+            The full `Window`. The executable is left blank if it hasn't been resolved yet,
+            since it's not needed for moving windows around
+        """
+        if self._window is None:
+            self._window = Window.from_hwnd(self.id, executable=self._executable or '', ctx=self._ctx)
+        return self._window
+
+
+REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+class RuleIndex:
+    """
+    Pre-processes a set of rules so that windows can be matched against them without re-compiling
+    every pattern or checking every rule. Rules are bucketed by their executable pattern:
+
+    - no executable: checked against every window, without needing its executable
+    - plain text: can only match as a case-insensitive prefix, so are looked up by prefix
+    - invalid regex: can only match exactly, so are looked up by executable path
+    - everything else is a regex, which has to be checked against every window
+
+    A window's executable is only read if one of the rules that filter on it matches the window's title,
+    since resolving it for a live window means looking up the owning process.
+    """
+
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules = list(rules)
+        self._matchers = [(compile_match(r.name), compile_match(r.executable)) for r in self.rules]
+        self._unfiltered: list[int] = []
+        """Rules without an executable pattern"""
+        self._filtered: list[int] = []
+        """Rules with an executable pattern, in every bucket below"""
+        self._regex: list[int] = []
+        self._exact: dict[str, list[int]] = {}
+        self._prefix: dict[str, list[int]] = {}
+        self._prefix_lengths: list[int] = []
+
+        for index, rule in enumerate(self.rules):
+            exe = rule.executable
+            if not exe or not isinstance(exe, str):
+                self._unfiltered.append(index)
+                continue
+            self._filtered.append(index)
+            if exe.isascii() and REGEX_METACHARS.isdisjoint(exe):
+                self._prefix.setdefault(exe.casefold(), []).append(index)
+            else:
+                try:
+                    re.compile(exe)
+                except re.error:
+                    self._exact.setdefault(exe, []).append(index)
+                else:
+                    self._regex.append(index)
+        self._prefix_lengths = sorted({len(k) for k in self._prefix})
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _candidates(self, executable: Optional[str]) -> Iterable[int]:
+        """
+        Returns:
+            The rules with an executable pattern that could match `executable`
+        """
+        if not isinstance(executable, str):
+            # `match` treats `None` as matching anything
+            return self._filtered
+
+        candidates = list(self._regex)
+        candidates.extend(self._exact.get(executable, ()))
+        folded = executable.casefold()
+        for length in self._prefix_lengths:
+            if length > len(folded):
                 break
-            if rv:
-                points += p
-        else:
-            matching.append((points, rule))
-    return (i[1] for i in sorted(matching, reverse=True, key=lambda m: m[0]))
+            candidates.extend(self._prefix.get(folded[:length], ()))
+        return candidates
+
+    def _score(self, index: int, field: int, value: Optional[str]) -> Optional[int]:
+        """
+        Args:
+            index: the rule to check
+            field: 0 for the name, 1 for the executable
+            value: the window's name or executable
+
+        Returns:
+            The points the field adds to the rule's score, or None if it doesn't match
+        """
+        if not (points := self._matchers[index][field](value)):
+            return None
+        rule = self.rules[index]
+        return points if (rule.name, rule.executable)[field] else 0
+
+    def find_matching(self, window: Window | LazyWindow) -> list[Rule]:
+        """
+        Returns:
+            All rules that match the window, best matches first. Rules that match
+            equally well are returned in the order they were given
+        """
+        matching: list[tuple[int, int]] = []
+        name = window.name
+        for index in self._unfiltered:
+            if (points := self._score(index, 0, name)) is not None:
+                matching.append((-points, index))
+
+        if any(self._score(index, 0, name) is not None for index in self._filtered):
+            executable = window.executable
+            for index in self._candidates(executable):
+                if (name_points := self._score(index, 0, name)) is None:
+                    continue
+                if (exe_points := self._score(index, 1, executable)) is not None:
+                    matching.append((-(name_points + exe_points), index))
+        return [self.rules[i[1]] for i in sorted(matching)]
+
+
+_rule_indexes: dict[tuple[int, ...], RuleIndex] = {}
+_rule_index_lock = threading.Lock()
+
+
+def get_rule_index(rules: Sequence[Rule]) -> RuleIndex:
+    """
+    Get the `RuleIndex` for a set of rules, building it if it hasn't been used recently.
+    Call `invalidate_rule_indexes` after editing any rules.
+    """
+    # the index holds references to the rules, so their IDs can't be re-used while it is cached
+    key = tuple(map(id, rules))
+    with _rule_index_lock:
+        index = _rule_indexes.get(key)
+        if index is None:
+            if len(_rule_indexes) >= 16:
+                del _rule_indexes[next(iter(_rule_indexes))]
+            index = _rule_indexes[key] = RuleIndex(rules)
+        return index
+
+
+def invalidate_rule_indexes():
+    with _rule_index_lock:
+        _rule_indexes.clear()
+
+
+class ProfileMatcher:
+    """
+    Picks the on-spawn profile that best matches a window. Profile patterns are compiled up front,
+    and results are memoised by window title and executable, since a burst of spawned windows
+    tends to come from the same few processes.
+
+    The executable is only read if the title alone can't decide the result, since resolving it
+    for a live window means looking up the owning process.
+    """
 
+    MEMO_SIZE = 1024
 
-def apply_rules(rules: list[Rule], window: Window) -> bool:
+    def __init__(self, profiles: Iterable[dict]):
+        self.profiles: list[tuple[dict, Optional[Callable], Optional[Callable]]] = []
+        for profile in profiles:
+            if not profile.get('enabled', False):
+                continue
+            apply_to = profile.get('apply_to') or {}
+            name = apply_to.get('name', '') or None
+            exe = apply_to.get('executable', '') or None
+            if not name and not exe:
+                continue
+            self.profiles.append((profile, name and compile_match(name), exe and compile_match(exe)))
+        self._name_memo: dict[str, Optional[dict] | list[int]] = {}
+        """
+        Either the best profile for a title, or the title's score against each profile if the
+        executable is needed to decide
+        """
+        self._memo: dict[tuple[str, str], Optional[dict]] = {}
+        self._lock = threading.Lock()
+
+    def _by_name(self, name: str) -> Optional[dict] | list[int]:
+        scores = [name_matcher(name) if name_matcher else 0 for _, name_matcher, _ in self.profiles]
+        best, best_score, best_index = None, 0, len(self.profiles)
+        for index, ((profile, _, exe_matcher), score) in enumerate(zip(self.profiles, scores)):
+            if not exe_matcher and score > best_score:
+                best, best_score, best_index = profile, score, index
+        for index, ((_, _, exe_matcher), score) in enumerate(zip(self.profiles, scores)):
+            # an executable match scores at most 2, and earlier profiles win ties
+            if exe_matcher and (score + 2 > best_score or (score + 2 == best_score and index < best_index)):
+                return scores
+        return best
+
+    def find(self, window: Window | LazyWindow) -> Optional[dict]:
+        """
+        Returns:
+            The highest scoring profile for the window, or None if no profiles match.
+            If multiple profiles score the same, the first one is returned
+        """
+        name = window.name
+        with self._lock:
+            memo_hit = name in self._name_memo
+            result = self._name_memo.get(name)
+        if not memo_hit:
+            result = self._by_name(name)
+            with self._lock:
+                if len(self._name_memo) >= self.MEMO_SIZE:
+                    self._name_memo.clear()
+                self._name_memo[name] = result
+        if not isinstance(result, list):
+            return result
+
+        key = (name, window.executable)
+        with self._lock:
+            if key in self._memo:
+                return self._memo[key]
+
+        best, best_score = None, 0
+        for (profile, _, exe_matcher), score in zip(self.profiles, result):
+            if exe_matcher:
+                score += exe_matcher(key[1])
+            if score > best_score:
+                best, best_score = profile, score
+
+        with self._lock:
+            if len(self._memo) >= self.MEMO_SIZE:
+                self._memo.clear()
+            self._memo[key] = best
+        return best
+
+
+_profile_matcher: Optional[ProfileMatcher] = None
+_profile_matcher_lock = threading.Lock()
+
+
+def get_profile_matcher(on_spawn_settings: dict) -> ProfileMatcher:
+    """
+    Get the `ProfileMatcher` for the on-spawn settings, building it on first use.
+    Call `invalidate_profile_matcher` after the settings are changed.
+    """
+    global _profile_matcher
+    with _profile_matcher_lock:
+        if _profile_matcher is None:
+            _profile_matcher = ProfileMatcher(on_spawn_settings.get('profiles', []))
+        return _profile_matcher
+
+
+def invalidate_profile_matcher():
+    global _profile_matcher
+    with _profile_matcher_lock:
+        _profile_matcher = None
+
+
+def find_matching_rules(rules: Sequence[Rule] | RuleIndex, window: Window) -> Iterator[Rule]:
+    if not isinstance(rules, RuleIndex):
+        rules = get_rule_index(rules)
+    return iter(rules.find_matching(window))
+
+
+def apply_rules(rules: Sequence[Rule] | RuleIndex, window: Window, geometry: Optional[DisplayGeometry] = None) -> bool:
     """
     Returns:
         whether any rules were applied
     """
     matching = list(find_matching_rules(rules, window))
     for rule in matching:
-        window.set_pos(rule.rect, rule.placement)
+        window.set_pos(rule.rect, rule.placement, geometry)
     return len(matching) > 0
 
 
-def restore_snapshot(snap: list[Window], rules: Optional[list[Rule]] = None):
-    def callback(hwnd, extra):
-        if not is_window_valid(hwnd):
-            return
+def restore_snapshot(
+    snap: list[Window], rules: Optional[Sequence[Rule]] = None, geometry: Optional[DisplayGeometry] = None
+):
+    """
+    Move windows back to where they were in a snapshot, applying rules to any windows that aren't in it
 
-        window = Window.from_hwnd(hwnd)
-        for item in snap:
-            if item.rect == (0, 0, 0, 0):
-                return
+    Args:
+        snap: the windows to restore
+        rules: rules to apply to windows not in the snapshot
+        geometry: the current display geometry. If given, no geometry queries are made per window
+    """
 
-            if hwnd != item.id:
-                continue
+    def callback(hwnd, extra):
+        item = archived.get(hwnd)
+        if item is None and (blank or rule_index is None):
+            # nothing would be done to this window, so don't bother checking it
+            return
+        if not is_window_valid(hwnd, ctx):
+            return
 
-            if window.rect == item.rect:
+        handle = LazyWindow(hwnd, ctx)
+        if item is not None:
+            if handle.rect == item.rect:
                 return
 
-            try:
-                placement = item.placement
-            except KeyError:
-                placement = None
-
+            window = handle.resolve()
             log.info(f'restore window "{window.name}" {window.rect} -> {item.rect}')
-            window.set_pos(item.rect, placement)
+            window.set_pos(item.rect, item.placement, geometry)
             return
-        else:
-            if not rules:
-                return
-            for rule in find_matching_rules(rules, window):
-                log.info(f'apply rule "{rule.rule_name}" to "{window.name}"')
-                window.set_pos(rule.rect, rule.placement)
 
-    win32gui.EnumWindows(callback, None)
+        for rule in rule_index.find_matching(handle):  # type: ignore  # checked above
+            window = handle.resolve()
+            log.info(f'apply rule "{rule.rule_name}" to "{window.name}"')
+            window.set_pos(rule.rect, rule.placement, geometry)
+
+    # map hwnds to their archived windows. A blank rect marks the end of the usable part of the snapshot,
+    # after which no windows are restored and no rules are applied
+    archived: dict[int, Window] = {}
+    blank = False
+    for item in snap:
+        if item.rect == (0, 0, 0, 0):
+            blank = True
+            break
+        archived.setdefault(item.id, item)
+
+    rule_index = get_rule_index(rules) if rules else None
+    with CaptureContext() as ctx:
+        win32gui.EnumWindows(callback, None)
@@ -0,0 +1,108 @@
+import threading
+import time
+from typing import Callable
+
+import win32con
+import win32gui
+
+from services import Service
+from win32_extras import SetWinEventHook, UnhookWinEvent
+
+# https://learn.microsoft.com/en-us/windows/win32/winauto/event-constants
+EVENT_SYSTEM_MOVESIZEEND = 0x000B
+EVENT_SYSTEM_MINIMIZESTART = 0x0016
+EVENT_SYSTEM_MINIMIZEEND = 0x0017
+EVENT_OBJECT_CREATE = 0x8000
+EVENT_OBJECT_DESTROY = 0x8001
+EVENT_OBJECT_SHOW = 0x8002
+EVENT_OBJECT_HIDE = 0x8003
+EVENT_OBJECT_LOCATIONCHANGE = 0x800B
+EVENT_OBJECT_NAMECHANGE = 0x800C
+OBJID_WINDOW = 0
+CHILDID_SELF = 0
+
+EVENT_RANGES = (
+    (EVENT_SYSTEM_MOVESIZEEND, EVENT_SYSTEM_MOVESIZEEND),
+    (EVENT_SYSTEM_MINIMIZESTART, EVENT_SYSTEM_MINIMIZEEND),
+    (EVENT_OBJECT_CREATE, EVENT_OBJECT_HIDE),
+    (EVENT_OBJECT_LOCATIONCHANGE, EVENT_OBJECT_NAMECHANGE),
+)
+"""Ranges of window events that can affect a snapshot"""
+
+
+class DirtyWindowTracker:
+    """
+    Collects the hwnds of windows that have changed and releases them as a batch once no new events
+    have arrived for `quiet_period` seconds. Batches are also released `max_delay` seconds after the
+    first event, so that constant movement cannot postpone a capture forever.
+    """
+
+    def __init__(self, quiet_period: float = 1, max_delay: float = 10, clock: Callable[[], float] = time.monotonic):
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._dirty: set[int] = set()
+        self._first_event = 0.0
+        self._last_event = 0.0
+
+    def __len__(self):
+        return len(self._dirty)
+
+    def push(self, *hwnds: int):
+        """Mark one or more windows as dirty"""
+        now = self._clock()
+        with self._lock:
+            if not self._dirty:
+                self._first_event = now
+            self._dirty.update(hwnds)
+            self._last_event = now
+
+    def pop_ready(self) -> set[int]:
+        """
+        Returns:
+            The set of dirty hwnds if the batch is ready, otherwise an empty set
+        """
+        now = self._clock()
+        with self._lock:
+            if not self._dirty:
+                return set()
+            if now - self._last_event < self.quiet_period and now - self._first_event < self.max_delay:
+                return set()
+            dirty, self._dirty = self._dirty, set()
+            return dirty
+
+
+class WindowEventService(Service):
+    """
+    Listens for top-level windows being moved, resized, minimised, shown, hidden, renamed or destroyed
+    and passes the hwnd of each one to the default callback.
+    """
+
+    def _on_event(self, hook, event, hwnd, id_object, id_child, event_thread, event_time):
+        if not hwnd or id_object != OBJID_WINDOW or id_child != CHILDID_SELF:
+            return
+        try:
+            # only care about top-level windows. Destroyed windows can't be checked, so let them through
+            if event != EVENT_OBJECT_DESTROY and win32gui.GetAncestor(hwnd, win32con.GA_ROOT) != hwnd:
+                return
+            self._run_callback('default', hwnd)
+        except Exception:
+            self.log.exception(f'failed to handle window event {event:x} for hwnd {hwnd}')
+
+    def _runner(self):
+        # hooks must be registered on the thread that pumps the messages
+        hooks = []
+        for low, high in EVENT_RANGES:
+            hook, proc = SetWinEventHook(low, high, self._on_event)
+            if hook:
+                hooks.append((hook, proc))
+            else:
+                self.log.error(f'failed to register window event hook for events {low:x}-{high:x}')
+        self.log.debug(f'registered {len(hooks)} window event hooks')
+
+        while not self._kill_signal.wait(timeout=0.05):
+            win32gui.PumpWaitingMessages()
+
+        for hook, _ in hooks:
+            UnhookWinEvent(hook)
@@ -1,6 +1,11 @@
+import dataclasses
+import json
 import operator
+import random
 import re
 import sys
+import time
+import tracemalloc
 import types
 import typing
 from collections.abc import Iterable
@@ -19,6 +24,7 @@ from pytest import MonkeyPatch
 sys.path.insert(0, str((Path(__file__).parent / '../').resolve()))
 from src import common  # noqa:E402
 from src.common import Display, Rect, Rule, Snapshot, Window, WindowType  # noqa:E402
+from src.geometry import DisplayGeometry, Monitor  # noqa:E402
 
 
 def test_local_path(monkeypatch: MonkeyPatch):
@@ -225,6 +231,15 @@ class TestWindowType(TestJSONType):
         mocker.patch.object(sample_cls, 'get_border_and_shadow_thickness', Mock(spec=True, return_value=8))
         assert sample_cls.fits_display_config(displays) is True
 
+    def test_geometry_avoids_system_queries(self, sample_cls: WindowType, mocker: MockerFixture):
+        monitor_from_point = mocker.patch('win32api.MonitorFromPoint')
+        get_system_metrics = mocker.patch('win32api.GetSystemMetrics')
+        geometry = DisplayGeometry([Monitor(rect=(0, 0, 100, 100), work=(0, 0, 100, 90))], frame_thickness=8)
+        assert sample_cls.get_closest_display_rect((10, 10), geometry) == (0, 0, 100, 90)
+        assert WindowType.get_border_and_shadow_thickness(sample_cls, geometry) == 8
+        monitor_from_point.assert_not_called()
+        get_system_metrics.assert_not_called()
+
 
 class TestRule(TestWindowType):
     @pytest.fixture
@@ -287,6 +302,69 @@ class TestSnapshot(TestJSONType):
             window.executable = 'does-not-exist.exe'
             assert snapshots[0].last_known_process_instance(window) is None
 
+        def test_index_follows_history_changes(self, snapshots: list[Snapshot]):
+            snapshot = deepcopy(snapshots[0])
+            window = snapshot.history[-1].windows[0]
+            assert snapshot.last_known_process_instance(window) is window
+
+            newer = deepcopy(window)
+            snapshot.history[-1].windows.append(newer)
+            assert snapshot.last_known_process_instance(window) is newer
+
+            snapshot.history.append(common.WindowHistory(time=snapshot.history[-1].time + 1, windows=[window]))
+            assert snapshot.last_known_process_instance(window) is window
+
+            snapshot.history = snapshot.history[:1]
+            assert snapshot.last_known_process_instance(window) is newer
+
+        def test_matches_linear_search(self):
+            def reference(snapshot: Snapshot, window: Window, match_title: bool, match_resizability: bool):
+                def compare_titles(base: str, other: str):
+                    if base == other:
+                        return len(base.split()) + 1
+                    score = 0
+                    for a, b in zip(reversed(base.split()), reversed(other.split())):
+                        if a != b:
+                            return score
+                        score += 1
+                    return score
+
+                contenders = [
+                    w
+                    for h in reversed(snapshot.history)
+                    for w in reversed(h.windows)
+                    if w.executable == window.executable
+                    and (not match_resizability or w.resizable == window.resizable)
+                ]
+                if match_title:
+                    contenders.sort(key=lambda x: compare_titles(window.name, x.name), reverse=True)
+                return contenders[0] if contenders else None
+
+            rng = random.Random(42)
+            words = ['Inbox', '-', 'Email', 'Client', 'Web', 'Browser', 'Page']
+
+            def random_window(id: int) -> Window:
+                return Window.from_json(
+                    {
+                        **WINDOWS1[0],
+                        'id': id,
+                        'name': ' '.join(rng.choices(words, k=rng.randint(0, 4))),
+                        'executable': rng.choice(('a.exe', 'b.exe')),
+                        'resizable': rng.random() > 0.3,
+                    }
+                )  # type: ignore
+
+            snapshot = Snapshot()
+            for i in range(20):
+                snapshot.history.append(common.WindowHistory(time=i, windows=[random_window(j) for j in range(10)]))
+                for _ in range(20):
+                    window = random_window(-1)
+                    for match_title in (False, True):
+                        for match_resizability in (False, True):
+                            expected = reference(snapshot, window, match_title, match_resizability)
+                            actual = snapshot.last_known_process_instance(window, match_title, match_resizability)
+                            assert actual is expected
+
         class TestMatchTitleKwarg:
             @pytest.fixture
             def sample(self) -> Snapshot:
@@ -421,3 +499,241 @@ class TestSnapshot(TestJSONType):
                 squashable.squash_history()
             assert len(squashable.history) == 1
             assert greater == lesser, 'greater should have had dead windows pruned'
+
+        @staticmethod
+        def legacy_squash(snapshot: Snapshot, prune=True):
+            """The original nested-loop squash, for comparison"""
+
+            def should_keep(window: Window) -> bool:
+                if prune:
+                    return (
+                        win32gui.IsWindow(window.id) == 1
+                        and window.id in exe_by_id
+                        and window.executable == exe_by_id[window.id]
+                    )
+                return window.id not in exe_by_id or window.executable == exe_by_id[window.id]
+
+            index = len(snapshot.history) - 1
+            exe_by_id = {}
+            while index > 0:
+                for window in snapshot.history[index].windows:
+                    exe_by_id.setdefault(window.id, window.executable)
+                current = snapshot.history[index].windows = list(filter(should_keep, snapshot.history[index].windows))
+                previous = snapshot.history[index - 1].windows = list(
+                    filter(should_keep, snapshot.history[index - 1].windows)
+                )
+                if len(current) > len(previous):
+                    smaller, greater, to_pop = previous, current, index - 1
+                else:
+                    smaller, greater, to_pop = current, previous, index
+                for window_a in smaller:
+                    if window_a in greater:
+                        continue
+                    for window_b in greater:
+                        if (
+                            window_a.id == window_b.id
+                            and window_a.rect == window_b.rect
+                            and window_a.placement == window_b.placement
+                        ):
+                            break
+                    else:
+                        break
+                else:
+                    snapshot.history.pop(to_pop)
+                index -= 1
+
+        @staticmethod
+        def random_snapshot(rng: random.Random, captures: int, windows: int) -> Snapshot:
+            pool = [
+                Window.from_json({**WINDOWS1[0], 'id': rng.randint(1, windows), 'executable': rng.choice('ab')})
+                for _ in range(windows * 2)
+            ]
+            history = []
+            for t in range(captures):
+                capture = rng.sample(pool, rng.randint(0, windows))
+                for i in rng.sample(range(len(capture)), min(len(capture), 2)):
+                    capture[i] = dataclasses.replace(capture[i], rect=(t, t, t + 100, t + 100))
+                history.append(common.WindowHistory(time=t, windows=capture))
+            return Snapshot(history=history)  # type: ignore
+
+        @pytest.mark.parametrize('prune', (True, False))
+        @pytest.mark.parametrize('seed', range(20))
+        def test_matches_legacy_squash(self, seed: int, prune: bool):
+            rng = random.Random(seed)
+            snapshot = self.random_snapshot(rng, captures=8, windows=6)
+            expected = deepcopy(snapshot)
+            alive = set(rng.sample(range(1, 7), 4))
+            with patch.object(win32gui, 'IsWindow', Mock(side_effect=lambda h: int(h in alive))):
+                self.legacy_squash(expected, prune)
+                snapshot.squash_history(prune)
+            assert snapshot == expected
+
+        def test_benchmark(self):
+            # 50 captures of 200 windows, where each capture moves a few windows and shares the rest
+            rng = random.Random(0)
+            windows = [Window.from_json({**WINDOWS1[0], 'id': i, 'executable': f'{i % 20}.exe'}) for i in range(200)]
+            history = []
+            for t in range(50):
+                windows = list(windows)
+                for i in rng.sample(range(len(windows)), 3):
+                    windows[i] = dataclasses.replace(windows[i], rect=(t, t, t + 100, t + 100))
+                history.append(common.WindowHistory(time=t, windows=windows))
+            snapshot = Snapshot(history=history)  # type: ignore
+
+            is_window = Mock(return_value=1)
+            with patch.object(win32gui, 'IsWindow', is_window):
+                start = time.perf_counter()
+                snapshot.squash_history()
+                elapsed = time.perf_counter() - start
+            assert is_window.call_count == 200, 'each hwnd should only be checked once'
+            assert elapsed < 0.1
+
+
+@pytest.mark.parametrize('a', (None, 1, -1, 'abc', 'ABC', 'a.c', '(', 'C:\\Program Files\\app.exe'))
+@pytest.mark.parametrize('b', (None, 1, 'abc', 'abcd', 'xabc', '(', 'C:\\Program Files\\app.exe'))
+def test_compile_match(a, b):
+    assert common.compile_match(a)(b) == common.match(a, b)
+
+
+def test_display_fingerprint_ignores_order():
+    displays = [Display.from_json(d) for d in DISPLAYS1 + DISPLAYS2]
+    fingerprint = common.display_fingerprint(displays)
+    assert fingerprint == common.display_fingerprint(reversed(displays))
+    assert hash(fingerprint) == hash(common.display_fingerprint(reversed(displays)))
+    assert fingerprint != common.display_fingerprint(displays[:1])
+
+
+def test_revisioned():
+    history = common.WindowHistory(time=1)
+    revision = history.revision
+    history.windows = []
+    assert history.revision == revision + 1
+    history.windows.append(Window.from_json(WINDOWS1[0]))
+    assert history.revision == revision + 1, 'in-place changes are not tracked'
+    history.touch()
+    assert history.revision == revision + 2
+
+    snap = Snapshot(history=[history])
+    before = snap.content_revision()
+    history.time = 2
+    assert snap.content_revision() != before
+
+
+class TestInterner:
+    def test_shares_equal_values(self):
+        interner = common.Interner()
+        a, b = ''.join(['ab', 'c']), ''.join(['a', 'bc'])
+        assert a is not b
+        assert interner.intern(a) is a
+        assert interner.intern(b) is a
+        assert interner.intern((1, (2, 3))) is interner.intern((1, (2, 3)))
+
+    def test_distinguishes_types(self):
+        interner = common.Interner()
+        interner.intern((1, True))
+        assert type(interner.intern((1, 1))[1]) is int
+
+    def test_unhashable_and_bounded(self):
+        interner = common.Interner(max_size=2)
+        value = ([1],)
+        assert interner.intern(value) is value
+        for i in range(5):
+            interner.intern(str(i))
+        assert len(interner) <= 2
+
+    def test_from_json_memory(self, mocker: MockerFixture):
+        """Loading many captures of the same windows should use much less memory with interning"""
+        history = [{'time': i, 'windows': WINDOWS1 + WINDOWS2} for i in range(200)]
+        # round trip through JSON so that every string is a separate object, like when loading from disk
+        data = json.loads(json.dumps({'history': history}))
+
+        def measure():
+            common.interner.clear()
+            tracemalloc.start()
+            try:
+                snap = Snapshot.from_json(data)
+                return tracemalloc.get_traced_memory()[0], snap
+            finally:
+                tracemalloc.stop()
+
+        interned, snap = measure()
+        windows = [w for h in snap.history for w in h.windows]
+        assert windows[0].executable is windows[len(WINDOWS1) + len(WINDOWS2)].executable
+        del snap, windows
+        mocker.patch.object(common.interner, 'intern', side_effect=lambda v: v)
+        baseline, _ = measure()
+        assert interned < baseline * 0.75, f'{interned=} {baseline=}'
+
+
+class TestDisplayMatcher:
+    @pytest.fixture
+    def displays(self) -> list[Display]:
+        return [Display.from_json(d) for d in DISPLAYS1 + DISPLAYS2]
+
+    def test_matcher_is_cached(self, displays: list[Display], mocker: MockerFixture):
+        compile_match = mocker.spy(common, 'compile_match')
+        display = displays[0]
+        assert display.matches_config(displays)
+        assert display.matches_config(displays)
+        assert compile_match.call_count == 2, 'uid and name should only be compiled once'
+
+    @pytest.mark.parametrize('ops,expected', ((['eq', 'eq'], False), (['ge', 'le'], True), (['lt', 'eq'], False)))
+    def test_invalidate_on_edit(self, ops, expected):
+        pattern = Display(uid='', name='', resolution=(1920, 1080), rect=(0, 0, 1920, 1080))
+        target = Display(uid='', name='', resolution=(2560, 1080), rect=(0, 0, 2560, 1080))
+        assert pattern.matches(target) is False
+        pattern.set_res(0, 1000)
+        pattern.comparison_params['resolution'] = ops
+        pattern.invalidate_matcher()
+        assert pattern.matches(target) is expected
+
+    def test_equivalent_to_legacy(self, displays: list[Display]):
+        def legacy_matches(a: Display, b: Display):
+            if b.uid and not common.match(a.uid, b.uid):
+                return False
+            if b.name and not common.match(a.name, b.name):
+                return False
+            for index, metric in enumerate(zip(b.resolution, a.resolution)):
+                if 0 in metric:
+                    continue
+                op = a.comparison_params.get('resolution', ('eq', 'eq'))[index]
+                if not common.str_to_op(op)(*metric):
+                    return False
+            return True
+
+        displays.append(Display(uid='.*', name=None, resolution=(0, 1080), rect=(0, 0, 0, 0)))
+        for a in displays:
+            for b in displays:
+                assert a.matches(b) == legacy_matches(a, b)
+
+    def test_not_serialised(self, displays: list[Display]):
+        display = displays[0]
+        display.get_matcher()
+        assert '_matcher' not in dataclasses.asdict(display)
+        assert deepcopy(display) == display
+
+
+class TestCaptureContext:
+    def test_memoises_queries(self):
+        func = Mock(return_value=(1, 2, 3, 4))
+        ctx = common.CaptureContext()
+        assert ctx.query(func, 1) == (1, 2, 3, 4)
+        assert ctx.query(func, 1) == (1, 2, 3, 4)
+        ctx.query(func, 2)
+        ctx.query(func, 2, 'extra arg')
+        assert func.call_count == 3
+
+    def test_does_not_cache_exceptions(self):
+        func = Mock(side_effect=[ValueError, 'ok'])
+        ctx = common.CaptureContext()
+        with pytest.raises(ValueError):
+            ctx.query(func, 1)
+        assert ctx.query(func, 1) == 'ok'
+
+    def test_current(self):
+        assert common.CaptureContext.current() is not common.CaptureContext.current()
+        with common.CaptureContext() as outer:
+            assert common.CaptureContext.current() is outer
+            with common.CaptureContext() as inner:
+                assert common.CaptureContext.current() is inner
+            assert common.CaptureContext.current() is outer
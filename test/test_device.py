@@ -0,0 +1,44 @@
+import sys
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+import win32con
+
+sys.path.insert(0, str((Path(__file__).parent / '../src').resolve()))
+from src import device  # noqa:E402
+
+
+class TestDeviceChangeService:
+    @pytest.fixture
+    def callback(self):
+        return device.DeviceChangeCallback(default=Mock(), display_change=Mock())
+
+    @pytest.fixture
+    def service(self, callback: device.DeviceChangeCallback):
+        return device.DeviceChangeService(callback)
+
+    def test_display_change_restores(self, service: device.DeviceChangeService, callback):
+        service.callback(0, win32con.WM_DISPLAYCHANGE, 0, 0)
+        callback.display_change.assert_called_once()
+        callback.default.assert_called_once()
+
+    @pytest.mark.parametrize(
+        'msg,wp',
+        (
+            (win32con.WM_SETTINGCHANGE, win32con.SPI_SETWORKAREA),
+            (win32con.WM_SETTINGCHANGE, win32con.SPI_SETNONCLIENTMETRICS),
+            (win32con.WM_SETTINGCHANGE, device.SPI_SETLOGICALDPIOVERRIDE),
+            (device.WM_DPICHANGED, 0x00600060),
+        ),
+        ids=['work-area', 'non-client-metrics', 'dpi-override', 'dpi-changed'],
+    )
+    def test_geometry_change_invalidates_only(self, service: device.DeviceChangeService, callback, msg, wp):
+        service.callback(0, msg, wp, 0)
+        callback.display_change.assert_called_once()
+        callback.default.assert_not_called()
+
+    def test_other_settings_ignored(self, service: device.DeviceChangeService, callback):
+        service.callback(0, win32con.WM_SETTINGCHANGE, 0, 0)
+        callback.display_change.assert_not_called()
+        callback.default.assert_not_called()
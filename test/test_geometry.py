@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str((Path(__file__).parent / '../src').resolve()))
+from src.geometry import DisplayGeometry, Monitor, rect_fits  # noqa:E402
+
+LEFT = Monitor(rect=(-1920, 0, 0, 1080), work=(-1920, 0, 0, 1040), dpi=96)
+PRIMARY = Monitor(rect=(0, 0, 2560, 1440), work=(0, 0, 2560, 1400), dpi=144)
+ABOVE = Monitor(rect=(0, -1080, 1920, 0), work=(0, -1080, 1920, 0), dpi=120)
+
+
+@pytest.fixture
+def geometry():
+    return DisplayGeometry((PRIMARY, LEFT, ABOVE), frame_thickness=8)
+
+
+class TestMonitorFromPoint:
+    @pytest.mark.parametrize(
+        'point,expected',
+        (
+            ((0, 0), PRIMARY),
+            ((2559, 1439), PRIMARY),
+            ((-1, 0), LEFT),
+            ((100, -1), ABOVE),
+            # right and bottom edges are exclusive
+            ((0, 1440), PRIMARY),
+            ((2560, 0), PRIMARY),
+        ),
+    )
+    def test_on_screen(self, geometry: DisplayGeometry, point, expected):
+        assert geometry.monitor_from_point(point) is expected
+
+    @pytest.mark.parametrize(
+        'point,expected', (((-3000, 500), LEFT), ((5000, 500), PRIMARY), ((100, -5000), ABOVE), ((-100, -100), LEFT))
+    )
+    def test_off_screen_picks_nearest(self, geometry: DisplayGeometry, point, expected):
+        assert geometry.monitor_from_point(point) is expected
+
+    def test_no_monitors(self):
+        geometry = DisplayGeometry(())
+        assert geometry.monitor_from_point((0, 0)) is None
+        assert geometry.work_area((0, 0)) is None
+        assert geometry.dpi((0, 0)) == 96
+        assert not geometry
+
+
+def test_work_area_and_dpi(geometry: DisplayGeometry):
+    assert geometry.work_area((-10, 10)) == LEFT.work
+    assert geometry.dpi((10, 10)) == 144
+
+
+def test_fits(geometry: DisplayGeometry):
+    assert geometry.fits((-8, -8, 2568, 1448))
+    assert not geometry.fits((-8, -8, 2568, 1448), offset=0)
+    assert not geometry.fits((-100, 0, 100, 100)), 'should not fit when spanning monitors'
+
+
+def test_rect_fits():
+    assert rect_fits((0, 0, 10, 10), (0, 0, 10, 10))
+    assert not rect_fits((-1, 0, 10, 10), (0, 0, 10, 10))
+    assert rect_fits((-1, 0, 10, 11), (0, 0, 10, 10), offset=1)
@@ -0,0 +1,216 @@
+import json
+import sys
+from dataclasses import asdict
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from test.conftest import DISPLAYS1, DISPLAYS2, RULES1, WINDOWS1, WINDOWS2
+
+sys.path.insert(0, str((Path(__file__).parent / '../src').resolve()))
+from src import journal as journal_module  # noqa:E402
+from src.common import Rule, Snapshot, Window, WindowHistory  # noqa:E402
+from src.journal import HistoryJournal  # noqa:E402
+
+
+@pytest.fixture
+def journal(tmp_path: Path) -> HistoryJournal:
+    return HistoryJournal(str(tmp_path / 'history.json'), str(tmp_path / 'history.journal'))
+
+
+@pytest.fixture
+def snapshots() -> list[Snapshot]:
+    return [
+        Snapshot.from_json({'displays': DISPLAYS1, 'history': [{'time': 1, 'windows': WINDOWS1}]}),
+        Snapshot.from_json({'displays': DISPLAYS2, 'history': [{'time': 2, 'windows': WINDOWS2}], 'rules': RULES1}),
+        Snapshot(phony='Global'),
+    ]
+
+
+def load(journal: HistoryJournal) -> list[dict]:
+    return HistoryJournal(journal.base_file, journal.file).load()
+
+
+def as_json(snapshots: list[Snapshot]) -> list[dict]:
+    return json.loads(json.dumps([asdict(s) for s in snapshots]))
+
+
+def save(journal: HistoryJournal, snapshots: list[Snapshot]) -> list[dict]:
+    records = journal.diff(snapshots)
+    journal.append(records)
+    return records
+
+
+def test_round_trip(journal: HistoryJournal, snapshots: list[Snapshot]):
+    save(journal, snapshots)
+    assert load(journal) == as_json(snapshots)
+
+
+def test_no_changes(journal: HistoryJournal, snapshots: list[Snapshot]):
+    save(journal, snapshots)
+    size = journal.size
+    assert save(journal, snapshots) == []
+    assert journal.size == size
+
+
+def test_capture_only_writes_new_entry(journal: HistoryJournal, snapshots: list[Snapshot]):
+    save(journal, snapshots)
+    windows = [Window.from_json(w) for w in WINDOWS1]
+    snapshots[0].history.append(WindowHistory(time=3, windows=windows))
+
+    records = save(journal, snapshots)
+    delta = list(range(len(WINDOWS1)))
+    assert records == [
+        {'op': 'history', 'index': 0, 'times': [1, 3], 'entries': [{'time': 3, 'base': 1, 'delta': delta}]}
+    ]
+    assert load(journal) == as_json(snapshots)
+
+
+def test_squash_and_prune(journal: HistoryJournal, snapshots: list[Snapshot]):
+    snapshots[0].history.append(WindowHistory(time=3, windows=[Window.from_json(w) for w in WINDOWS2]))
+    save(journal, snapshots)
+    snapshots[0].history.pop(0)
+    snapshots[0].history[0].windows = snapshots[0].history[0].windows[1:]
+
+    save(journal, snapshots)
+    assert load(journal) == as_json(snapshots)
+
+
+def test_edit_rules(journal: HistoryJournal, snapshots: list[Snapshot]):
+    save(journal, snapshots)
+    snapshots[2].rules.append(Rule.from_json(RULES1[0]))
+    snapshots[1].rules[0].rule_name = 'edited'
+
+    records = save(journal, snapshots)
+    assert [r['op'] for r in records] == ['meta', 'meta']
+    assert load(journal) == as_json(snapshots)
+
+
+def test_layouts_removed_and_reordered(journal: HistoryJournal, snapshots: list[Snapshot]):
+    save(journal, snapshots)
+    layout = Snapshot(phony='Layout', displays=snapshots[1].displays)
+    snapshots[:] = [snapshots[0], snapshots[2], layout]
+
+    records = save(journal, snapshots)
+    assert [r['op'] for r in records] == ['truncate', 'snapshot', 'snapshot']
+    assert load(journal) == as_json(snapshots)
+
+
+def test_compact(journal: HistoryJournal, snapshots: list[Snapshot]):
+    save(journal, snapshots)
+    journal.compact(journal.checkpoint(snapshots))
+    assert journal.size == 0
+    assert not Path(journal.file).exists()
+    assert not Path(journal.old_file).exists()
+
+    snapshots[0].mru = 1
+    save(journal, snapshots)
+    assert load(journal) == as_json(snapshots)
+
+
+def test_failed_append_not_lost(journal: HistoryJournal, snapshots: list[Snapshot], mocker: MockerFixture):
+    save(journal, snapshots)
+    snapshots[0].mru = 1
+    mocker.patch('builtins.open', side_effect=OSError)
+    with pytest.raises(OSError):
+        save(journal, snapshots)
+    mocker.stopall()
+
+    snapshots[1].mru = 2
+    records = save(journal, snapshots)
+    assert [record['index'] for record in records] == [0, 1]
+    assert load(journal) == as_json(snapshots)
+
+
+def test_failed_compaction_not_lost(journal: HistoryJournal, snapshots: list[Snapshot], mocker: MockerFixture):
+    save(journal, snapshots)
+    snapshots[0].mru = 1
+    records = journal.diff(snapshots)
+    checkpoint = journal.checkpoint(snapshots)
+    journal.append(records)
+    mocker.patch.object(journal_module, 'write_json', side_effect=OSError)
+    with pytest.raises(OSError):
+        journal.compact(checkpoint)
+    mocker.stopall()
+
+    snapshots[1].mru = 2
+    save(journal, snapshots)
+    assert load(journal) == as_json(snapshots)
+
+
+def test_base_file_versioned(journal: HistoryJournal, snapshots: list[Snapshot]):
+    journal.compact(journal.checkpoint(snapshots))
+    with open(journal.base_file) as f:
+        assert json.load(f)['version'] == journal_module.FORMAT_VERSION
+    assert load(journal) == as_json(snapshots)
+
+
+def test_legacy_base_file(journal: HistoryJournal, snapshots: list[Snapshot]):
+    with open(journal.base_file, 'w') as f:
+        json.dump([asdict(s) for s in snapshots], f)
+    assert load(journal) == as_json(snapshots)
+
+
+def test_newer_base_file_set_aside(journal: HistoryJournal, snapshots: list[Snapshot]):
+    version = journal_module.FORMAT_VERSION + 1
+    save(journal, snapshots)
+    with open(journal.base_file, 'w') as f:
+        json.dump({'version': version, 'snapshots': []}, f)
+
+    assert load(journal) == []
+    assert not Path(journal.base_file).exists()
+    assert not Path(journal.file).exists()
+    assert Path(f'{journal.base_file}.v{version}').exists()
+    assert Path(f'{journal.file}.v{version}').exists()
+
+
+def test_interrupted_compaction(journal: HistoryJournal, snapshots: list[Snapshot]):
+    """If a compaction dies after writing the base file, the old journal is replayed again on top of it"""
+    save(journal, snapshots)
+    Path(journal.file).rename(journal.old_file)
+    with open(journal.base_file, 'w') as f:
+        json.dump([asdict(s) for s in snapshots], f)
+    assert load(journal) == as_json(snapshots)
+
+
+def test_malformed_tail(journal: HistoryJournal, snapshots: list[Snapshot]):
+    save(journal, snapshots)
+    with open(journal.file, 'a') as f:
+        f.write('{"op": "truncate", "len')
+    assert load(journal) == as_json(snapshots)
+
+
+class TestDeltaEncoding:
+    @pytest.fixture
+    def history(self) -> list[WindowHistory]:
+        windows = [Window.from_json(w) for w in WINDOWS1 + WINDOWS2]
+        history = []
+        for i in range(25):
+            windows = windows.copy()
+            # move a window, close a window and open a new one
+            windows[i % len(windows)] = Window.from_json({**WINDOWS1[0], 'rect': (i, i, 100, 100)})
+            windows.pop(0)
+            windows.append(Window.from_json({**WINDOWS2[0], 'id': 1000 + i}))
+            history.append(WindowHistory(time=i, windows=windows))
+        return history
+
+    def test_round_trip(self, history: list[WindowHistory]):
+        encoded = json.loads(json.dumps(journal_module.encode_history(history)))
+        assert ['delta' not in e for e in encoded] == [i % journal_module.KEYFRAME_INTERVAL == 0 for i in range(25)]
+        decoded = journal_module.decode_history(encoded)
+        assert decoded == json.loads(json.dumps([asdict(h) for h in history]))
+
+    def test_unchanged_windows_shared(self, history: list[WindowHistory]):
+        encoded = json.loads(json.dumps(journal_module.encode_history(history)))
+        snapshot = Snapshot.from_json({'history': journal_module.decode_history(encoded)}, memo={})
+        assert snapshot.history[2].windows[-2] is snapshot.history[1].windows[-1]
+
+    def test_smaller_than_full(self, history: list[WindowHistory]):
+        full = len(json.dumps([asdict(h) for h in history]))
+        encoded = len(json.dumps(journal_module.encode_history(history)))
+        assert encoded < full / 3
+
+    def test_missing_base(self):
+        history = [{'time': 2, 'base': 1, 'delta': [0]}, {'time': 3, 'windows': []}]
+        assert journal_module.decode_history(history) == [{'time': 3, 'windows': []}]
@@ -0,0 +1,76 @@
+import sys
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+sys.path.insert(0, str((Path(__file__).parent / '../src').resolve()))
+from src import process  # noqa:E402
+
+
+class TestProcessCache:
+    @pytest.fixture
+    def cache(self, mocker: MockerFixture):
+        self.create_times = {1: 100.0, 2: 200.0}
+        mocker.patch('src.process.get_create_time', new=lambda pid: self.create_times.get(pid))
+        resolver = process.InMemoryResolver({1: 'C:\\proc1.exe', 2: 'C:\\proc2.exe', 3: 'C:\\proc3.exe'})
+        self.query = mocker.spy(resolver, '_resolve')
+        return process.ProcessCache(resolver)
+
+    def test_hits_after_first_lookup(self, cache: process.ProcessCache):
+        assert cache.get_executable(1) == 'C:\\proc1.exe'
+        assert cache.get_executable(1) == 'C:\\proc1.exe'
+        assert self.query.call_count == 1
+        assert cache.stats.hits == 1
+        assert cache.stats.misses == 1
+
+    def test_recycled_pid_is_evicted(self, cache: process.ProcessCache):
+        cache.get_executable(1)
+        self.create_times[1] = 150.0
+        cache.get_executable(1)
+        assert self.query.call_count == 2, 'new process with same PID should be re-queried'
+        assert cache.stats.evictions == 1
+
+    def test_prune(self, cache: process.ProcessCache):
+        cache.get_executable(1)
+        cache.get_executable(2)
+        cache.prune(alive=[2])
+        assert len(cache) == 1
+        assert cache.stats.evictions == 1
+
+    def test_does_not_cache_unknown_create_time(self, cache: process.ProcessCache):
+        cache.get_executable(3)
+        cache.get_executable(3)
+        assert self.query.call_count == 2
+        assert len(cache) == 0
+
+    def test_bulk_lookup_queries_once(self, cache: process.ProcessCache):
+        cache.get_executable(1)
+        assert cache.get_executables([1, 2, 2]) == {1: 'C:\\proc1.exe', 2: 'C:\\proc2.exe'}
+        assert self.query.call_count == 2
+        assert self.query.call_args.args[0] == {2}, 'should only query uncached processes'
+
+
+class TestResolverChain:
+    def test_falls_through_to_next_resolver(self):
+        first = process.InMemoryResolver({1: 'first.exe'})
+        second = process.InMemoryResolver({1: 'second.exe', 2: 'second.exe'})
+        chain = process.ResolverChain((first, second))
+        assert chain.resolve([1, 2, 3]) == {1: 'first.exe', 2: 'second.exe'}
+        assert first.stats.failures == 2
+        assert second.stats.resolved == 1
+        assert second.stats.failures == 1
+
+    def test_stops_once_all_resolved(self, mocker: MockerFixture):
+        first = process.InMemoryResolver({1: 'first.exe'})
+        second = process.InMemoryResolver({})
+        spy = mocker.spy(second, '_resolve')
+        process.ResolverChain((first, second)).resolve([1])
+        spy.assert_not_called()
+
+    def test_resolver_errors_count_as_failures(self, mocker: MockerFixture):
+        resolver = process.InMemoryResolver({})
+        mocker.patch.object(resolver, '_resolve', side_effect=RuntimeError)
+        assert resolver.resolve([1, 2]) == {}
+        assert resolver.stats.calls == 1
+        assert resolver.stats.failures == 2
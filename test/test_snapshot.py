@@ -0,0 +1,274 @@
+import sys
+import threading
+import time
+from dataclasses import asdict
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+import win32con
+from pytest_mock import MockerFixture
+
+from test.conftest import DISPLAYS1, DISPLAYS2, WINDOWS1
+
+sys.path.insert(0, str((Path(__file__).parent / '../src').resolve()))
+from src import device, snapshot  # noqa:E402
+from src.common import Display, Rule, Snapshot, Window, WindowHistory  # noqa:E402
+from src.geometry import DisplayGeometry, Monitor  # noqa:E402
+
+
+class TestAdaptiveInterval:
+    def test_backs_off_when_idle(self):
+        interval = snapshot.AdaptiveInterval(base=5, ceiling=30)
+        assert [interval.next(False) for _ in range(4)] == [10, 20, 30, 30]
+
+    def test_resets_on_change(self):
+        interval = snapshot.AdaptiveInterval(base=5, ceiling=30)
+        interval.next(False)
+        interval.next(False)
+        assert interval.next(True) == 5
+
+    def test_ceiling_below_base(self):
+        interval = snapshot.AdaptiveInterval(base=60, ceiling=30)
+        assert interval.next(False) == 60, 'should never go faster than base frequency'
+
+
+class TestDisplayCache:
+    def test_enumerates_once_until_invalidated(self, mocker: MockerFixture):
+        enum = mocker.patch('src.snapshot.enum_display_devices', return_value=['display'])
+        cache = snapshot.DisplayCache()
+        assert cache.get() == ['display']
+        assert cache.get() == ['display']
+        assert enum.call_count == 1
+        cache.invalidate()
+        assert cache.version == 1
+        cache.get()
+        assert enum.call_count == 2
+
+    def test_empty_result_not_cached(self, mocker: MockerFixture):
+        enum = mocker.patch('src.snapshot.enum_display_devices', return_value=[])
+        cache = snapshot.DisplayCache()
+        cache.get()
+        cache.get()
+        assert enum.call_count == 2
+
+    def test_work_area_change_affects_rebound(self, mocker: MockerFixture):
+        # taskbar moves from the bottom of the screen to the top
+        work_areas = iter([(0, 0, 1920, 1040), (0, 40, 1920, 1080)])
+        mocker.patch(
+            'src.snapshot.get_display_geometry',
+            side_effect=lambda: DisplayGeometry([Monitor(rect=(0, 0, 1920, 1080), work=next(work_areas))]),
+        )
+        cache = snapshot.DisplayCache()
+        service = device.DeviceChangeService(
+            device.DeviceChangeCallback(default=Mock(), display_change=cache.invalidate)
+        )
+        window = Window.from_json(WINDOWS1[0])
+
+        assert window.rebound((0, 0, 100, 100), geometry=cache.get_geometry()) == (0, 0, 100, 100)
+        service.callback(0, win32con.WM_SETTINGCHANGE, win32con.SPI_SETWORKAREA, 0)
+        assert window.rebound((0, 0, 100, 100), geometry=cache.get_geometry()) == (0, 40, 100, 100)
+
+
+class TestSnapshotFile:
+    @pytest.fixture
+    def snapshot_file(self, mocker: MockerFixture, tmp_path):
+        mocker.patch('src.snapshot.local_path', side_effect=lambda path: str(tmp_path / path))
+        return snapshot.SnapshotFile()
+
+    def test_find_snapshot(self, snapshot_file: snapshot.SnapshotFile):
+        displays = [Display.from_json(d) for d in DISPLAYS1 + DISPLAYS2]
+        snap = Snapshot(displays=displays)
+        snapshot_file.data.append(Snapshot(displays=displays[:1]))
+        snapshot_file.data.append(snap)
+        snapshot_file.data.append(Snapshot(displays=displays, phony='Layout'))
+        snapshot_file.rebuild_index()
+        assert snapshot_file.find_snapshot(list(reversed(displays))) is snap
+        assert snapshot_file.find_snapshot(displays[1:]) is None
+
+    def test_find_snapshot_after_direct_edit(self, snapshot_file: snapshot.SnapshotFile):
+        displays = [Display.from_json(d) for d in DISPLAYS1]
+        snapshot_file.data.append(Snapshot(displays=displays))
+        assert snapshot_file.find_snapshot(displays) is not None
+        snapshot_file.data[-1].displays = [Display.from_json(d) for d in DISPLAYS2]
+        assert snapshot_file.find_snapshot(displays) is None
+
+    def test_get_rules_cached_until_changed(self, snapshot_file: snapshot.SnapshotFile, mocker: MockerFixture):
+        displays = [Display.from_json(d) for d in DISPLAYS1]
+        rule = Rule(size=(0, 0), rect=(1, 1, 2, 2), placement=(0, 1, (-1, -1), (-1, -1), (1, 1, 2, 2)))
+        current = Snapshot(displays=displays)
+        layout = Snapshot(displays=displays, phony='Layout', rules=[rule])
+        snapshot_file.data.extend((current, layout))
+        mocker.patch.object(snapshot_file, 'get_current_snapshot', return_value=current)
+        mocker.patch('src.snapshot.display_cache')
+        fits = mocker.patch.object(Rule, 'fits_display_config', return_value=True)
+
+        rules = snapshot_file.get_rules(compatible_with=True, exclusive=True)
+        assert rules == (rule,)
+        assert snapshot_file.get_rules(compatible_with=True, exclusive=True) is rules
+        assert fits.call_count == 1
+
+        snapshot_file.rules_changed()
+        assert snapshot_file.get_rules(compatible_with=True, exclusive=True) == (rule,)
+        assert fits.call_count == 2
+
+    def test_save_and_reload(self, snapshot_file: snapshot.SnapshotFile):
+        displays = [Display.from_json(d) for d in DISPLAYS1]
+        snapshot_file.data.append(Snapshot(displays=displays, phony='Layout'))
+        snapshot_file.save()
+        snapshot_file.data[-1].mru = 1
+        snapshot_file.save()
+        assert snapshot_file.flush(timeout=5)
+
+        reloaded = snapshot.SnapshotFile()
+        assert list(map(asdict, reloaded.data)) == list(map(asdict, snapshot_file.data))
+
+    def test_reload_shares_unchanged_windows(self, snapshot_file: snapshot.SnapshotFile):
+        windows = [Window.from_json(w) for w in WINDOWS1]
+        history = [WindowHistory(time=1, windows=windows), WindowHistory(time=2, windows=windows[1:])]
+        snapshot_file.data.append(Snapshot(displays=[Display.from_json(d) for d in DISPLAYS1], history=history))
+        snapshot_file.compact()
+
+        reloaded = snapshot.SnapshotFile().data[-1].history
+        assert len(reloaded[0].windows) == len(WINDOWS1)
+        assert all(a is b for a, b in zip(reloaded[1].windows, reloaded[0].windows[1:]))
+
+    def test_concurrent_updates(self, snapshot_file: snapshot.SnapshotFile, mocker: MockerFixture):
+        displays = [Display.from_json(d) for d in DISPLAYS1]
+        mocker.patch.object(snapshot.display_cache, 'get', return_value=displays)
+        mocker.patch.object(snapshot_file, 'save')
+        mocker.patch.object(snapshot_file, 'prune_history')
+        active, overlaps = [0], []
+
+        def slow_capture(hwnds=None):
+            active[0] += 1
+            overlaps.append(active[0] > 1)
+            time.sleep(0.05)
+            active[0] -= 1
+            return [Window.from_json(w) for w in WINDOWS1], True
+
+        mocker.patch.object(snapshot_file._capture, 'capture', new=slow_capture)
+        threads = [threading.Thread(target=snapshot_file.update, args=(hwnds,)) for hwnds in (None, [1])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert overlaps == [False, False]
+        history = snapshot_file.find_snapshot(displays).history
+        assert len(history) == 2
+        assert history[0].time <= history[1].time
+
+    def test_update_during_restore_does_not_deadlock(
+        self, snapshot_file: snapshot.SnapshotFile, mocker: MockerFixture
+    ):
+        displays = [Display.from_json(d) for d in DISPLAYS1]
+        mocker.patch.object(snapshot.display_cache, 'get', return_value=displays)
+        mocker.patch.object(snapshot_file, 'save')
+        mocker.patch.object(snapshot_file, 'prune_history')
+        capturing = threading.Event()
+
+        def slow_capture(hwnds=None):
+            capturing.set()
+            time.sleep(0.1)
+            return [Window.from_json(w) for w in WINDOWS1], True
+
+        mocker.patch.object(snapshot_file._capture, 'capture', new=slow_capture)
+
+        def restore():
+            # same as `restore` being called for a new display config
+            capturing.wait()
+            with snapshot_file.lock:
+                snapshot_file.get_current_snapshot()
+
+        threads = [
+            threading.Thread(target=snapshot_file.update, daemon=True),
+            threading.Thread(target=restore, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+        assert not any(thread.is_alive() for thread in threads)
+        assert snapshot_file.find_snapshot(displays) is not None
+
+    def test_compacts_journal(self, snapshot_file: snapshot.SnapshotFile):
+        snapshot_file.journal.max_size = 1
+        snapshot_file.data.append(Snapshot(phony='Layout'))
+        snapshot_file.save()
+        assert snapshot_file.flush(timeout=5)
+        assert snapshot_file.journal.size > 0
+        snapshot_file.data[-1].mru = 1
+        snapshot_file.save()
+        assert snapshot_file.flush(timeout=5)
+        assert snapshot_file.journal.size == 0
+
+        reloaded = snapshot.SnapshotFile()
+        assert list(map(asdict, reloaded.data)) == list(map(asdict, snapshot_file.data))
+
+
+class TestSnapshotWriter:
+    @pytest.fixture
+    def snapshot_file(self, mocker: MockerFixture, tmp_path):
+        mocker.patch('src.snapshot.local_path', side_effect=lambda path: str(tmp_path / path))
+        snapshot_file = snapshot.SnapshotFile()
+        yield snapshot_file
+        snapshot_file.writer.stop()
+
+    def test_coalesces_requests(self, snapshot_file: snapshot.SnapshotFile, mocker: MockerFixture):
+        append = mocker.spy(snapshot_file.journal, 'append')
+        for _ in range(10):
+            snapshot_file.save()
+        assert snapshot_file.flush(timeout=5)
+        assert append.call_count == 1
+        assert snapshot_file.writer.writes == 1
+
+    def test_save_does_not_block(self, snapshot_file: snapshot.SnapshotFile, mocker: MockerFixture):
+        written = threading.Event()
+        mocker.patch.object(snapshot_file.journal, 'append', side_effect=lambda _: written.wait(5))
+        snapshot_file.writer.delay = 0
+        start = time.perf_counter()
+        snapshot_file.save()
+        snapshot_file.save()
+        assert time.perf_counter() - start < 0.5
+        assert not snapshot_file.flush(timeout=0.1)
+        written.set()
+        assert snapshot_file.flush(timeout=5)
+
+    def test_skips_unchanged(self, snapshot_file: snapshot.SnapshotFile, mocker: MockerFixture):
+        request = mocker.spy(snapshot_file.writer, 'request')
+        snapshot_file.save()
+        snapshot_file.save()
+        assert request.call_count == 1
+        assert snapshot_file.skipped_writes == 1
+
+        snapshot_file.data[0].mru = 1
+        snapshot_file.save()
+        snapshot_file.data[0].history.append(snapshot.WindowHistory(time=1))
+        snapshot_file.data[0].touch()
+        snapshot_file.save()
+        snapshot_file.rules_changed()
+        snapshot_file.save()
+        assert request.call_count == 4
+        assert snapshot_file.skipped_writes == 1
+
+    def test_compacts_after_failure(self, snapshot_file: snapshot.SnapshotFile, mocker: MockerFixture):
+        compact = mocker.spy(snapshot_file.journal, 'compact')
+        mocker.patch.object(snapshot_file.journal, 'append', side_effect=OSError)
+        snapshot_file.save()
+        assert snapshot_file.flush(timeout=5)
+        assert snapshot_file.writer.writes == 0
+
+        mocker.patch.object(snapshot_file.journal, 'append')
+        snapshot_file.data[0].mru = 1
+        snapshot_file.save()
+        assert snapshot_file.flush(timeout=5)
+        assert compact.call_count == 1
+        assert list(map(asdict, snapshot.SnapshotFile().data)) == list(map(asdict, snapshot_file.data))
+
+    def test_flush_after_stop(self, snapshot_file: snapshot.SnapshotFile):
+        snapshot_file.close()
+        snapshot_file.data.append(Snapshot(phony='Layout'))
+        snapshot_file.save()
+        assert snapshot_file.flush(timeout=5)
+        assert [s.phony for s in snapshot.SnapshotFile().data] == [s.phony for s in snapshot_file.data]
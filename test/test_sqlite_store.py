@@ -0,0 +1,349 @@
+import json
+import random
+import sqlite3
+import sys
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from test.conftest import DISPLAYS1, DISPLAYS2, RULES1, WINDOWS1, WINDOWS2
+
+sys.path.insert(0, str((Path(__file__).parent / '../src').resolve()))
+from src import snapshot  # noqa:E402
+from src.common import Display, Rule, Snapshot, Window, WindowHistory, display_fingerprint  # noqa:E402
+from src.journal import HistoryJournal  # noqa:E402
+from src.sqlite_store import SCHEMA_VERSION, SqliteHistoryStore  # noqa:E402
+
+
+@pytest.fixture
+def store(tmp_path: Path):
+    store = SqliteHistoryStore(
+        str(tmp_path / 'history.db'), str(tmp_path / 'history.json'), str(tmp_path / 'history.journal')
+    )
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def snapshots() -> list[Snapshot]:
+    return [
+        Snapshot.from_json({'displays': DISPLAYS1, 'history': [{'time': 1, 'windows': WINDOWS1}]}),
+        Snapshot.from_json({'displays': DISPLAYS2, 'history': [{'time': 2, 'windows': WINDOWS2}], 'rules': RULES1}),
+        Snapshot(phony='Global'),
+    ]
+
+
+def as_json(snapshots: list[Snapshot]) -> list[dict]:
+    return json.loads(json.dumps([asdict(s) for s in snapshots]))
+
+
+def save(store: SqliteHistoryStore, snapshots: list[Snapshot]):
+    store.append(store.diff(snapshots))
+
+
+def reload(store: SqliteHistoryStore) -> list[dict]:
+    other = SqliteHistoryStore(store.db_file, store.base_file, store.file)
+    try:
+        return other.load()
+    finally:
+        other.close()
+
+
+def test_round_trip(store: SqliteHistoryStore, snapshots: list[Snapshot]):
+    save(store, snapshots)
+    assert reload(store) == as_json(snapshots)
+
+
+def test_captures(store: SqliteHistoryStore, snapshots: list[Snapshot]):
+    save(store, snapshots)
+    windows = [Window.from_json(w) for w in WINDOWS1]
+    snapshots[0].history.append(WindowHistory(time=3, windows=windows[1:]))
+    snapshots[0].history.append(WindowHistory(time=4, windows=windows[2:] + [Window.from_json(WINDOWS2[0])]))
+    save(store, snapshots)
+    assert reload(store) == as_json(snapshots)
+
+    # squash and prune
+    snapshots[0].history.pop(1)
+    snapshots[0].history[0].windows = snapshots[0].history[0].windows[:-1]
+    save(store, snapshots)
+    assert reload(store) == as_json(snapshots)
+
+
+def test_windows_stored_once(store: SqliteHistoryStore, snapshots: list[Snapshot]):
+    windows = snapshots[0].history[0].windows
+    snapshots[0].history.extend(WindowHistory(time=t, windows=windows) for t in range(2, 10))
+    save(store, snapshots)
+    count = store._db.execute('SELECT COUNT(*) FROM windows').fetchone()[0]
+    assert count == len(WINDOWS1) + len(WINDOWS2)
+
+    snapshots[0].history = []
+    save(store, snapshots)
+    count = store._db.execute('SELECT COUNT(*) FROM windows').fetchone()[0]
+    assert count == len(WINDOWS2), 'unused windows should be removed'
+
+
+def test_edit_rules_and_layouts(store: SqliteHistoryStore, snapshots: list[Snapshot]):
+    save(store, snapshots)
+    snapshots[2].rules.append(Rule.from_json(RULES1[0]))
+    snapshots[1].rules[0].rule_name = 'edited'
+    save(store, snapshots)
+    assert reload(store) == as_json(snapshots)
+
+    snapshots[:] = [snapshots[0], snapshots[2], Snapshot(phony='Layout', displays=snapshots[1].displays)]
+    save(store, snapshots)
+    assert reload(store) == as_json(snapshots)
+
+
+def test_indexes(store: SqliteHistoryStore):
+    indexes = {row[0] for row in store._db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert indexes >= {
+        'snapshots_position',
+        'snapshots_fingerprint',
+        'captures_time',
+        'captures_age',
+        'capture_windows_window',
+        'windows_executable',
+        'windows_hwnd',
+    }
+
+
+@pytest.mark.parametrize(
+    'lookup,index',
+    (
+        (lambda store: store.find_snapshot(display_fingerprint([])), 'snapshots_fingerprint'),
+        (lambda store: store.find_capture(0, 1), 'captures_time'),
+        (lambda store: store.find_expired(1, 10), 'captures_age'),
+        (lambda store: store.find_process_instances(0, 'a.exe'), 'windows_executable'),
+        (lambda store: store.find_snapshots_with_windows([1]), 'windows_hwnd'),
+    ),
+    ids=['fingerprint', 'capture', 'capture-time', 'executable', 'hwnd'],
+)
+def test_lookups_use_indexes(store: SqliteHistoryStore, snapshots: list[Snapshot], lookup, index: str):
+    save(store, snapshots)
+    statements = []
+    store._db.set_trace_callback(statements.append)
+    lookup(store)
+    store._db.set_trace_callback(None)
+
+    plans = [row[-1] for statement in statements for row in store._db.execute(f'EXPLAIN QUERY PLAN {statement}')]
+    assert any(index in plan for plan in plans), plans
+
+
+class TestQueries:
+    def test_find_snapshot(self, store: SqliteHistoryStore, snapshots: list[Snapshot]):
+        snapshots.append(Snapshot(displays=snapshots[1].displays, phony='Layout'))
+        snapshots.append(Snapshot(displays=snapshots[1].displays))
+        save(store, snapshots)
+        assert store.find_snapshot(display_fingerprint(snapshots[0].displays)) == 0
+        assert store.find_snapshot(display_fingerprint(snapshots[1].displays)) == 1
+        assert store.find_snapshot(display_fingerprint([])) is None
+
+    def test_find_capture(self, store: SqliteHistoryStore, snapshots: list[Snapshot]):
+        windows = snapshots[0].history[0].windows
+        snapshots[0].history.extend(WindowHistory(time=t, windows=windows) for t in (3, 5))
+        save(store, snapshots)
+        assert store.find_capture(0) == 2
+        assert store.find_capture(0, 3) == 1
+        assert store.find_capture(0, 4) is None
+        assert store.find_capture(2) is None
+
+    def test_find_layouts_with_rules(self, store: SqliteHistoryStore, snapshots: list[Snapshot]):
+        snapshots.append(Snapshot(phony='Layout', rules=[Rule.from_json(RULES1[0])]))
+        snapshots.append(Snapshot(phony='Empty layout'))
+        save(store, snapshots)
+        assert store.find_layouts_with_rules() == [3]
+
+    def test_find_process_instances(self, store: SqliteHistoryStore, snapshots: list[Snapshot]):
+        windows = snapshots[0].history[0].windows
+        snapshots[0].history.append(WindowHistory(time=3, windows=windows[:1]))
+        save(store, snapshots)
+        executable = windows[0].executable
+        expected = [
+            (c, i)
+            for c, entry in reversed(list(enumerate(snapshots[0].history)))
+            for i, window in reversed(list(enumerate(entry.windows)))
+            if window.executable == executable
+        ]
+        assert store.find_process_instances(0, executable) == expected
+        assert store.find_process_instances(0, 'does-not-exist.exe') == []
+
+    def test_find_expired(self, store: SqliteHistoryStore, snapshots: list[Snapshot]):
+        snapshots[1].history.append(WindowHistory(time=10, windows=snapshots[1].history[0].windows))
+        save(store, snapshots)
+        first, second = (display_fingerprint(s.displays) for s in snapshots[:2])
+        assert store.find_expired(None, 10) == set()
+        assert store.find_expired(None, 1) == {second}
+        assert store.find_expired(2, 10) == {first}
+        assert store.find_expired(5, 1) == {first, second}
+
+    def test_find_windows(self, store: SqliteHistoryStore, snapshots: list[Snapshot]):
+        snapshots[1].history[0].windows.append(Window.from_json({**WINDOWS2[0], 'id': 100}))
+        save(store, snapshots)
+        assert store.find_window_ids() == {w['id'] for w in WINDOWS1 + WINDOWS2} | {100}
+        assert store.find_snapshots_with_windows([100]) == {display_fingerprint(snapshots[1].displays)}
+        assert store.find_snapshots_with_windows([WINDOWS1[0]['id']]) == {
+            display_fingerprint(s.displays) for s in snapshots[:2]
+        }
+        assert store.find_snapshots_with_windows([]) == set()
+
+
+def test_schema_upgrade(store: SqliteHistoryStore, snapshots: list[Snapshot]):
+    save(store, snapshots)
+    store._db.execute('PRAGMA user_version = 0')
+    # the schema from before the lookups were indexed
+    store._db.execute('DROP INDEX windows_executable')
+    store._db.execute('ALTER TABLE windows DROP COLUMN executable')
+    store.close()
+
+    upgraded = SqliteHistoryStore(store.db_file, store.base_file, store.file)
+    try:
+        assert upgraded._db.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+        assert upgraded.load() == as_json(snapshots)
+        assert upgraded.find_process_instances(0, WINDOWS1[0]['executable']) != []
+    finally:
+        upgraded.close()
+
+
+def test_newer_schema_set_aside(tmp_path: Path):
+    db_file = str(tmp_path / 'history.db')
+    with sqlite3.connect(db_file) as db:
+        db.execute(f'PRAGMA user_version = {SCHEMA_VERSION + 1}')
+    db.close()
+    store = SqliteHistoryStore(db_file, str(tmp_path / 'history.json'), str(tmp_path / 'history.journal'))
+    store.close()
+    assert (tmp_path / f'history.db.v{SCHEMA_VERSION + 1}').exists()
+
+
+def test_migrate_from_json(store: SqliteHistoryStore, snapshots: list[Snapshot]):
+    journal = HistoryJournal(store.base_file, store.file)
+    journal.compact(journal.checkpoint(snapshots[:2]))
+    journal.append(journal.diff(snapshots))
+
+    assert store.load() == as_json(snapshots)
+    assert reload(store) == as_json(snapshots)
+    # the JSON files are left alone so that the JSON backend can still be selected
+    assert HistoryJournal(store.base_file, store.file).load() == as_json(snapshots)
+
+
+@pytest.fixture
+def settings(mocker: MockerFixture) -> dict:
+    settings = {'history_backend': 'sqlite'}
+    mocker.patch('src.snapshot.load_json', return_value=settings)
+    return settings
+
+
+def test_snapshot_file_backend(mocker: MockerFixture, tmp_path: Path, settings: dict):
+    mocker.patch('src.snapshot.local_path', side_effect=lambda path: str(tmp_path / path))
+
+    snapshot_file = snapshot.SnapshotFile()
+    assert type(snapshot_file.journal).__name__ == 'SqliteHistoryStore'
+    snapshot_file.data.append(Snapshot(phony='Layout'))
+    snapshot_file.close()
+
+    reloaded = snapshot.SnapshotFile()
+    assert [s.phony for s in reloaded.data] == ['Global', 'Layout']
+    assert not (tmp_path / 'history.json').exists()
+    reloaded.close()
+
+
+class TestSnapshotFileQueries:
+    @pytest.fixture
+    def snapshot_file(self, mocker: MockerFixture, tmp_path: Path, settings: dict):
+        mocker.patch('src.snapshot.local_path', side_effect=lambda path: str(tmp_path / path))
+        snapshot_file = snapshot.SnapshotFile()
+        yield snapshot_file
+        snapshot_file.close()
+
+    @pytest.fixture
+    def current(self, snapshot_file: snapshot.SnapshotFile, mocker: MockerFixture) -> Snapshot:
+        displays = [Display.from_json(d) for d in DISPLAYS1]
+        windows = [Window.from_json(w) for w in WINDOWS1]
+        current = Snapshot(displays=displays, history=[WindowHistory(time=t, windows=windows) for t in (1, 2, 3)])
+        snapshot_file.data.append(current)
+        mocker.patch.object(snapshot.display_cache, 'get', return_value=displays)
+        mocker.patch.object(snapshot.display_cache, 'get_geometry', return_value=None)
+        return current
+
+    def test_restore(self, snapshot_file: snapshot.SnapshotFile, current: Snapshot, mocker: MockerFixture):
+        restore = mocker.patch('src.snapshot.restore_snapshot')
+        find_capture = mocker.spy(snapshot_file.store, 'find_capture')
+
+        snapshot_file.restore(2)
+        assert restore.call_args.args[0] is current.history[1].windows
+        assert current.mru == 2
+        snapshot_file.restore(-1)
+        assert restore.call_args.args[0] is current.history[2].windows
+        current.history[1].windows = []
+        snapshot_file.restore()
+        assert restore.call_args.args[0] == []
+        assert find_capture.call_count == 3
+
+    def test_get_rules(self, snapshot_file: snapshot.SnapshotFile, current: Snapshot, mocker: MockerFixture):
+        mocker.patch.object(Rule, 'fits_display_config', return_value=True)
+        rules = [Rule.from_json(r) for r in RULES1]
+        snapshot_file.data.append(Snapshot(displays=current.displays, phony='Layout', rules=rules[:1]))
+        snapshot_file.data.append(Snapshot(displays=current.displays, phony='Empty layout'))
+        snapshot_file.data.append(
+            Snapshot(displays=[Display.from_json(d) for d in DISPLAYS2], phony='Other', rules=rules[1:])
+        )
+        find_layouts = mocker.spy(snapshot_file.store, 'find_layouts_with_rules')
+
+        assert snapshot_file.get_rules(compatible_with=True, exclusive=True) == tuple(rules[:1])
+        find_layouts.assert_called_once()
+
+    def test_last_known_process_instance(self, snapshot_file: snapshot.SnapshotFile, current: Snapshot):
+        rng = random.Random(42)
+        words = ['Inbox', '-', 'Email', 'Client', 'Web', 'Browser', 'Page']
+
+        def random_window(id: int) -> Window:
+            return Window.from_json(
+                {
+                    **WINDOWS1[0],
+                    'id': id,
+                    'name': ' '.join(rng.choices(words, k=rng.randint(0, 4))),
+                    'executable': rng.choice(('a.exe', 'b.exe')),
+                    'resizable': rng.random() > 0.3,
+                }
+            )  # type: ignore
+
+        current.history = [WindowHistory(time=t, windows=[random_window(i) for i in range(10)]) for t in range(5)]
+        for _ in range(50):
+            window = random_window(-1)
+            for match_title in (False, True):
+                for match_resizability in (False, True):
+                    expected = current.last_known_process_instance(window, match_title, match_resizability)
+                    actual = snapshot_file.last_known_process_instance(window, match_title, match_resizability)
+                    assert actual is expected
+
+    def test_prune_history(
+        self, snapshot_file: snapshot.SnapshotFile, current: Snapshot, settings: dict, mocker: MockerFixture
+    ):
+        now = time.time()
+        windows = [Window.from_json({**w, 'id': w['id'] + 100}) for w in WINDOWS2]
+        stale = Snapshot(
+            displays=[Display.from_json(d) for d in DISPLAYS2],
+            history=[WindowHistory(time=now - 1000, windows=windows), WindowHistory(time=now, windows=windows[:1])],
+        )
+        current.history = [WindowHistory(time=now, windows=current.history[0].windows)]
+        snapshot_file.data.append(stale)
+        snapshot_file.rebuild_index()
+        snapshot_file.save()
+        snapshot_file.flush()
+        cleanup = mocker.spy(Snapshot, 'cleanup')
+
+        settings.update(prune_history=False, window_history_ttl=100)
+        snapshot_file.prune_history()
+        assert [call.args[0] for call in cleanup.call_args_list] == [stale]
+        assert all(now - entry.time <= 100 for entry in stale.history)
+
+        cleanup.reset_mock()
+        dead = WINDOWS1[0]['id']
+        mocker.patch('win32gui.IsWindow', side_effect=lambda hwnd: int(hwnd != dead))
+        settings.update(prune_history=True)
+        snapshot_file.save()
+        snapshot_file.flush()
+        snapshot_file.prune_history()
+        assert [call.args[0] for call in cleanup.call_args_list] == [current]
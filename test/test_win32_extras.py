@@ -0,0 +1,18 @@
+import sys
+from ctypes.wintypes import HANDLE
+from pathlib import Path
+
+sys.path.insert(0, str((Path(__file__).parent / '../src').resolve()))
+from src import win32_extras  # noqa:E402
+
+
+def test_win_event_hook_handles_not_truncated():
+    assert win32_extras.user32.SetWinEventHook.restype is HANDLE
+    assert win32_extras.user32.SetWinEventHook.argtypes[3] is win32_extras.WinEventProc
+    assert win32_extras.user32.UnhookWinEvent.argtypes == (HANDLE,)
+
+
+def test_process_handles_not_truncated():
+    assert win32_extras.kernel32.OpenProcess.restype is HANDLE
+    assert win32_extras.kernel32.QueryFullProcessImageNameW.argtypes[0] is HANDLE
+    assert win32_extras.kernel32.CloseHandle.argtypes == (HANDLE,)
@@ -1,6 +1,9 @@
 import dataclasses
 import sys
+import threading
+import time
 from pathlib import Path
+from unittest.mock import Mock, PropertyMock
 
 import pytest
 import win32con
@@ -67,3 +70,326 @@ class TestFindMatchingRules:
             window.find_matching_rules(rule_cls, window_cls)
         except TypeError as e:
             pytest.fail(f'should not raise {e!r}')
+
+    @pytest.mark.parametrize(
+        'executable',
+        (None, '', 'notepad', 'NOTEPAD', 'C:\\Windows\\notepad.exe', 'C:\\Program Files\\app.exe', '.*pad.exe$'),
+    )
+    def test_matches_same_as_match(self, executable):
+        placement = (0, 1, (-1, -1), (-1, -1), (0, 0, 0, 0))
+        window_cls = common.Window(
+            id=1,
+            name='Untitled - Notepad',
+            executable='C:\\Windows\\notepad.exe',
+            size=(0, 0),
+            rect=(0, 0, 0, 0),
+            placement=placement,
+        )
+        rules = [
+            common.Rule(size=(0, 0), rect=(0, 0, 0, 0), placement=placement, name=name, executable=exe)
+            for name in (None, 'untitled', 'Untitled - Notepad', 'other')
+            for exe in (executable, 'other.exe')
+        ]
+        expected = []
+        for rule in rules:
+            scores = [common.match(rule.name, window_cls.name), common.match(rule.executable, window_cls.executable)]
+            if all(scores):
+                expected.append((-sum(s for s, v in zip(scores, (rule.name, rule.executable)) if v), rule))
+        expected = [r for _, r in sorted(expected, key=lambda e: e[0])]
+        assert [id(r) for r in window.RuleIndex(rules).find_matching(window_cls)] == [id(r) for r in expected]
+
+    def test_best_match_first(self, window_cls: common.Window):
+        geometry = {'size': window_cls.size, 'rect': window_cls.rect, 'placement': window_cls.placement}
+        partial = common.Rule(**geometry, executable='.*')
+        exact = common.Rule(**geometry, executable=window_cls.executable)
+        assert list(window.find_matching_rules([partial, exact], window_cls)) == [exact, partial]
+
+    def test_executable_only_read_when_needed(self, window_cls: common.Window):
+        geometry = {'size': window_cls.size, 'rect': window_cls.rect, 'placement': window_cls.placement}
+        handle = Mock(spec=['name', 'executable'])
+        handle.name = 'Untitled - Notepad'
+        type(handle).executable = executable = PropertyMock(return_value='notepad.exe')
+        unfiltered = common.Rule(**geometry, name='Untitled')
+        index = window.RuleIndex([unfiltered, common.Rule(**geometry, name='other', executable='notepad.exe')])
+        assert index.find_matching(handle) == [unfiltered]
+        executable.assert_not_called()
+
+        index = window.RuleIndex([unfiltered, common.Rule(**geometry, executable='notepad.exe')])
+        assert len(index.find_matching(handle)) == 2
+        executable.assert_called_once()
+
+    def test_index_is_cached_until_invalidated(self, rule_cls: common.Rule):
+        rules = [rule_cls]
+        index = window.get_rule_index(rules)
+        assert window.get_rule_index(list(rules)) is index
+        window.invalidate_rule_indexes()
+        assert window.get_rule_index(rules) is not index
+
+
+class TestProfileMatcher:
+    @pytest.fixture
+    def profiles(self):
+        return [
+            {'name': 'disabled', 'enabled': False, 'apply_to': {'name': '.*'}},
+            {'name': 'partial', 'enabled': True, 'apply_to': {'name': 'Untitled', 'executable': ''}},
+            {'name': 'exact', 'enabled': True, 'apply_to': {'name': '', 'executable': 'notepad.exe'}},
+            {'name': 'no filter', 'enabled': True, 'apply_to': {}},
+        ]
+
+    @pytest.fixture
+    def notepad(self, window_cls: common.Window):
+        return dataclasses.replace(window_cls, name='Untitled - Notepad', executable='notepad.exe')
+
+    def test_best_score_wins(self, profiles, notepad: common.Window):
+        assert window.ProfileMatcher(profiles).find(notepad)['name'] == 'exact'
+
+    def test_no_match(self, profiles, notepad: common.Window):
+        notepad.name = notepad.executable = 'other'
+        assert window.ProfileMatcher(profiles).find(notepad) is None
+
+    def test_memoised(self, profiles, notepad: common.Window):
+        matcher = window.ProfileMatcher(profiles)
+        profile, name_matcher, exe_matcher = matcher.profiles[0]
+        spy = Mock(wraps=name_matcher)
+        matcher.profiles[0] = (profile, spy, exe_matcher)
+        matcher.find(notepad)
+        matcher.find(dataclasses.replace(notepad, id=notepad.id + 1))
+        assert spy.call_count == 1
+
+    def test_executable_only_read_when_needed(self, profiles):
+        handle = Mock(spec=['name', 'executable'])
+        type(handle).executable = executable = PropertyMock(return_value='notepad.exe')
+        handle.name = 'Untitled - Notepad'
+        assert window.ProfileMatcher(profiles[:2]).find(handle)['name'] == 'partial'
+        executable.assert_not_called()
+
+        # an executable match could outscore a partial title match
+        assert window.ProfileMatcher(profiles).find(handle)['name'] == 'exact'
+        executable.assert_called_once()
+
+    def test_same_as_scoring_every_profile(self):
+        patterns = (None, 'Untitled', 'Untitled - Notepad', 'other', 'notepad.exe', '.*')
+        profiles = [
+            {'name': f'{name}|{exe}', 'enabled': True, 'apply_to': {'name': name, 'executable': exe}}
+            for name in patterns
+            for exe in patterns
+        ]
+        for count in range(1, len(profiles), 5):
+            for offset in range(0, len(profiles), 7):
+                subset = (profiles[offset:] + profiles[:offset])[:count]
+                matcher = window.ProfileMatcher(subset)
+                for title in ('Untitled - Notepad', 'other'):
+                    for exe in ('notepad.exe', 'other.exe'):
+                        handle = Mock(spec=['name', 'executable'], executable=exe)
+                        handle.name = title
+                        expected, best_score = None, 0
+                        for profile in subset:
+                            apply_to = profile['apply_to']
+                            score = sum(
+                                common.match(pattern, value)
+                                for pattern, value in ((apply_to['name'], title), (apply_to['executable'], exe))
+                                if pattern
+                            )
+                            if score > best_score:
+                                expected, best_score = profile, score
+                        assert matcher.find(handle) is expected
+
+
+class TestCloakCache:
+    @pytest.fixture
+    def cache(self, mocker: MockerFixture):
+        self.states = {1: 0, 2: 2, 3: 2}
+        self.desktop_ids = {2: 'desktop-2', 3: 'null'}
+        mocker.patch('src.window.get_dwm_cloak_state', new=lambda h: self.states[h])
+        mocker.patch('src.window.GUID', new=lambda: 'null')
+        self.pyvda = mocker.patch('src.window.pyvda')
+        self.pyvda.AppView.side_effect = lambda hwnd: Mock(desktop_id=self.desktop_ids[hwnd])
+        self.pyvda.get_virtual_desktops.return_value = [Mock(id='desktop-1'), Mock(id='desktop-2')]
+        self.pyvda.VirtualDesktop.current.return_value = Mock(id='desktop-1')
+        self.now = 0.0
+        return window.CloakCache(clock=lambda: self.now)
+
+    def test_uncloaked_windows_skip_com(self, cache: window.CloakCache):
+        assert cache.is_cloaked(1) is False
+        self.pyvda.AppView.assert_not_called()
+
+    def test_windows_on_other_desktops_are_not_cloaked(self, cache: window.CloakCache):
+        assert cache.is_cloaked(2) is False
+        assert cache.is_cloaked(3) is True
+
+    def test_caches_results(self, cache: window.CloakCache):
+        cache.is_cloaked(2)
+        cache.is_cloaked(3)
+        cache.is_cloaked(2)
+        assert self.pyvda.AppView.call_count == 2
+        assert self.pyvda.get_virtual_desktops.call_count == 1
+
+    def test_cloak_state_change_invalidates(self, cache: window.CloakCache):
+        cache.is_cloaked(2)
+        self.states[2] = 1
+        cache.is_cloaked(2)
+        assert self.pyvda.AppView.call_count == 2
+
+    def test_desktop_switch_invalidates(self, cache: window.CloakCache):
+        cache.check_desktop_switch()
+        cache.is_cloaked(2)
+        cache.check_desktop_switch()
+        cache.is_cloaked(2)
+        assert self.pyvda.AppView.call_count == 1
+        self.pyvda.VirtualDesktop.current.return_value = Mock(id='desktop-2')
+        cache.check_desktop_switch()
+        cache.is_cloaked(2)
+        assert self.pyvda.AppView.call_count == 2
+
+    def test_lookups_check_desktop_switch_periodically(self, cache: window.CloakCache):
+        cache.is_cloaked(1)
+        self.pyvda.VirtualDesktop.current.assert_not_called()
+        for _ in range(10):
+            cache.is_cloaked(2)
+        assert self.pyvda.VirtualDesktop.current.call_count == 1
+
+        self.pyvda.VirtualDesktop.current.return_value = Mock(id='desktop-2')
+        self.now += cache.desktop_check_interval
+        cache.is_cloaked(2)
+        assert self.pyvda.VirtualDesktop.current.call_count == 2
+        assert self.pyvda.AppView.call_count == 2
+
+    def test_errors_not_cached(self, cache: window.CloakCache):
+        self.pyvda.AppView.side_effect = Exception
+        assert cache.is_cloaked(2) is True
+        self.pyvda.AppView.side_effect = lambda hwnd: Mock(desktop_id=self.desktop_ids[hwnd])
+        assert cache.is_cloaked(2) is False
+
+    def test_prune(self, cache: window.CloakCache):
+        cache.is_cloaked(2)
+        cache.is_cloaked(3)
+        cache.prune([3])
+        cache.is_cloaked(2)
+        cache.is_cloaked(3)
+        assert self.pyvda.AppView.call_count == 3
+
+
+class TestIncrementalCapture:
+    @pytest.fixture
+    def fake_windows(self, mocker: MockerFixture):
+        signatures = {
+            1: ((0, 0, 100, 100), (0, 1, (-1, -1), (-1, -1), (0, 0, 100, 100)), 'Window 1', 0),
+            2: ((100, 100, 200, 200), (0, 1, (-1, -1), (-1, -1), (100, 100, 200, 200)), 'Window 2', 0),
+        }
+        mocker.patch('win32gui.EnumWindows', new=lambda cb, extra: [cb(h, extra) for h in list(signatures)])
+        mocker.patch('win32process.GetWindowThreadProcessId', new=lambda h: (0, h))
+        mocker.patch('src.window.is_window_valid', return_value=True)
+        mocker.patch('src.window.get_window_signature', new=lambda h, ctx=None: signatures[h])
+        mocker.patch.object(window.process_cache, 'get_executables', new=lambda pids: {p: f'{p}.exe' for p in pids})
+        mocker.patch.object(window.process_cache, 'prune')
+        return signatures
+
+    def test_first_capture_is_changed(self, fake_windows):
+        windows, changed = window.IncrementalCapture().capture()
+        assert changed is True
+        assert [w.id for w in windows] == [1, 2]
+        assert windows[0].executable == '1.exe'
+
+    def test_reuses_unchanged_windows(self, fake_windows):
+        capture = window.IncrementalCapture()
+        first, _ = capture.capture()
+        second, changed = capture.capture()
+        assert changed is False
+        assert all(a is b for a, b in zip(first, second))
+
+    def test_refetches_changed_windows(self, fake_windows: dict):
+        capture = window.IncrementalCapture()
+        first, _ = capture.capture()
+        rect, placement, _, style = fake_windows[2]
+        fake_windows[2] = (rect, placement, 'New title', style)
+        second, changed = capture.capture()
+        assert changed is True
+        assert second[0] is first[0]
+        assert second[1] is not first[1]
+        assert second[1].name == 'New title'
+
+    def test_closed_windows_are_changes(self, fake_windows: dict):
+        capture = window.IncrementalCapture()
+        capture.capture()
+        del fake_windows[1]
+        windows, changed = capture.capture()
+        assert changed is True
+        assert [w.id for w in windows] == [2]
+
+    def test_only_rechecks_given_hwnds(self, fake_windows: dict, mocker: MockerFixture):
+        capture = window.IncrementalCapture()
+        first, _ = capture.capture()
+        fake_windows[3] = ((0, 0, 50, 50), (0, 1, (-1, -1), (-1, -1), (0, 0, 50, 50)), 'Window 3', 0)
+        enum = mocker.patch('win32gui.EnumWindows')
+        windows, changed = capture.capture([3])
+        enum.assert_not_called()
+        assert changed is True
+        assert [w.id for w in windows] == [1, 2, 3]
+        assert windows[0] is first[0]
+
+    def test_concurrent_captures_are_serialised(self, fake_windows: dict, mocker: MockerFixture):
+        capture = window.IncrementalCapture()
+        capture.capture()
+        active, overlaps = [0], []
+        original = capture._capture
+
+        def slow_capture(*args):
+            active[0] += 1
+            overlaps.append(active[0] > 1)
+            time.sleep(0.05)
+            try:
+                return original(*args)
+            finally:
+                active[0] -= 1
+
+        mocker.patch.object(capture, '_capture', new=slow_capture)
+        fake_windows[3] = ((0, 0, 50, 50), (0, 1, (-1, -1), (-1, -1), (0, 0, 50, 50)), 'Window 3', 0)
+        threads = [threading.Thread(target=capture.capture, args=(hwnds,)) for hwnds in ([1], [3])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert overlaps == [False, False]
+        windows, changed = capture.capture()
+        assert changed is False
+        assert [w.id for w in windows] == [1, 2, 3]
+
+
+class TestRestoreSnapshot:
+    @pytest.fixture
+    def live(self, mocker: MockerFixture):
+        rects = {1: (0, 0, 100, 100), 2: (50, 50, 150, 150), 3: (0, 0, 10, 10)}
+        mocker.patch('win32gui.EnumWindows', new=lambda cb, extra: [cb(h, extra) for h in list(rects)])
+        mocker.patch('win32gui.GetWindowRect', new=lambda h: rects[h])
+        mocker.patch('win32gui.GetWindowText', new=lambda h: f'Window {h}')
+        mocker.patch('win32process.GetWindowThreadProcessId', new=lambda h: (0, h))
+        self.is_window_valid = mocker.patch('src.window.is_window_valid', return_value=True)
+        self.get_executable = mocker.patch.object(
+            window.process_cache, 'get_executable', side_effect=lambda pid: f'{pid}.exe'
+        )
+        self.set_pos = mocker.patch.object(window.Window, 'set_pos', autospec=True)
+        return rects
+
+    def archived(self, hwnd: int, rect: common.Rect) -> common.Window:
+        placement = (0, 1, (-1, -1), (-1, -1), rect)
+        return common.Window(id=hwnd, name='', executable='', size=(0, 0), rect=rect, placement=placement)
+
+    def test_only_moves_changed_windows(self, live):
+        window.restore_snapshot([self.archived(1, live[1]), self.archived(2, (0, 0, 1, 1))])
+        assert [(c.args[0].id, c.args[1]) for c in self.set_pos.call_args_list] == [(2, (0, 0, 1, 1))]
+        assert self.is_window_valid.call_count == 2, 'windows not in the snapshot should be skipped'
+        self.get_executable.assert_not_called()
+
+    def test_blank_rect_stops_restore(self, live):
+        rule = common.Rule(size=(0, 0), rect=(1, 1, 2, 2), placement=(0, 1, (-1, -1), (-1, -1), (1, 1, 2, 2)))
+        window.restore_snapshot([self.archived(2, (0, 0, 1, 1)), self.archived(0, (0, 0, 0, 0))], [rule])
+        assert [c.args[0].id for c in self.set_pos.call_args_list] == [2]
+
+    def test_rules_resolve_executable(self, live):
+        rule = common.Rule(
+            size=(0, 0), rect=(1, 1, 2, 2), placement=(0, 1, (-1, -1), (-1, -1), (1, 1, 2, 2)), executable='3.exe'
+        )
+        window.restore_snapshot([self.archived(1, (0, 0, 1, 1))], [rule])
+        assert [c.args[0].id for c in self.set_pos.call_args_list] == [1, 3]
+        assert self.get_executable.call_count == 2, 'should only resolve windows that are matched against rules'
@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str((Path(__file__).parent / '../src').resolve()))
+from src import window_events  # noqa:E402
+
+
+class TestDirtyWindowTracker:
+    @pytest.fixture
+    def clock(self):
+        self.now = 0.0
+        return lambda: self.now
+
+    @pytest.fixture
+    def tracker(self, clock):
+        return window_events.DirtyWindowTracker(quiet_period=1, max_delay=5, clock=clock)
+
+    def test_empty(self, tracker: window_events.DirtyWindowTracker):
+        self.now = 100
+        assert tracker.pop_ready() == set()
+
+    def test_waits_for_quiet_period(self, tracker: window_events.DirtyWindowTracker):
+        tracker.push(1)
+        self.now = 0.5
+        tracker.push(2, 1)
+        self.now = 1
+        assert tracker.pop_ready() == set(), 'should wait until no events have arrived for quiet period'
+        self.now = 1.5
+        assert tracker.pop_ready() == {1, 2}
+        assert len(tracker) == 0
+        assert tracker.pop_ready() == set()
+
+    def test_max_delay(self, tracker: window_events.DirtyWindowTracker):
+        # constant stream of events should not postpone capture forever
+        for i in range(11):
+            self.now = i * 0.5
+            tracker.push(i)
+        assert tracker.pop_ready() == set(range(11))